@@ -0,0 +1,84 @@
+'''Measure how lexing throughput scales with threads.
+
+Runs the same batch of documents through a ThreadPoolExecutor with an
+increasing number of workers. On a regular CPython build the GIL keeps
+this near 1x; on a free-threaded build (python3.13t and later) it should
+scale with the number of cores, since lexers share no mutable state.
+
+    python benchmarks/thread_scaling.py [max_threads] [documents]
+'''
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from rexlex import Lexer, Token, include
+
+
+class BenchLexer(Lexer):
+
+    re_skip = re.compile(r'\s+')
+    tokendefs = {
+        'root': [
+            include('literals'),
+            (Token.Keyword, r'(?:def|class|return|if|else|for|in)\b'),
+            (Token.Name, r'[A-Za-z_]\w*'),
+            (Token.Punctuation, r'[()\[\]{}:,.]'),
+            (Token.Operator, r'[-+*/%=<>!]=?'),
+        ],
+        'literals': [
+            (Token.Number, r'\d+(?:\.\d+)?'),
+            (Token.String, r'"', 'string'),
+        ],
+        'string': [
+            (Token.String.Escape, r'\\.'),
+            (Token.String, r'[^"\\]+'),
+            (Token.String, r'"', None, True),
+        ],
+    }
+
+
+DOCUMENT = '''
+def f(x, y):
+    if x > 10.5:
+        return "big \\"x\\"" + y
+    for i in range(x):
+        y = y * i + 3
+    return y
+''' * 20
+
+
+def lex(text):
+    count = 0
+    for _ in BenchLexer(text):
+        count += 1
+    return count
+
+
+def run(threads, documents):
+    start = time.time()
+    with ThreadPoolExecutor(threads) as pool:
+        tokens = sum(pool.map(lex, [DOCUMENT] * documents))
+    return time.time() - start, tokens
+
+
+def main(argv):
+    max_threads = int(argv[1]) if 1 < len(argv) else 8
+    documents = int(argv[2]) if 2 < len(argv) else 64
+    gil = getattr(sys, '_is_gil_enabled', lambda: True)()
+    print('Python %s, GIL %s' % (sys.version.split()[0],
+                                 'enabled' if gil else 'disabled'))
+    lex(DOCUMENT)
+    baseline = None
+    threads = 1
+    while threads <= max_threads:
+        elapsed, tokens = run(threads, documents)
+        rate = documents / elapsed
+        baseline = baseline or rate
+        print('%2d threads: %8.1f docs/s  %10.0f tokens/s  %.2fx' % (
+            threads, rate, tokens / elapsed, rate / baseline))
+        threads *= 2
+
+
+if __name__ == '__main__':
+    main(sys.argv)
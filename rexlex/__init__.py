@@ -17,10 +17,10 @@ __contact__ = 'twneale@gmail.com'
 __homepage__ = 'http://github.com/twneale/rexlex'
 __docformat__ = 'restructuredtext'
 __all__ = [
-    'Lexer', 'Token', 'include', 'bygroups', 'Rule',
+    'Lexer', 'Token', 'include', 'bygroups', 'words', 'Rule',
     'ScannerLexer', 'IncompleteLex',
     'TRACE', 'TRACE_RESULT', 'TRACE_META', 'TRACE_STATE',
-    'TRACE_RULE', '__version__']
+    'TRACE_RULE', 'trace_level', 'warmup', '__version__']
 
 
 # Configure logging.
@@ -33,14 +33,17 @@ from rexlex.log_config import (
     REXLEX_TRACE_STATE as TRACE_STATE,
     REXLEX_TRACE_RULE as TRACE_RULE,
     REXLEX_TRACE as TRACE,
+    trace_level,
 )
 
 # Import lexer.
 from rexlex.lexer.lexer import Lexer
 from rexlex.lexer.tokentype import Token
-from rexlex.lexer.utils import include, bygroups, Rule
+from rexlex.lexer.utils import include, bygroups, words, Rule
 from rexlex.lexer.exceptions import IncompleteLex
 
 # Import Scanner.
 from rexlex.scanner.scanner import ScannerLexer
 
+from rexlex.warmup import warmup
+
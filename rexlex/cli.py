@@ -0,0 +1,290 @@
+'''Bulk lexing from the command line::
+
+    python -m rexlex mypackage.lexers.MyLexer 'docs/**/*.txt' > tokens.jsonl
+    cat doc.txt | python -m rexlex mypackage.lexers.MyLexer
+
+Files are lexed in a pool of worker processes and written to stdout (or
+``--output``) as each one is done, in the order they were given unless
+``--unordered`` is passed. A throughput and error summary goes to
+stderr at the end; the exit status is 1 if any file failed.
+
+Output formats:
+
+``jsonl``
+    One line per file: ``{"path": ..., "tokens": [[start, end, token],
+    ...]}``, or ``{"path": ..., "error": ...}`` if lexing failed. Token
+    types are written as their ``as_json()`` names.
+``binary``
+    One frame per file: a header (path length as uint32 LE, data length
+    as uint64 LE), the UTF-8 path, then the tokens in the binary token
+    stream format, or nothing if lexing failed. See read_frames.
+
+Files of ``--mmap-threshold`` bytes or more are memory-mapped and
+decoded straight from the mapping instead of being read into memory
+first. ScannerLexer subclasses are accepted too; their parse results
+are written as one stream of tokens per file.
+'''
+import os
+import sys
+import mmap
+import glob
+import json
+import time
+import codecs
+import struct
+import argparse
+import importlib
+import itertools
+import collections
+import multiprocessing
+
+from rexlex.lexer.lexer import Lexer
+from rexlex.lexer.tokentype import _TokenType
+from rexlex.scanner.scanner import ScannerLexer
+from rexlex.tokenstream.binary import dumps_tokens, loads_tokens
+
+
+_FRAME = struct.Struct('<IQ')
+
+
+class Result(collections.namedtuple(
+        'Result', 'path data size ntokens seconds error')):
+    '''What lexing one file produced: the encoded output, the input size
+    in bytes, the number of tokens, the time it took and, if it failed,
+    the error as a string.
+    '''
+    __slots__ = ()
+
+
+def import_lexer(path):
+    '''Import a Lexer or ScannerLexer subclass from its dotted path.
+    '''
+    module_name, _, name = path.rpartition('.')
+    if not module_name:
+        raise ImportError('%r is not a dotted path.' % path)
+    lexer_cls = getattr(importlib.import_module(module_name), name, None)
+    if not (isinstance(lexer_cls, type)
+            and issubclass(lexer_cls, (Lexer, ScannerLexer))):
+        raise ImportError('%r is not a Lexer or ScannerLexer class.' % path)
+    return lexer_cls
+
+
+def read_text(path, encoding='utf-8', mmap_threshold=None):
+    '''Return the decoded text of a file and its size in bytes. Files of
+    at least mmap_threshold bytes are decoded from a memory map, without
+    an intermediate copy of the raw bytes.
+    '''
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if mmap_threshold is None or size < mmap_threshold or not size:
+            return f.read().decode(encoding), size
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        return codecs.decode(buf, encoding), size
+    finally:
+        buf.close()
+
+
+def iter_tokens(lexer_cls, text):
+    '''Yield the (start, end, token) tuples of lexing text with a Lexer
+    or ScannerLexer class.
+    '''
+    if issubclass(lexer_cls, ScannerLexer):
+        return itertools.chain.from_iterable(lexer_cls(text))
+    return lexer_cls(text)
+
+
+def _token_name(token):
+    if isinstance(token, _TokenType):
+        return token.as_json()
+    return token
+
+
+def encode_jsonl(path, tokens=None, error=None):
+    record = collections.OrderedDict([('path', path)])
+    if error is None:
+        record['tokens'] = [
+            [start, end, _token_name(token)] for start, end, token in tokens]
+    else:
+        record['error'] = error
+    return (json.dumps(record) + '\n').encode('utf-8')
+
+
+def encode_binary(path, tokens=None, error=None):
+    data = b'' if error is not None else dumps_tokens(tokens)
+    path = path.encode('utf-8')
+    return _FRAME.pack(len(path), len(data)) + path + data
+
+
+def read_frames(fileobj):
+    '''Yield (path, TokenFile) pairs from binary output; the TokenFile is
+    None for files that failed.
+    '''
+    while True:
+        header = fileobj.read(_FRAME.size)
+        if not header:
+            return
+        path_size, data_size = _FRAME.unpack(header)
+        path = fileobj.read(path_size).decode('utf-8')
+        data = fileobj.read(data_size)
+        yield path, (loads_tokens(data) if data else None)
+
+
+_ENCODERS = {'jsonl': encode_jsonl, 'binary': encode_binary}
+
+
+# Set in each worker by _init_worker.
+_worker = None
+
+
+def _init_worker(lexer_path, fmt, encoding, mmap_threshold):
+    global _worker
+    lexer_cls = import_lexer(lexer_path)
+    lexer_cls.precompile()
+    _worker = (lexer_cls, _ENCODERS[fmt], encoding, mmap_threshold)
+
+
+def _lex_file(path, text=None):
+    lexer_cls, encode, encoding, mmap_threshold = _worker
+    started = time.time()
+    size = ntokens = 0
+    try:
+        if text is None:
+            text, size = read_text(path, encoding, mmap_threshold)
+        else:
+            size = len(text.encode(encoding))
+        tokens = list(iter_tokens(lexer_cls, text))
+        ntokens = len(tokens)
+        data = encode(path, tokens)
+        error = None
+    except Exception as exc:
+        error = '%s: %s' % (type(exc).__name__, exc)
+        data = encode(path, error=error)
+    return Result(path, data, size, ntokens, time.time() - started, error)
+
+
+def expand_paths(patterns):
+    '''Expand glob patterns (with ``**``) into file paths, keeping the
+    order they were given in. Patterns that match nothing are kept as is,
+    so they're reported as errors.
+    '''
+    paths = []
+    seen = set()
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True))
+        matches = [path for path in matches if os.path.isfile(path)]
+        for path in matches or [pattern]:
+            if path not in seen:
+                seen.add(path)
+                paths.append(path)
+    return paths
+
+
+def summarize(results, seconds, max_errors=10):
+    '''Lines of throughput and error summary for a list of Results.
+    '''
+    size = sum(result.size for result in results)
+    ntokens = sum(result.ntokens for result in results)
+    errors = [result for result in results if result.error is not None]
+    seconds = max(seconds, 1e-9)
+    lines = [
+        'Lexed %d files, %d bytes, %d tokens in %.3fs '
+        '(%.2f MB/s, %d tokens/s); %d errors.' % (
+            len(results), size, ntokens, seconds, size / seconds / 1e6,
+            ntokens / seconds, len(errors))]
+    for result in errors[:max_errors]:
+        lines.append('  %s: %s' % (
+            result.path, result.error.splitlines()[0]))
+    if max_errors < len(errors):
+        lines.append('  ... and %d more.' % (len(errors) - max_errors))
+    return lines
+
+
+def main(argv=None, stdin=None, stdout=None, stderr=None):
+    '''Lex the files named on the command line.
+    '''
+    stdin = stdin or sys.stdin
+    stdout = stdout or getattr(sys.stdout, 'buffer', sys.stdout)
+    stderr = stderr or sys.stderr
+    parser = argparse.ArgumentParser(
+        prog='python -m rexlex',
+        description='Lex files in parallel and write their tokens.')
+    parser.add_argument(
+        'lexer', metavar='LEXER',
+        help='dotted path of a Lexer or ScannerLexer class')
+    parser.add_argument(
+        'files', nargs='*', metavar='FILE',
+        help='files or glob patterns to lex; stdin if none or -')
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=None,
+        help='number of worker processes (default: number of CPUs; '
+             '1 lexes in this process)')
+    parser.add_argument(
+        '-f', '--format', choices=sorted(_ENCODERS), default='jsonl',
+        help='output format (default: jsonl)')
+    parser.add_argument(
+        '-o', '--output', help='file to write to instead of stdout')
+    parser.add_argument(
+        '--unordered', action='store_true',
+        help='write files as they finish instead of in order')
+    parser.add_argument(
+        '--encoding', default='utf-8', help='input encoding')
+    parser.add_argument(
+        '--mmap-threshold', type=int, default=16 << 20, metavar='BYTES',
+        help='memory-map files of at least this size (default: 16 MiB)')
+    parser.add_argument(
+        '-q', '--quiet', action='store_true', help="don't print the summary")
+    args = parser.parse_args(argv)
+
+    try:
+        lexer_cls = import_lexer(args.lexer)
+    except (ImportError, AttributeError) as exc:
+        parser.error(str(exc))
+    init_args = (args.lexer, args.format, args.encoding, args.mmap_threshold)
+    # Compile before forking, so the workers inherit the result.
+    lexer_cls.precompile()
+
+    paths = expand_paths(f for f in args.files if f != '-')
+    read_stdin = not args.files or '-' in args.files
+    jobs = args.jobs or os.cpu_count() or 1
+
+    out = stdout if args.output is None else open(args.output, 'wb')
+    results = []
+    started = time.time()
+    pool = None
+    try:
+        if read_stdin:
+            _init_worker(*init_args)
+            result = _lex_file('-', stdin.read())
+            out.write(result.data)
+            results.append(result._replace(data=None))
+        if paths and (jobs == 1 or len(paths) == 1):
+            _init_worker(*init_args)
+            outcomes = map(_lex_file, paths)
+        elif paths:
+            pool = multiprocessing.Pool(
+                min(jobs, len(paths)), _init_worker, init_args)
+            if args.unordered:
+                outcomes = pool.imap_unordered(_lex_file, paths)
+            else:
+                outcomes = pool.imap(_lex_file, paths)
+        else:
+            outcomes = ()
+        for result in outcomes:
+            out.write(result.data)
+            results.append(result._replace(data=None))
+        if pool is not None:
+            pool.close()
+            pool.join()
+    finally:
+        if pool is not None:
+            pool.terminate()
+        if out is not stdout:
+            out.close()
+        else:
+            out.flush()
+
+    if not args.quiet:
+        for line in summarize(results, time.time() - started):
+            stderr.write(line + '\n')
+    return 1 if any(result.error for result in results) else 0
@@ -0,0 +1,727 @@
+'''Static checks for lexer grammars, meant to run in CI before a lexer
+is deployed::
+
+    python -m rexlex.lexer.check mypackage.lexers.MyLexer
+
+A module path checks every Lexer subclass defined in that module. The
+exit status is 1 if there are errors (or, with ``--strict``, any
+findings at all).
+
+The checks work on the compiled tokendefs, i.e. after ``include``
+expansion:
+
+``redos``
+    Patterns whose structure risks exponential backtracking: a repeated
+    group whose body is itself a repeat plus only optional parts, like
+    ``(a+)+`` or ``(\\s*\\w+)*``, or a repeated alternation whose branches
+    can start with the same character, like ``(\\w+x|\\d+y)*``.
+``empty``
+    Patterns that can match the empty string. Unless the rule changes
+    state, the lexer can't make progress past such a match.
+``shadowed``
+    Patterns that can never be reached, because an earlier pattern in the
+    same state matches a prefix of everything they match. This is only
+    decided for patterns that match a finite set of literal strings.
+``unreachable``
+    States that no chain of pushes from ``root`` leads to, and that
+    aren't included in other states.
+``undefined-state``
+    Push or swap targets that aren't defined.
+
+The pattern checks are heuristics; ``redos`` in particular can flag
+patterns that are fine in practice.
+'''
+import re
+import sys
+import argparse
+import importlib
+import collections
+
+from rexlex.lexer.dfa import sre_parse, sre_constants, _CATEGORIES, _in_category
+from rexlex.lexer.utils import include
+from rexlex.lexer.matchers import LiteralMatcher, WordsMatcher
+from rexlex.lexer.exceptions import BogusIncludeError
+from rexlex.lexer.py2compat import str, unicode, bytes, basestring
+
+try:
+    unichr
+except NameError:
+    unichr = chr
+
+
+ERROR = 'error'
+WARNING = 'warning'
+
+
+class Finding(collections.namedtuple(
+        'Finding', 'level kind state rule pattern message')):
+    '''One analysis result. ``rule`` is the index of the rule within its
+    state after include expansion, or None for findings about whole
+    states.
+    '''
+    __slots__ = ()
+
+    def __str__(self):
+        where = 'state %r' % (self.state,)
+        if self.rule is not None:
+            where += ' rule #%d' % self.rule
+        if self.pattern is not None:
+            where += ' %r' % (self.pattern,)
+        return '%s: %s: %s: %s' % (self.level, self.kind, where, self.message)
+
+
+_c = sre_constants
+_LITERAL = _c.LITERAL
+_NOT_LITERAL = _c.NOT_LITERAL
+_ANY = _c.ANY
+_IN = _c.IN
+_BRANCH = _c.BRANCH
+_SUBPATTERN = _c.SUBPATTERN
+_MAX_REPEAT = _c.MAX_REPEAT
+_MIN_REPEAT = _c.MIN_REPEAT
+_RANGE = _c.RANGE
+_NEGATE = _c.NEGATE
+_CATEGORY = _c.CATEGORY
+_MAXREPEAT = _c.MAXREPEAT
+_AT = _c.AT
+_ASSERT = _c.ASSERT
+_ASSERT_NOT = _c.ASSERT_NOT
+_GROUPREF = _c.GROUPREF
+_REPEATS = (_MAX_REPEAT, _MIN_REPEAT)
+_POSSESSIVE_REPEAT = getattr(_c, 'POSSESSIVE_REPEAT', None)
+_ATOMIC_GROUP = getattr(_c, 'ATOMIC_GROUP', None)
+
+# Repeats with a bound above this count as unbounded for backtracking.
+_LARGE_REPEAT = 10
+
+# Characters tried when deciding whether two branches can start alike.
+_SAMPLE = range(256)
+
+
+# ---------------------------------------------------------------------------
+# Parse tree helpers.
+# ---------------------------------------------------------------------------
+def _parse(pattern, flags):
+    try:
+        return sre_parse.parse(pattern, flags)
+    except Exception:
+        return None
+
+
+def _subpattern_items(av):
+    # (group, add_flags, del_flags, items) on current Pythons.
+    return av[-1]
+
+
+def _nullable(items):
+    '''Whether the item sequence can match the empty string.
+    '''
+    return all(_nullable_op(op, av) for op, av in items)
+
+
+def _nullable_op(op, av):
+    if op in (_LITERAL, _NOT_LITERAL, _ANY, _IN):
+        return False
+    if op is _BRANCH:
+        return any(_nullable(alternative) for alternative in av[1])
+    if op is _SUBPATTERN:
+        return _nullable(_subpattern_items(av))
+    if op in _REPEATS or op is _POSSESSIVE_REPEAT:
+        lo, hi, items = av
+        return lo == 0 or _nullable(items)
+    if op is _ATOMIC_GROUP:
+        return _nullable(av)
+    # Anchors, lookaround and backreferences can all match empty.
+    return True
+
+
+def _is_contextual(items):
+    '''Whether matching depends on text outside the match itself:
+    anchors, lookaround or backreferences.
+    '''
+    for op, av in items:
+        if op in (_AT, _ASSERT, _ASSERT_NOT, _GROUPREF):
+            return True
+        if op is _BRANCH:
+            if any(_is_contextual(alt) for alt in av[1]):
+                return True
+        elif op is _SUBPATTERN:
+            if _is_contextual(_subpattern_items(av)):
+                return True
+        elif op in _REPEATS or op is _POSSESSIVE_REPEAT:
+            if _is_contextual(av[2]):
+                return True
+        elif op is _ATOMIC_GROUP:
+            if _is_contextual(av):
+                return True
+    return False
+
+
+def _literal_strings(items, limit=256):
+    '''The finite set of strings the items match, as a list of lists of
+    code points, or None if the set isn't a small set of literals.
+    '''
+    strings = [[]]
+    for op, av in items:
+        if op is _LITERAL:
+            choices = [[av]]
+        elif op is _SUBPATTERN:
+            choices = _literal_strings(_subpattern_items(av), limit)
+        elif op is _BRANCH:
+            choices = []
+            for alternative in av[1]:
+                alt_strings = _literal_strings(alternative, limit)
+                if alt_strings is None:
+                    return None
+                choices.extend(alt_strings)
+        else:
+            return None
+        if choices is None or limit < len(strings) * len(choices):
+            return None
+        strings = [prefix + choice for prefix in strings for choice in choices]
+    return strings
+
+
+def _first_atoms(items):
+    '''The atoms (LITERAL, IN, ...) that can consume the first character
+    of a match of items. Returns (atoms, complete); complete is false if
+    something other than plain atoms may come first.
+    '''
+    atoms = []
+    for op, av in items:
+        if op in (_LITERAL, _NOT_LITERAL, _ANY, _IN):
+            atoms.append((op, av))
+            return atoms, True
+        if op is _SUBPATTERN:
+            sub_atoms, complete = _first_atoms(_subpattern_items(av))
+            atoms.extend(sub_atoms)
+            if not complete:
+                return atoms, False
+            if not _nullable(_subpattern_items(av)):
+                return atoms, True
+        elif op is _BRANCH:
+            for alternative in av[1]:
+                sub_atoms, complete = _first_atoms(alternative)
+                atoms.extend(sub_atoms)
+                if not complete:
+                    return atoms, False
+            if not _nullable_op(op, av):
+                return atoms, True
+        elif op in _REPEATS or op is _POSSESSIVE_REPEAT:
+            sub_atoms, complete = _first_atoms(av[2])
+            atoms.extend(sub_atoms)
+            if not complete:
+                return atoms, False
+            if not _nullable_op(op, av):
+                return atoms, True
+        elif op is _AT:
+            continue
+        else:
+            return atoms, False
+    return atoms, True
+
+
+def _atom_matches(atom, code, ascii):
+    op, av = atom
+    if op is _LITERAL:
+        return code == av
+    if op is _NOT_LITERAL:
+        return code != av
+    if op is _ANY:
+        return code != 10
+    negate = False
+    for subop, subav in av:
+        if subop is _NEGATE:
+            negate = True
+        elif subop is _LITERAL:
+            if code == subav:
+                return not negate
+        elif subop is _RANGE:
+            if subav[0] <= code <= subav[1]:
+                return not negate
+        elif subop is _CATEGORY and subav in _CATEGORIES:
+            base, positive = _CATEGORIES[subav]
+            if _in_category(base, ascii, code) == positive:
+                return not negate
+    return negate
+
+
+def _atom_codes(atom):
+    '''Code points worth sampling for an atom besides _SAMPLE.
+    '''
+    op, av = atom
+    if op in (_LITERAL, _NOT_LITERAL):
+        return [av]
+    if op is _IN:
+        codes = []
+        for subop, subav in av:
+            if subop is _LITERAL:
+                codes.append(subav)
+            elif subop is _RANGE:
+                codes.extend(subav)
+        return codes
+    return []
+
+
+def _branches_overlap(first, second, flags):
+    '''Whether two branches can start with the same character.
+    '''
+    first_atoms, first_complete = _first_atoms(first)
+    second_atoms, second_complete = _first_atoms(second)
+    if not (first_complete and second_complete):
+        return False
+    ascii = bool(flags & re.ASCII)
+    codes = set(_SAMPLE)
+    for atom in first_atoms + second_atoms:
+        codes.update(_atom_codes(atom))
+    fold = flags & re.IGNORECASE
+    for code in codes:
+        variants = [code]
+        if fold and code < 0x110000:
+            char = unichr(code)
+            variants.extend(ord(c) for c in (char.lower(), char.upper())
+                            if len(c) == 1)
+        if any(_atom_matches(atom, variant, ascii)
+               for atom in first_atoms for variant in variants) and \
+           any(_atom_matches(atom, code, ascii) for atom in second_atoms):
+            return True
+    return False
+
+
+# ---------------------------------------------------------------------------
+# Pattern checks.
+# ---------------------------------------------------------------------------
+def _is_repeat(op, av):
+    if op in _REPEATS:
+        lo, hi, items = av
+        return (hi is _MAXREPEAT or 1 < hi) and not _nullable(items)
+    return False
+
+
+def _unbounded(av):
+    lo, hi, items = av
+    return hi is _MAXREPEAT or _LARGE_REPEAT < hi
+
+
+def _has_free_repeat(items):
+    '''Whether the sequence is a repeat plus only optional parts, so that
+    a run of input can be split between iterations in many ways.
+    '''
+    for i, (op, av) in enumerate(items):
+        if _is_repeat(op, av):
+            inner = True
+        elif op is _SUBPATTERN:
+            inner = _has_free_repeat(_subpattern_items(av))
+        elif op is _BRANCH:
+            inner = any(_has_free_repeat(alt) for alt in av[1])
+        else:
+            inner = False
+        if inner and _nullable(items[:i]) and _nullable(items[i + 1:]):
+            return True
+    return False
+
+
+def _direct_branches(items):
+    '''Yield BRANCH nodes in the sequence, looking through groups.
+    '''
+    for op, av in items:
+        if op is _BRANCH:
+            yield av[1]
+        elif op is _SUBPATTERN:
+            for branches in _direct_branches(_subpattern_items(av)):
+                yield branches
+
+
+def _redos_problems(items, flags):
+    '''Yield descriptions of backtracking risks in a parse tree.
+    '''
+    for op, av in items:
+        if op in _REPEATS:
+            lo, hi, body = av
+            if _unbounded(av):
+                body = list(body)
+                if _has_free_repeat(body):
+                    yield 'nested quantifiers'
+                for branches in _direct_branches(body):
+                    pairs = [(a, b) for i, a in enumerate(branches)
+                             for b in branches[i + 1:]]
+                    if any(_branches_overlap(list(a), list(b), flags)
+                           for a, b in pairs):
+                        yield 'repeated alternation with overlapping branches'
+                        break
+            for problem in _redos_problems(av[2], flags):
+                yield problem
+        elif op is _SUBPATTERN:
+            for problem in _redos_problems(_subpattern_items(av), flags):
+                yield problem
+        elif op is _BRANCH:
+            for alternative in av[1]:
+                for problem in _redos_problems(alternative, flags):
+                    yield problem
+        elif op in (_ASSERT, _ASSERT_NOT):
+            for problem in _redos_problems(av[1], flags):
+                yield problem
+
+
+class _Pattern(object):
+    '''What the analysis needs to know about one compiled pattern.
+    '''
+
+    def __init__(self, rgx):
+        self.rgx = rgx
+        self.pattern = rgx.pattern
+        self.flags = getattr(rgx, 'flags', 0)
+        self.tree = None
+        self.strings = None
+        self.contextual = True
+        if isinstance(rgx, LiteralMatcher):
+            self.strings = [rgx.literal]
+            self.contextual = False
+        elif isinstance(rgx, WordsMatcher):
+            if not rgx.fold:
+                self.strings = list(rgx.table)
+            self.tree = _parse(rgx.pattern, rgx.flags)
+        else:
+            self.tree = _parse(rgx.pattern, self.flags)
+            if self.tree is not None:
+                self.flags |= self.tree.state.flags
+                self.contextual = _is_contextual(self.tree)
+                if not self.flags & (re.IGNORECASE | re.VERBOSE):
+                    codes = _literal_strings(self.tree)
+                    if codes is not None:
+                        self.strings = [self._join(c) for c in codes]
+
+    def _join(self, codes):
+        if isinstance(self.pattern, bytes) and bytes is not str:
+            return bytes(bytearray(codes))
+        return u''.join(unichr(code) for code in codes)
+
+    def nullable(self):
+        if isinstance(self.rgx, (LiteralMatcher, WordsMatcher)):
+            return False
+        return self.tree is not None and _nullable(self.tree)
+
+    def shadows(self, string):
+        '''Whether this pattern matches a prefix of string wherever string
+        occurs in the text.
+        '''
+        if self.contextual or isinstance(self.rgx, WordsMatcher):
+            return False
+        return self.rgx.match(string) is not None
+
+
+# ---------------------------------------------------------------------------
+# Grammar checks.
+# ---------------------------------------------------------------------------
+def _targets(rule):
+    '''State names a rule pushes or swaps to.
+    '''
+    push = rule.push
+    if isinstance(push, basestring):
+        push = (push,)
+    for state in push or ():
+        if not state.startswith('#pop'):
+            yield state
+    if rule.swap:
+        yield rule.swap
+
+
+def _included(tokendefs):
+    '''Names of states that are included somewhere.
+    '''
+    names = set()
+    for rules in tokendefs.values():
+        for rule in rules:
+            if isinstance(rule, include):
+                names.add(str(rule))
+    return names
+
+
+def analyze(compiler):
+    '''Run every check over the compiler's lexer. Returns a list of
+    Findings.
+    '''
+    findings = []
+    try:
+        compiled = compiler.compile_all()
+    except BogusIncludeError as exc:
+        return [Finding(ERROR, 'undefined-state', None, None, None, str(exc))]
+
+    for state in sorted(compiled):
+        rules = compiled[state]
+        findings.extend(_check_state(state, rules, compiled))
+
+    reachable = set()
+    pending = ['root']
+    while pending:
+        state = pending.pop()
+        if state in reachable or state not in compiled:
+            continue
+        reachable.add(state)
+        for rule in compiled[state]:
+            pending.extend(_targets(rule))
+    if 'root' not in compiled:
+        findings.append(Finding(
+            ERROR, 'undefined-state', 'root', None, None,
+            "No 'root' state is defined."))
+    included = _included(compiler.tokendefs)
+    for state in sorted(set(compiled) - reachable - included):
+        findings.append(Finding(
+            WARNING, 'unreachable', state, None, None,
+            'State is never pushed from root and never included.'))
+    return findings
+
+
+def _check_state(state, rules, compiled):
+    # Patterns seen so far in this state, in order.
+    earlier = []
+    for index, rule in enumerate(rules):
+        for target in _targets(rule):
+            if target not in compiled:
+                yield Finding(
+                    ERROR, 'undefined-state', state, index, None,
+                    'Transition to undefined state %r.' % (target,))
+        for rgx in rule.rgxs:
+            pattern = _Pattern(rgx)
+            if pattern.tree is not None:
+                for problem in set(_redos_problems(pattern.tree, pattern.flags)):
+                    yield Finding(
+                        WARNING, 'redos', state, index, pattern.pattern,
+                        'Risk of exponential backtracking: %s.' % problem)
+            if pattern.nullable():
+                if rule.push or rule.pop or rule.swap:
+                    level, message = WARNING, 'Pattern can match empty.'
+                else:
+                    level = ERROR
+                    message = ('Pattern can match empty and the rule '
+                               "doesn't change state, so the lexer can stall.")
+                yield Finding(
+                    level, 'empty', state, index, pattern.pattern, message)
+            shadow = _find_shadow(pattern, earlier)
+            if shadow is not None:
+                yield Finding(
+                    WARNING, 'shadowed', state, index, pattern.pattern,
+                    'Never matches: rule #%d %r matches first.' % shadow)
+            earlier.append((index, pattern))
+
+
+def _find_shadow(pattern, earlier):
+    for index, other in earlier:
+        if (other.pattern, other.flags) == (pattern.pattern, pattern.flags) \
+                and type(other.rgx) is type(pattern.rgx):
+            return index, other.pattern
+        if other.nullable() and not other.contextual:
+            return index, other.pattern
+    strings = pattern.strings
+    if not strings:
+        return None
+    for index, other in earlier:
+        if all(other.shadows(string) for string in strings):
+            return index, other.pattern
+    return None
+
+
+# ---------------------------------------------------------------------------
+# Line locality.
+# ---------------------------------------------------------------------------
+# Anchors that test the same thing at a position whether the line is
+# lexed alone or in its document.
+_LINE_LOCAL_AT = frozenset(
+    getattr(_c, name) for name in (
+        'AT_BOUNDARY', 'AT_NON_BOUNDARY', 'AT_UNI_BOUNDARY',
+        'AT_UNI_NON_BOUNDARY', 'AT_LOC_BOUNDARY', 'AT_LOC_NON_BOUNDARY')
+    if hasattr(_c, name))
+_MULTILINE_AT = frozenset([_c.AT_BEGINNING, _c.AT_END])
+
+
+def line_local(rgx):
+    '''Whether a compiled pattern or matcher matches the same way in a
+    line lexed on its own as in the whole text: it can only consume a
+    newline as the last character of a match, and doesn't look outside
+    the line with lookaround or string anchors. Conservative; patterns
+    it can't analyze aren't line local.
+    '''
+    if isinstance(rgx, LiteralMatcher):
+        return _newline_last(rgx.literal)
+    pattern = getattr(rgx, 'pattern', None)
+    if pattern is None:
+        return False
+    tree = _parse(pattern, getattr(rgx, 'flags', 0))
+    if tree is None:
+        return False
+    flags = tree.state.flags
+    ascii = isinstance(pattern, bytes) or bool(flags & re.ASCII)
+    return _newline_items(tree, flags, ascii) is not None
+
+
+def _newline_last(string):
+    newline = b'\n' if isinstance(string, bytes) else '\n'
+    index = string.find(newline)
+    return index == -1 or index == len(string) - 1
+
+
+def _newline_items(items, flags, ascii):
+    '''Whether items can consume a newline, or None if they can consume
+    one and then go on matching, or look outside the line.
+    '''
+    newline = False
+    for op, av in items:
+        if newline:
+            # Anything after a newline may match into the next line.
+            return None
+        if op in (_LITERAL, _NOT_LITERAL, _IN):
+            newline = _atom_matches((op, av), 10, ascii)
+        elif op is _ANY:
+            newline = bool(flags & re.DOTALL)
+        elif op is _BRANCH:
+            for alternative in av[1]:
+                result = _newline_items(alternative, flags, ascii)
+                if result is None:
+                    return None
+                newline = newline or result
+        elif op is _SUBPATTERN:
+            newline = _newline_items(_subpattern_items(av), flags, ascii)
+        elif op is _ATOMIC_GROUP:
+            newline = _newline_items(av, flags, ascii)
+        elif op in _REPEATS or op is _POSSESSIVE_REPEAT:
+            newline = _newline_items(av[2], flags, ascii)
+            if newline and 1 < av[1]:
+                return None
+        elif op is _AT:
+            if av not in _LINE_LOCAL_AT and not (
+                    av in _MULTILINE_AT and flags & re.MULTILINE):
+                return None
+        elif op is _GROUPREF:
+            # The group may have captured a newline.
+            newline = True
+        else:
+            return None
+        if newline is None:
+            return None
+    return newline
+
+
+# ---------------------------------------------------------------------------
+# Consumed bytes.
+# ---------------------------------------------------------------------------
+# Shapes of patterns that are one character-consuming atom.
+SINGLE = 'single'
+RUN = 'run'
+
+_CONSUMING = (_LITERAL, _NOT_LITERAL, _ANY, _IN)
+
+
+def consumed_bytes(rgx):
+    '''What a compiled bytes pattern or matcher can consume. Returns
+    (codes, shape): codes is the set of bytes any part of the pattern can
+    match, in lookaround too; shape is SINGLE if the pattern is one byte,
+    RUN if it is a greedy run of one or more bytes, and None otherwise.
+    Returns None for patterns it can't analyze.
+    '''
+    pattern = getattr(rgx, 'pattern', None)
+    if pattern is None:
+        return None
+    tree = _parse(pattern, getattr(rgx, 'flags', 0))
+    if tree is None:
+        return None
+    flags = tree.state.flags
+    codes = set()
+    for atom in _consuming_atoms(tree):
+        codes.update(_byte_codes(atom, flags))
+    return codes, _byte_shape(list(tree))
+
+
+def _consuming_atoms(items):
+    for op, av in items:
+        if op in _CONSUMING:
+            yield op, av
+        elif op is _BRANCH:
+            for alternative in av[1]:
+                for atom in _consuming_atoms(alternative):
+                    yield atom
+        elif op is _SUBPATTERN:
+            for atom in _consuming_atoms(_subpattern_items(av)):
+                yield atom
+        elif op in _REPEATS or op is _POSSESSIVE_REPEAT:
+            for atom in _consuming_atoms(av[2]):
+                yield atom
+        elif op is _ATOMIC_GROUP:
+            for atom in _consuming_atoms(av):
+                yield atom
+        elif op in (_ASSERT, _ASSERT_NOT):
+            for atom in _consuming_atoms(av[1]):
+                yield atom
+
+
+def _byte_codes(atom, flags):
+    if atom[0] is _ANY and flags & re.DOTALL:
+        codes = set(range(256))
+    else:
+        codes = set(code for code in range(256)
+                    if _atom_matches(atom, code, True))
+    if flags & re.IGNORECASE:
+        codes.update([ord(chr(code).swapcase()) for code in codes
+                      if chr(code).isalpha() and code < 128])
+    return codes
+
+
+def _byte_shape(items):
+    if len(items) != 1:
+        return None
+    op, av = items[0]
+    if op in _CONSUMING:
+        return SINGLE
+    if op is _MAX_REPEAT or op is _POSSESSIVE_REPEAT:
+        lo, hi, repeated = av
+        if lo == 1 and hi == _MAXREPEAT and len(repeated) == 1 and \
+                repeated[0][0] in _CONSUMING:
+            return RUN
+    return None
+
+
+# ---------------------------------------------------------------------------
+# Command line.
+# ---------------------------------------------------------------------------
+def _lexer_classes(path):
+    '''Resolve a dotted path to a lexer class, or to a module and all the
+    Lexer subclasses defined in it.
+    '''
+    from rexlex.lexer.lexer import Lexer
+    try:
+        module = importlib.import_module(path)
+    except ImportError:
+        module_name, _, name = path.rpartition('.')
+        if not module_name:
+            raise
+        return [getattr(importlib.import_module(module_name), name)]
+    return [
+        obj for obj in vars(module).values()
+        if isinstance(obj, type) and issubclass(obj, Lexer)
+        and obj.__module__ == module.__name__
+        and getattr(obj, 'tokendefs', None)]
+
+
+def main(argv=None):
+    '''Analyze the lexers named on the command line.
+    '''
+    from rexlex.lexer.tokendefs import Compiler
+    parser = argparse.ArgumentParser(
+        prog='python -m rexlex.lexer.check',
+        description='Check lexer grammars for performance and '
+                    'correctness problems.')
+    parser.add_argument(
+        'lexers', nargs='+', metavar='LEXER',
+        help='dotted path of a lexer class, or of a module of lexers')
+    parser.add_argument(
+        '--strict', action='store_true', help='fail on warnings too')
+    args = parser.parse_args(argv)
+
+    failed = False
+    for path in args.lexers:
+        for lexer_cls in _lexer_classes(path):
+            name = '%s.%s' % (lexer_cls.__module__, lexer_cls.__name__)
+            for finding in Compiler(lexer_cls).analyze():
+                sys.stdout.write('%s: %s\n' % (name, finding))
+                if finding.level == ERROR or args.strict:
+                    failed = True
+    return 1 if failed else 0
@@ -0,0 +1,12 @@
+'''Command line entry point for the grammar checks in
+rexlex.lexer.analysis::
+
+    python -m rexlex.lexer.check mypackage.lexers.MyLexer
+'''
+import sys
+
+from rexlex.lexer.analysis import main
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,395 @@
+'''Generated Python source for lexer classes.
+
+A lexer class with ``engine = 'codegen'`` is lexed by a module generated
+from its compiled StateTable instead of by the generic rule loop. Each
+state becomes a function that tries the state's patterns in order with
+their ``match`` methods bound as closure variables, builds the rule's
+tokens directly, and returns a transition function specialized for the
+rule's pops and pushes. There is no tracing or flight recording in the
+generated code.
+
+The module source depends only on the shape of the state table (rule
+kinds, group counts, transitions, which tokens are left out by
+``dont_emit``, whether there's a ``re_skip``), not on the patterns
+themselves, which are bound when the module is loaded. Modules are
+written to a cache directory under a hash of that shape and imported
+from there on later runs::
+
+    class MyLexer(Lexer):
+        engine = 'codegen'
+        codegen_dir = '/var/cache/mylexer'   # optional
+        tokendefs = {...}
+
+The generated engine yields the same tokens as the generic one. Lexers
+fall back to the generic engine when tracing is on, when they have a
+time or token budget, and when constructed with ``codegen=False``; the
+generated engine also hands over to the generic one where no rule
+matches and the lex would end or recover, so incomplete lexes and error
+recovery behave the same.
+'''
+import os
+import re
+import sys
+import hashlib
+import tempfile
+import importlib.util
+
+from rexlex.lexer.tokendefs import TOKEN, WORDS, GROUPS
+
+
+# Bump when the generated code changes, to invalidate cached modules.
+VERSION = 4
+
+_HEADER = '''\
+# Generated by rexlex.lexer.codegen from %(lexer)s.
+# Do not edit; delete this file to have it regenerated.
+
+KEY = %(key)r
+
+
+def bind(states, skip, dont_emit):
+    \'\'\'Bind the patterns and tokens of a StateTable's states and return
+    the lex generator and the push function.
+    \'\'\'
+'''
+
+_DRIVER = '''\
+    def %(name)s(lexer, text, pos, stack, bail_on_fail, max_stalled_scans,
+            counts%(args)s):
+        \'\'\'%(doc)s
+        Stops at the end of text, or leaves the rest to the generic engine
+        where no rule matches and the stack would run out (or at any
+        failed match if bail_on_fail), or when max_stalled_scans is
+        exceeded. Sets lexer.pos to where it stopped, and counts to the
+        number of tokens and the deepest stack.
+        \'\'\'
+        text_len = len(text)
+        last_pos = pos
+        stalled = 0
+        ntokens, max_depth = counts
+        # States that failed at failed_pos, with the position they skipped
+        # to, so a run of pops doesn't retry them there.
+        failed_pos = None
+        failed = {}
+        try:
+            while pos < text_len:
+                state = stack[-1] if stack else %(root)d
+                if pos == failed_pos and state in failed:
+                    new_pos, items, transition = failed[state], None, None
+                else:
+                    new_pos, items, transition = state_funcs[state](text, pos)
+                    if items is None:
+                        if pos != failed_pos:
+                            failed_pos = pos
+                            failed = {}
+                        failed[state] = new_pos
+                if items is None and (bail_on_fail or len(stack) <= 1):
+                    break
+                if new_pos == last_pos:
+                    stalled += 1
+                    if max_stalled_scans is not None and \\
+                            max_stalled_scans < stalled:
+                        break
+                else:
+                    last_pos = new_pos
+                    stalled = 0
+                pos = new_pos
+                if items is None:
+                    stack.pop()%(on_state)s
+                    continue
+                if items:
+                    ntokens += len(items)
+                    lexer.pos = pos
+                    for %(emit)s
+                if transition is not None:
+                    transition(stack)
+                    if max_depth < len(stack):
+                        max_depth = len(stack)%(on_state)s
+            lexer.pos = pos
+        finally:
+            counts[:] = ntokens, max_depth
+'''
+
+_LEX = {
+    'name': 'lex',
+    'args': '',
+    'doc': 'Yield (start, end, token) tuples from pos, updating stack in\n'
+           '        place.',
+    'emit': 'item in items:\n'
+            '                        yield item',
+    'on_state': '',
+}
+
+_PUSH = {
+    'name': 'push',
+    'args': ',\n             on_token, token_ids, on_state',
+    'doc': 'Call on_token(start, end, token_id) for each token from pos,\n'
+           '        and on_state(pos, state, depth) after each change of the\n'
+           '        stack if on_state is given, updating stack in place.',
+    'emit': 'start, end, token in items:\n'
+            '                        on_token(start, end, token_ids[token])',
+    'on_state': '\n'
+                '                    if on_state is not None:\n'
+                '                        on_state(pos, stack[-1] if stack '
+                'else %(root)d, len(stack))',
+}
+
+
+def _groups(rgx):
+    '''Number of groups of a compiled pattern or matcher, or None if it's
+    unknown.
+    '''
+    groups = getattr(rgx, 'groups', None)
+    if isinstance(groups, int):
+        return groups
+    run = getattr(rgx, 'run', None)
+    groups = getattr(getattr(run, '__self__', None), 'groups', None)
+    if isinstance(groups, int):
+        return groups
+    if hasattr(rgx, 'literal'):
+        return 0
+    return None
+
+
+def describe(statetable, dont_emit=frozenset(), has_skip=False):
+    '''The shape of a StateTable that the generated source depends on, as
+    nested tuples.
+    '''
+    states = []
+    for rules in statetable.states:
+        shapes = []
+        for rule in rules:
+            if rule.kind == GROUPS:
+                emitted = tuple(
+                    token not in dont_emit for token in rule.token)
+                groups = tuple(_groups(rgx) for rgx in rule.rgxs)
+            else:
+                emitted = rule.kind == WORDS or rule.token not in dont_emit
+                groups = (None,) * len(rule.rgxs)
+            popset = tuple(sorted(rule.popset)) if rule.popset else None
+            shapes.append((
+                rule.kind, emitted, groups, rule.npop, popset, rule.pushes))
+        states.append(tuple(shapes))
+    return (VERSION, statetable.ids['root'], has_skip, bool(dont_emit),
+            tuple(states))
+
+
+def key(description):
+    return hashlib.sha1(repr(description).encode('utf-8')).hexdigest()
+
+
+def _transition_source(name, npop, popset, pushes):
+    lines = ['    def %s(stack):' % name]
+    if npop:
+        lines.append('        del stack[-%d:]' % npop)
+    if popset:
+        lines.append('        while stack and stack[-1] in %s_popset:' % name)
+        lines.append('            stack.pop()')
+        lines.insert(0, '    %s_popset = frozenset(%r)' % (name, popset))
+    if len(pushes) == 1:
+        lines.append('        stack.append(%d)' % pushes[0])
+    elif pushes:
+        lines.append('        stack.extend(%r)' % (pushes,))
+    return lines
+
+
+def _emit_source(kind, emitted, groups, dont_emit, token, transition):
+    '''Lines that build the tokens of a match m at pos and return them.
+    '''
+    lines = []
+    if kind == TOKEN:
+        if emitted:
+            lines.append('start, end = m.span()')
+            lines.append('return end, [(start, end, %s)], %s' % (
+                token, transition))
+        else:
+            lines.append('return m.end(), [], %s' % transition)
+    elif kind == WORDS:
+        lines.append('start, end = m.span()')
+        if dont_emit:
+            lines.append('if m.token in dont_emit:')
+            lines.append('    return end, [], %s' % transition)
+        lines.append('return end, [(start, end, m.token)], %s' % (
+            transition,))
+    elif groups is None:
+        # The matcher's group count isn't known up front.
+        lines.append('items = []')
+        lines.append(
+            'for group, group_token in enumerate(%s[:len(m.groups())], 1):'
+            % token)
+        lines.append('    start, end = m.span(group)')
+        condition = 'start != -1'
+        if dont_emit:
+            condition += ' and group_token not in dont_emit'
+        lines.append('    if %s:' % condition)
+        lines.append('        items.append((start, end, group_token))')
+        lines.append('return m.end(), items, %s' % transition)
+    else:
+        lines.append('items = []')
+        for index in range(min(groups, len(emitted))):
+            if not emitted[index]:
+                continue
+            lines.append('start, end = m.span(%d)' % (index + 1))
+            lines.append('if start != -1:')
+            lines.append('    items.append((start, end, %s[%d]))' % (
+                token, index))
+        lines.append('return m.end(), items, %s' % transition)
+    return lines
+
+
+def generate_source(description, lexer_name='a lexer'):
+    '''Python source of a module for a StateTable description.
+    '''
+    version, root, has_skip, has_dont_emit, states = description
+    lines = (_HEADER % {'lexer': lexer_name, 'key': key(description)}
+             ).splitlines()
+    transitions = {}
+    state_funcs = []
+    for state_id, rules in enumerate(states):
+        bindings = []
+        body = []
+        if has_skip and 1 < len(rules):
+            body.append('again = True')
+        for rule_index, rule in enumerate(rules):
+            kind, emitted, groups, npop, popset, pushes = rule
+            prefix = '%d_%d' % (state_id, rule_index)
+            bindings.append('rule_%s = states[%d][%d]' % (
+                prefix, state_id, rule_index))
+            if kind != WORDS:
+                bindings.append('token_%s = rule_%s.token' % (prefix, prefix))
+
+            transition = 'None'
+            if npop or popset or pushes:
+                op = (npop, popset, pushes)
+                transition = transitions.get(op)
+                if transition is None:
+                    transition = 'transition_%d' % len(transitions)
+                    transitions[op] = transition
+
+            body.append('# Rule %d.' % rule_index)
+            if has_skip:
+                # Like the generic engine, re_skip is applied before each
+                # rule, but it only needs rerunning if it last advanced.
+                skip_lines = [
+                    'm = skip(text, pos)',
+                    'if m and m.end() != pos:',
+                    '    pos = m.end()',
+                ]
+                if 1 < len(rules):
+                    skip_lines += ['else:', '    again = False']
+                if rule_index:
+                    body.append('if again:')
+                    body.extend('    ' + line for line in skip_lines)
+                else:
+                    body.extend(skip_lines)
+            for rgx_index, rgx_groups in enumerate(groups):
+                match_name = 'match_%s_%d' % (prefix, rgx_index)
+                bindings.append('%s = rule_%s.rgxs[%d].match' % (
+                    match_name, prefix, rgx_index))
+                body.append('m = %s(text, pos)' % match_name)
+                body.append('if m:')
+                body.extend('    ' + line for line in _emit_source(
+                    kind, emitted, rgx_groups, has_dont_emit,
+                    'token_' + prefix, transition))
+        body.append('return pos, None, None')
+
+        lines.append('')
+        lines.extend('    ' + line for line in bindings)
+        lines.append('')
+        lines.append('    def state_%d(text, pos):' % state_id)
+        lines.extend('        ' + line for line in body)
+        state_funcs.append('state_%d' % state_id)
+
+    for op, name in sorted(transitions.items(), key=lambda item: item[1]):
+        lines.append('')
+        lines.extend(_transition_source(name, *op))
+
+    lines.append('')
+    lines.append('    state_funcs = (%s,)' % ', '.join(state_funcs))
+    lines.append('')
+    for driver in (_LEX, _PUSH):
+        driver = dict(driver, root=root)
+        driver['on_state'] = driver['on_state'] % driver
+        lines.extend((_DRIVER % driver).splitlines())
+        lines.append('')
+    lines.append('    return lex, push')
+    return '\n'.join(lines) + '\n'
+
+
+def default_dir():
+    '''Directory generated modules are cached in: $REXLEX_CODEGEN_DIR, or
+    rexlex/codegen under the user's cache directory.
+    '''
+    directory = os.environ.get('REXLEX_CODEGEN_DIR')
+    if directory:
+        return directory
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+        os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'rexlex', 'codegen')
+
+
+def _import(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _exec(name, source):
+    module = type(sys)(name)
+    exec(compile(source, '<%s>' % name, 'exec'), module.__dict__)
+    return module
+
+
+def _write(path, source):
+    '''Write source to path atomically, so concurrent processes never
+    import a partial file.
+    '''
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(source)
+        os.rename(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def load_module(lexer_cls, directory=None):
+    '''Return the generated module for a lexer class, importing it from
+    the cache directory if it's there and generating it otherwise. If the
+    directory can't be written to, the module is only built in memory.
+    '''
+    dont_emit = frozenset(getattr(lexer_cls, 'dont_emit', ()))
+    has_skip = getattr(lexer_cls, 're_skip', None) is not None
+    description = describe(lexer_cls._statetable, dont_emit, has_skip)
+    name = 'rexlex_codegen_' + key(description)
+    if directory is None:
+        directory = default_dir()
+    path = os.path.join(directory, name + '.py')
+    if os.path.exists(path):
+        module = _import(name, path)
+        if getattr(module, 'KEY', None) == key(description):
+            return module
+    lexer_name = '%s.%s' % (lexer_cls.__module__, lexer_cls.__name__)
+    source = generate_source(description, lexer_name)
+    try:
+        _write(path, source)
+    except (IOError, OSError):
+        return _exec(name, source)
+    return _import(name, path)
+
+
+def bind(lexer_cls, directory=None):
+    '''Return the generated (lex, push) functions for a lexer class, bound
+    to its compiled states.
+    '''
+    module = load_module(lexer_cls, directory)
+    re_skip = getattr(lexer_cls, 're_skip', None)
+    skip = None if re_skip is None else re.compile(re_skip).match
+    dont_emit = frozenset(getattr(lexer_cls, 'dont_emit', ()))
+    return module.bind(lexer_cls._states, skip, dont_emit)
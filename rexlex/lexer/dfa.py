@@ -0,0 +1,547 @@
+'''Table-driven DFA engine for the regular subset of a lexer's patterns.
+
+``re`` is a backtracking engine and the generic driver calls it once per
+rule, so a state with many rules may try dozens of regexes at a position
+before one matches. Here, every pattern in a state that is truly regular
+(no backreferences, lookaround, anchors or atomic groups) is compiled
+into a single minimized DFA. One pass over the input then tells which of
+those patterns can match at a position, and the driver only needs to run
+``re`` on the first one to get its exact span. Patterns the DFA can't
+handle are still tried with ``re``, in their original order.
+
+Input characters are mapped to a small number of equivalence classes, so
+the transition table is a flat ``array`` of ``nstates * nclasses`` ints.
+'''
+import re
+import sys
+from array import array
+from bisect import bisect_right
+from collections import defaultdict
+from itertools import product
+
+try:
+    from re import _parser as sre_parse, _constants as sre_constants
+except ImportError:
+    import sre_parse
+    import sre_constants
+
+try:
+    from _sre import unicode_iscased
+except ImportError:
+    def unicode_iscased(code):
+        char = unichr(code)
+        return char != char.lower() or char != char.upper()
+
+from rexlex.lexer.matchers import LiteralMatcher
+from rexlex.lexer.py2compat import str, unicode, bytes, basestring
+
+try:
+    unichr
+except NameError:
+    unichr = chr
+
+
+# Priority value used for "no pattern matches".
+NOMATCH = 0x7fffffff
+
+_c = sre_constants
+_LITERAL = _c.LITERAL
+_NOT_LITERAL = _c.NOT_LITERAL
+_ANY = _c.ANY
+_IN = _c.IN
+_BRANCH = _c.BRANCH
+_SUBPATTERN = _c.SUBPATTERN
+_MAX_REPEAT = _c.MAX_REPEAT
+_MIN_REPEAT = _c.MIN_REPEAT
+_RANGE = _c.RANGE
+_NEGATE = _c.NEGATE
+_CATEGORY = _c.CATEGORY
+_MAXREPEAT = _c.MAXREPEAT
+
+_CATEGORIES = {
+    _c.CATEGORY_DIGIT: ('digit', True),
+    _c.CATEGORY_NOT_DIGIT: ('digit', False),
+    _c.CATEGORY_SPACE: ('space', True),
+    _c.CATEGORY_NOT_SPACE: ('space', False),
+    _c.CATEGORY_WORD: ('word', True),
+    _c.CATEGORY_NOT_WORD: ('word', False),
+}
+
+_ASCII_SPACE = frozenset(b' \t\n\r\f\v' if bytes is not str else
+                         map(ord, ' \t\n\r\f\v'))
+
+
+def _in_category(base, ascii, code):
+    if ascii:
+        if 128 <= code:
+            return False
+        if base == 'space':
+            return code in _ASCII_SPACE
+        if base == 'digit':
+            return 48 <= code <= 57
+        return code == 95 or unichr(code).isalnum()
+    char = unichr(code)
+    if base == 'space':
+        return char.isspace()
+    if base == 'digit':
+        return char.isdecimal()
+    return char == '_' or char.isalnum()
+
+
+class Unsupported(Exception):
+    '''Raised for patterns the DFA engine can't represent.
+    '''
+
+
+class TooLarge(Exception):
+    '''Raised when subset construction exceeds ``max_states``.
+    '''
+
+
+class _Charset(tuple):
+    '''(negate, ranges, categories); ranges are inclusive code point
+    pairs, categories are (base, positive, ascii) triples.
+    '''
+    __slots__ = ()
+
+    def __new__(cls, ranges=(), categories=(), negate=False):
+        return tuple.__new__(
+            cls, (negate, tuple(sorted(ranges)), frozenset(categories)))
+
+    def matches(self, lo, bits, catindex):
+        negate, ranges, categories = self
+        for start, end in ranges:
+            if start <= lo <= end:
+                return not negate
+        for base, positive, ascii in categories:
+            if bits[catindex[base, ascii]] == positive:
+                return not negate
+        return negate
+
+
+class _NFA(object):
+    '''Thompson NFA over charsets, built from ``sre_parse`` trees.
+    '''
+    max_repeat = 64
+
+    def __init__(self, maxcode):
+        self.maxcode = maxcode
+        self.eps = []
+        self.edges = []
+        self.final = {}
+        self.charsets = []
+        self._charset_ids = {}
+        self.start = self.new()
+
+    def new(self):
+        self.eps.append([])
+        self.edges.append([])
+        return len(self.eps) - 1
+
+    def add_pattern(self, pattern, flags, priority):
+        '''Add a pattern; raise Unsupported if it isn't regular.
+        '''
+        try:
+            tree = sre_parse.parse(pattern, flags)
+        except Exception as exc:
+            raise Unsupported(str(exc))
+        flags |= tree.state.flags
+        if flags & re.LOCALE:
+            raise Unsupported('LOCALE flag')
+        self._is_bytes = isinstance(pattern, bytes) and bytes is not str
+        # Roll back on failure so a rejected pattern leaves no stray states.
+        mark = len(self.eps), len(self.charsets)
+        try:
+            start = self.new()
+            end = self._build(tree, start, flags)
+        except Unsupported:
+            del self.eps[mark[0]:]
+            del self.edges[mark[0]:]
+            for charset in self.charsets[mark[1]:]:
+                del self._charset_ids[charset]
+            del self.charsets[mark[1]:]
+            raise
+        self.eps[self.start].append(start)
+        self.final[end] = priority
+
+    def _edge(self, state, charset):
+        charset_id = self._charset_ids.get(charset)
+        if charset_id is None:
+            charset_id = self._charset_ids[charset] = len(self.charsets)
+            self.charsets.append(charset)
+        target = self.new()
+        self.edges[state].append((charset_id, target))
+        return target
+
+    def _ascii(self, flags):
+        return self._is_bytes or bool(flags & re.ASCII)
+
+    def _fold(self, ranges, flags):
+        '''Apply IGNORECASE to a list of ranges.
+        '''
+        if not flags & re.IGNORECASE:
+            return ranges
+        if self._ascii(flags):
+            folded = list(ranges)
+            for start, end in ranges:
+                for lo, hi, shift in ((65, 90, 32), (97, 122, -32)):
+                    lo, hi = max(start, lo), min(end, hi)
+                    if lo <= hi:
+                        folded.append((lo + shift, hi + shift))
+            return folded
+        # Unicode case folding isn't modelled; only uncased characters,
+        # which re also matches exactly, are supported.
+        for start, end in ranges:
+            if 0x10000 < end - start:
+                raise Unsupported('IGNORECASE range too wide')
+            for code in range(start, end + 1):
+                if unicode_iscased(code):
+                    raise Unsupported('IGNORECASE with cased characters')
+        return ranges
+
+    def _category(self, category, flags):
+        base, positive = _CATEGORIES[category]
+        return base, positive, self._ascii(flags)
+
+    def _build(self, items, state, flags):
+        for op, av in items:
+            state = self._build_op(op, av, state, flags)
+        return state
+
+    def _build_op(self, op, av, state, flags):
+        if op is _LITERAL or op is _NOT_LITERAL:
+            ranges = self._fold([(av, av)], flags)
+            return self._edge(state, _Charset(ranges, (), op is _NOT_LITERAL))
+
+        elif op is _ANY:
+            if flags & re.DOTALL:
+                return self._edge(state, _Charset([(0, self.maxcode)]))
+            return self._edge(state, _Charset([(10, 10)], (), True))
+
+        elif op is _IN:
+            negate = False
+            ranges = []
+            categories = []
+            for subop, subav in av:
+                if subop is _NEGATE:
+                    negate = True
+                elif subop is _LITERAL:
+                    ranges.append((subav, subav))
+                elif subop is _RANGE:
+                    ranges.append(subav)
+                elif subop is _CATEGORY and subav in _CATEGORIES:
+                    categories.append(self._category(subav, flags))
+                else:
+                    raise Unsupported(subop)
+            ranges = self._fold(ranges, flags)
+            return self._edge(state, _Charset(ranges, categories, negate))
+
+        elif op is _BRANCH:
+            end = self.new()
+            for alternative in av[1]:
+                start = self.new()
+                self.eps[state].append(start)
+                self.eps[self._build(alternative, start, flags)].append(end)
+            return end
+
+        elif op is _SUBPATTERN:
+            group, add_flags, del_flags, items = av
+            return self._build(items, state, (flags | add_flags) & ~del_flags)
+
+        elif op is _MAX_REPEAT or op is _MIN_REPEAT:
+            lo, hi, items = av
+            if self.max_repeat < (lo + 1 if hi is _MAXREPEAT else hi):
+                raise Unsupported('repeat count too large')
+            for _ in range(lo):
+                state = self._build(items, state, flags)
+            if hi is _MAXREPEAT:
+                loop = self.new()
+                self.eps[state].append(loop)
+                self.eps[self._build(items, loop, flags)].append(loop)
+                return loop
+            end = self.new()
+            self.eps[state].append(end)
+            for _ in range(hi - lo):
+                state = self._build(items, state, flags)
+                self.eps[state].append(end)
+            return end
+
+        raise Unsupported(op)
+
+
+class DFA(object):
+    '''Minimized DFA for the regular patterns of one lexer state.
+
+    ``match_index(text, pos)`` returns the priority (index) of the first
+    pattern that matches some prefix of ``text[pos:]``, or NOMATCH.
+    '''
+    max_states = 4096
+
+    def __init__(self, patterns, max_states=None):
+        '''Patterns is a list of (pattern, flags) pairs, or None for
+        patterns that must be handled by ``re``.
+        '''
+        if max_states is not None:
+            self.max_states = max_states
+        is_bytes = any(
+            isinstance(p[0], bytes) and bytes is not str
+            for p in patterns if p is not None)
+        maxcode = 0xff if is_bytes else sys.maxunicode
+        nfa = _NFA(maxcode)
+        self.supported = supported = []
+        for priority, pattern in enumerate(patterns):
+            ok = False
+            if pattern is not None:
+                try:
+                    nfa.add_pattern(pattern[0], pattern[1], priority)
+                    ok = True
+                except Unsupported:
+                    pass
+            supported.append(ok)
+        self.is_bytes = is_bytes
+        self._build_classes(nfa)
+        self._build_table(nfa)
+
+    def __repr__(self):
+        return '<DFA: %d states, %d classes, %d/%d patterns>' % (
+            self.nstates, self.nclasses, sum(self.supported),
+            len(self.supported))
+
+    # -----------------------------------------------------------------------
+    # Character classes.
+    # -----------------------------------------------------------------------
+    def _build_classes(self, nfa):
+        bounds = set([0, nfa.maxcode + 1])
+        catkeys = set()
+        for negate, ranges, categories in nfa.charsets:
+            for start, end in ranges:
+                bounds.add(start)
+                bounds.add(end + 1)
+            for base, positive, ascii in categories:
+                catkeys.add((base, ascii))
+        self.bounds = bounds = sorted(bounds)
+        self.catkeys = catkeys = sorted(catkeys)
+        self.catindex = catindex = dict(
+            (key, i) for i, key in enumerate(catkeys))
+
+        # Each class is an (interval index, category bits) signature.
+        # Small intervals are enumerated exactly; big ones get every
+        # combination of bits, some of which may never occur.
+        signatures = []
+        for i, (lo, hi) in enumerate(zip(bounds, bounds[1:])):
+            if hi - lo <= 256:
+                combos = set(
+                    self._bits(code) for code in range(lo, hi))
+                combos = sorted(combos)
+            else:
+                combos = list(product((False, True), repeat=len(catkeys)))
+            signatures.extend((i, bits) for bits in combos)
+        self.classes = dict(
+            (signature, i) for i, signature in enumerate(signatures))
+        self.nclasses = len(signatures)
+
+        charset_classes = []
+        for charset in nfa.charsets:
+            charset_classes.append([
+                cls_id for (i, bits), cls_id in self.classes.items()
+                if charset.matches(bounds[i], bits, catindex)])
+        self.charset_classes = charset_classes
+
+        self._cache = {}
+        if self.is_bytes:
+            for code in range(256):
+                self._cache[code] = self._classify(code)
+        else:
+            for code in range(128):
+                self._cache[unichr(code)] = self._classify(code)
+
+    def _bits(self, code):
+        return tuple(
+            _in_category(base, ascii, code) for base, ascii in self.catkeys)
+
+    def _classify(self, code):
+        i = bisect_right(self.bounds, code) - 1
+        return self.classes[i, self._bits(code)]
+
+    def classify(self, char):
+        cls_id = self._cache.get(char)
+        if cls_id is None:
+            code = char if self.is_bytes else ord(char)
+            cls_id = self._cache[char] = self._classify(code)
+        return cls_id
+
+    # -----------------------------------------------------------------------
+    # Subset construction and minimization.
+    # -----------------------------------------------------------------------
+    def _build_table(self, nfa):
+        eps = nfa.eps
+        edges = nfa.edges
+        final = nfa.final
+        nclasses = self.nclasses
+        charset_classes = self.charset_classes
+
+        closures = {}
+
+        def closure(states):
+            key = frozenset(states)
+            result = closures.get(key)
+            if result is None:
+                stack = list(states)
+                seen = set(stack)
+                while stack:
+                    for nxt in eps[stack.pop()]:
+                        if nxt not in seen:
+                            seen.add(nxt)
+                            stack.append(nxt)
+                result = closures[key] = frozenset(seen)
+            return result
+
+        start = closure([nfa.start])
+        ids = {start: 0}
+        sets = [start]
+        rows = []
+        accept = []
+        while len(rows) < len(sets):
+            current = sets[len(rows)]
+            accept.append(min(
+                [final[s] for s in current if s in final] or [NOMATCH]))
+            targets = defaultdict(set)
+            for state in current:
+                for charset_id, target in edges[state]:
+                    for cls_id in charset_classes[charset_id]:
+                        targets[cls_id].add(target)
+            row = []
+            for cls_id in range(nclasses):
+                target = closure(targets.get(cls_id, ()))
+                target_id = ids.get(target)
+                if target_id is None:
+                    target_id = ids[target] = len(sets)
+                    sets.append(target)
+                    if self.max_states < len(sets):
+                        raise TooLarge()
+                row.append(target_id)
+            rows.append(row)
+
+        rows, accept = self._minimize(rows, accept)
+        self.nstates = nstates = len(rows)
+        self.accept = array('i', accept)
+        self.reach = array('i', self._reach(rows, accept))
+
+        typecode = 'B' if nstates <= 0xff else 'H' if nstates <= 0xffff else 'i'
+        table = array(typecode)
+        for row in rows:
+            table.extend(row)
+        self.table = table
+
+    @staticmethod
+    def _minimize(rows, accept):
+        '''Moore's partition refinement; state 0 stays the start state.
+        '''
+        blocks = dict((value, i) for i, value in enumerate(sorted(set(accept))))
+        partition = [blocks[value] for value in accept]
+        while True:
+            signatures = {}
+            refined = []
+            for state, row in enumerate(rows):
+                key = (partition[state],) + tuple(partition[t] for t in row)
+                refined.append(signatures.setdefault(key, len(signatures)))
+            if len(signatures) == len(set(partition)):
+                break
+            partition = refined
+
+        # Renumber blocks so the start state's block comes first.
+        order = {}
+        for state in range(len(rows)):
+            order.setdefault(partition[state], len(order))
+        new_rows = [None] * len(order)
+        new_accept = [None] * len(order)
+        for state, row in enumerate(rows):
+            block = order[partition[state]]
+            if new_rows[block] is None:
+                new_rows[block] = [order[partition[t]] for t in row]
+                new_accept[block] = accept[state]
+        return new_rows, new_accept
+
+    @staticmethod
+    def _reach(rows, accept):
+        '''For each state, the best priority reachable from it.
+        '''
+        reverse = defaultdict(set)
+        for state, row in enumerate(rows):
+            for target in row:
+                reverse[target].add(state)
+        reach = [NOMATCH] * len(rows)
+        for state in sorted(range(len(rows)), key=accept.__getitem__):
+            priority = accept[state]
+            if priority == NOMATCH:
+                break
+            if reach[state] <= priority:
+                continue
+            stack = [state]
+            reach[state] = priority
+            while stack:
+                for prev in reverse[stack.pop()]:
+                    if priority < reach[prev]:
+                        reach[prev] = priority
+                        stack.append(prev)
+        return reach
+
+    # -----------------------------------------------------------------------
+    # Matching.
+    # -----------------------------------------------------------------------
+    def match_index(self, text, pos):
+        table = self.table
+        accept = self.accept
+        reach = self.reach
+        nclasses = self.nclasses
+        cache = self._cache
+        classify = self.classify
+
+        state = 0
+        best = accept[0]
+        text_len = len(text)
+        while best > reach[state] and pos < text_len:
+            char = text[pos]
+            cls_id = cache.get(char)
+            if cls_id is None:
+                cls_id = classify(char)
+            state = table[state * nclasses + cls_id]
+            if accept[state] < best:
+                best = accept[state]
+            pos += 1
+        return best
+
+
+def rule_patterns(rules):
+    '''Flatten the regexes of compiled rules into (pattern, flags) pairs,
+    with None for matchers the DFA can't model.
+    '''
+    re_type = type(re.compile(''))
+    patterns = []
+    for rule in rules:
+        for rgx in rule.rgxs:
+            if isinstance(rgx, (re_type, LiteralMatcher)):
+                patterns.append((rgx.pattern, rgx.flags))
+            else:
+                patterns.append(None)
+    return patterns
+
+
+def compile_states(tokendefs, max_states=None):
+    '''Build a DFA for each state of compiled ``tokendefs``. States with
+    no regular patterns, or whose DFA would be too large, map to None.
+    '''
+    dfas = {}
+    for state, rules in tokendefs.items():
+        patterns = rule_patterns(rules)
+        dfa = None
+        if any(p is not None for p in patterns):
+            try:
+                dfa = DFA(patterns, max_states)
+            except TooLarge:
+                pass
+            else:
+                if not any(dfa.supported):
+                    dfa = None
+        dfas[state] = dfa
+    return dfas
@@ -0,0 +1,149 @@
+'''Structured trace events and the lexer's flight recorder.
+
+Every lexer keeps the last ``flight_recorder_size`` events in a ring
+buffer. Events are plain tuples::
+
+    (kind, pos, state, rule, end)
+
+where ``state`` is an index into the lexer's state names and ``rule`` is
+the index of a rule within its state (-1 if not applicable). Recording
+one is a single ``deque.append``, so the recorder is always on. When a
+lex fails, the recorded events are rendered into the same messages the
+logging-based trace output uses, and attached to the exception.
+
+Events can also be saved to a compact binary trace file and replayed
+later::
+
+    python -m rexlex.lexer.replay trace.rxtr [source-file]
+'''
+import sys
+import struct
+from collections import deque
+
+
+# Event kinds.
+SCAN = 0        # Started scanning at pos in state.
+SKIP = 1        # re_skip advanced from pos to end.
+MATCH = 2       # Rule matched text[pos:end] in state.
+STATE = 3       # Transition; state is the new top state, rule the depth.
+POP = 4         # No rule matched at pos; popped state.
+FINISH = 5      # Ran out of states at pos.
+RECOVER = 6     # Skipped unmatched text[pos:end], resuming in state.
+
+KIND_NAMES = ('SCAN', 'SKIP', 'MATCH', 'STATE', 'POP', 'FINISH', 'RECOVER')
+
+MAGIC = b'RXTR'
+VERSION = 1
+_EVENT = struct.Struct('<Bqiiq')
+_COUNT = struct.Struct('<I')
+
+
+class FlightRecorder(deque):
+    '''Ring buffer of the most recent trace events. With ``size=None``
+    every event is kept.
+    '''
+
+    def __init__(self, size=256, states=()):
+        super(FlightRecorder, self).__init__((), size)
+        self.states = states
+
+    def render(self, text=None):
+        return render(self, self.states, text)
+
+    def write(self, fileobj):
+        write_events(fileobj, self, self.states)
+
+
+def render(events, states, text=None, messages=None):
+    '''Render events as the human-readable trace messages. If the lexed
+    text is given, matched and skipped text is shown too.
+    '''
+    if messages is None:
+        from rexlex.lexer.lexer import Lexer
+        messages = Lexer._msg
+
+    def state_name(state_id):
+        if 0 <= state_id < len(states):
+            return states[state_id]
+        return state_id
+
+    lines = []
+    for kind, pos, state, rule, end in events:
+        name = state_name(state)
+        if kind == SCAN:
+            line = messages.SCAN_POS % pos
+            line += ' (%s)' % (messages.SCAN_STATE % name).strip()
+        elif kind == SKIP:
+            if text is not None:
+                line = messages.PROCESS_RULE_SKIPPED % text[pos:end]
+            else:
+                line = messages.PROCESS_RULE_ADVANCING % (pos, end)
+        elif kind == MATCH:
+            if text is not None:
+                line = messages.PROCESS_RULE_MATCH_FOUND % (text[pos:end],)
+            else:
+                line = messages.PROCESS_RULE_ADVANCING % (pos, end)
+            line += ' (rule #%d of %r, pos %r to %r)' % (rule, name, pos, end)
+        elif kind == STATE:
+            line = messages.UPDATE_PUSH % name
+            line += ' (depth %d)' % rule
+        elif kind == POP:
+            line = messages.SCAN_POPPING % name
+        elif kind == FINISH:
+            line = messages.SCAN_STATES_EXHAUSTED + ' (pos %r)' % pos
+        elif kind == RECOVER:
+            skipped = text[pos:end] if text is not None else (pos, end)
+            line = messages.RECOVER % (skipped, end, name)
+        else:
+            line = 'unknown event %r' % ((kind, pos, state, rule, end),)
+        lines.append(line)
+    return lines
+
+
+def write_events(fileobj, events, states):
+    '''Write events and the state name table to a binary trace file.
+    '''
+    fileobj.write(MAGIC + bytearray((VERSION,)))
+    fileobj.write(_COUNT.pack(len(states)))
+    for state in states:
+        data = state.encode('utf-8')
+        fileobj.write(_COUNT.pack(len(data)) + data)
+    for event in events:
+        fileobj.write(_EVENT.pack(*event))
+
+
+def read_events(fileobj):
+    '''Return (events, states) from a binary trace file.
+    '''
+    header = fileobj.read(len(MAGIC) + 1)
+    if header[:len(MAGIC)] != MAGIC:
+        raise ValueError('Not a rexlex trace file.')
+    nstates, = _COUNT.unpack(fileobj.read(_COUNT.size))
+    states = []
+    for _ in range(nstates):
+        size, = _COUNT.unpack(fileobj.read(_COUNT.size))
+        states.append(fileobj.read(size).decode('utf-8'))
+    data = fileobj.read()
+    events = [
+        _EVENT.unpack_from(data, offset)
+        for offset in range(0, len(data) - _EVENT.size + 1, _EVENT.size)]
+    return events, states
+
+
+def main(argv=None):
+    '''Replay a binary trace file as human-readable messages.
+    '''
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        sys.stderr.write('usage: python -m rexlex.lexer.replay '
+                         'TRACEFILE [SOURCEFILE]\n')
+        return 2
+    with open(argv[0], 'rb') as f:
+        events, states = read_events(f)
+    text = None
+    if 1 < len(argv):
+        with open(argv[1]) as f:
+            text = f.read()
+    for line in render(events, states, text):
+        sys.stdout.write(line + '\n')
+    return 0
@@ -22,3 +22,32 @@ class Finished(Exception):
 class MatchFound(Exception):
     '''Breaks the lexer loop when a match is found.
     '''
+
+
+class BudgetExceeded(Exception):
+    '''Raised when a lex runs over one of its budgets. ``pos`` is where
+    the lexer stopped, ``state`` the name of the state it was in and
+    ``rule`` the index of the offending rule in that state, or None if
+    no single rule is to blame.
+    '''
+    def __init__(self, message, pos=None, state=None, rule=None):
+        super(BudgetExceeded, self).__init__(message)
+        self.pos = pos
+        self.state = state
+        self.rule = rule
+
+
+class TimeBudgetExceeded(BudgetExceeded):
+    '''Raised when a lex takes longer than ``max_time`` seconds.
+    '''
+
+
+class TokenBudgetExceeded(BudgetExceeded):
+    '''Raised when a lex produces more than ``max_tokens`` tokens.
+    '''
+
+
+class NoProgress(BudgetExceeded):
+    '''Raised when the lexer scans ``max_stalled_scans`` times without
+    advancing, e.g. because a rule matches the empty string.
+    '''
@@ -0,0 +1,264 @@
+'''Token filters run over a lexer's output.
+
+Attach filters to a lexer class and they run whenever it's iterated::
+
+    class MyLexer(Lexer):
+        tokendefs = {...}
+        filters = [
+            Drop(Token.Text.Whitespace),
+            Remap({Token.Name.Builtin: Token.Name}),
+            Merge(Token.Text, Token.Comment),
+        ]
+
+A Pipeline works on (start, end, token_id) tuples, where token ids are
+small ints indexing ``Pipeline.tokens``. Stages that only look at one
+token's type (Drop, Remap) are composed into a single table from input
+token to output id, computed once per token type, and that lookup and
+any Merge that follows run in one loop. Lookahead stages need a window
+of tokens, so they run as separate generators between fused loops.
+'''
+import threading
+import collections
+
+from rexlex.lexer.tokentype import _TokenType
+
+
+def _matches(token, tokentypes):
+    '''Whether token is one of tokentypes, or a subtype of one.
+    '''
+    for tokentype in tokentypes:
+        if token == tokentype:
+            return True
+        if isinstance(tokentype, _TokenType) and token in tokentype:
+            return True
+    return False
+
+
+class TokenFilter(object):
+    '''Base for filters that map each token type to a new type, or to
+    None to drop the token, regardless of the surrounding tokens.
+    '''
+
+    def map_token(self, token):
+        raise NotImplementedError()
+
+
+class Drop(TokenFilter):
+    '''Drop tokens of the given types and their subtypes.
+    '''
+
+    def __init__(self, *tokentypes):
+        self.tokentypes = tokentypes
+
+    def map_token(self, token):
+        if _matches(token, self.tokentypes):
+            return None
+        return token
+
+
+class Remap(TokenFilter):
+    '''Replace token types according to a mapping. Only exact types are
+    remapped, not their subtypes.
+    '''
+
+    def __init__(self, mapping):
+        self.mapping = dict(mapping)
+
+    def map_token(self, token):
+        return self.mapping.get(token, token)
+
+
+class Merge(object):
+    '''Merge runs of adjacent tokens of the same type into one token. If
+    token types are given, only those types and their subtypes are
+    merged. With ``contiguous=False``, tokens separated by skipped text
+    are merged too.
+    '''
+
+    def __init__(self, *tokentypes, **kwargs):
+        self.tokentypes = tokentypes
+        self.contiguous = kwargs.pop('contiguous', True)
+        if kwargs:
+            raise TypeError('Unexpected arguments: %r' % sorted(kwargs))
+
+    def accepts(self, token):
+        return not self.tokentypes or _matches(token, self.tokentypes)
+
+
+class Lookahead(object):
+    '''Rewrite tokens based on the tokens that follow them. For each
+    token, ``func(token, following)`` is called with the (start, end,
+    token) tuple and a list of up to ``size`` following tuples, and
+    returns an iterable of tuples to emit in its place.
+    '''
+
+    def __init__(self, func, size=1):
+        self.func = func
+        self.size = size
+
+    def run(self, tokens):
+        func = self.func
+        window = collections.deque()
+        for token in tokens:
+            window.append(token)
+            if self.size < len(window):
+                current = window.popleft()
+                for result in func(current, list(window)):
+                    yield result
+        while window:
+            current = window.popleft()
+            for result in func(current, list(window)):
+                yield result
+
+
+class _Segment(object):
+    '''A run of TokenFilters, optionally followed by a Merge, executed as
+    a single loop.
+    '''
+
+    def __init__(self, pipeline, token_filters, merge, first):
+        self.pipeline = pipeline
+        self.token_filters = token_filters
+        self.merge = merge
+        # The first segment sees token types; later ones see token ids.
+        self.first = first
+        self.lookup = {}
+        self.mergeable = set()
+
+    def _resolve(self, key):
+        '''Compute and cache the output id for an input token or id.
+        '''
+        token = key if self.first else self.pipeline.tokens[key]
+        for token_filter in self.token_filters:
+            token = token_filter.map_token(token)
+            if token is None:
+                break
+        if token is None:
+            token_id = -1
+        else:
+            token_id = self.pipeline.intern(token)
+            if self.merge is not None and self.merge.accepts(token):
+                self.mergeable.add(token_id)
+        self.lookup[key] = token_id
+        return token_id
+
+    def run(self, tokens):
+        lookup = self.lookup
+        resolve = self._resolve
+        if self.merge is None:
+            for start, end, key in tokens:
+                token_id = lookup.get(key)
+                if token_id is None:
+                    token_id = resolve(key)
+                if 0 <= token_id:
+                    yield start, end, token_id
+            return
+
+        mergeable = self.mergeable
+        contiguous = self.merge.contiguous
+        prev_id = -1
+        prev_start = prev_end = None
+        for start, end, key in tokens:
+            token_id = lookup.get(key)
+            if token_id is None:
+                token_id = resolve(key)
+            if token_id < 0:
+                continue
+            if token_id == prev_id and token_id in mergeable and (
+                    prev_end == start or not contiguous):
+                prev_end = end
+                continue
+            if 0 <= prev_id:
+                yield prev_start, prev_end, prev_id
+            prev_start, prev_end, prev_id = start, end, token_id
+        if 0 <= prev_id:
+            yield prev_start, prev_end, prev_id
+
+
+class _TokenIds(dict):
+    '''Maps token types to ids, assigning new ids on lookup.
+    '''
+    __slots__ = ('pipeline',)
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+
+    def __missing__(self, token):
+        return self.pipeline.intern(token)
+
+
+class Pipeline(object):
+    '''Runs a sequence of filters over (start, end, token) tuples and
+    yields (start, end, token_id) tuples; ``tokens[token_id]`` is the
+    token type, and ``ids[token]`` the id of a token type. Caches are
+    shared by every run of the pipeline.
+    '''
+
+    def __init__(self, filters):
+        self.filters = list(filters)
+        self.tokens = []
+        self.ids = _TokenIds(self)
+        self._lock = threading.Lock()
+        self.stages = self._plan(self.filters)
+
+    def _plan(self, filters):
+        stages = []
+        token_filters = []
+        for stage in filters:
+            if isinstance(stage, TokenFilter):
+                token_filters.append(stage)
+            elif isinstance(stage, Merge):
+                stages.append(_Segment(
+                    self, token_filters, stage, not stages))
+                token_filters = []
+            elif isinstance(stage, Lookahead):
+                if token_filters or not stages:
+                    stages.append(_Segment(
+                        self, token_filters, None, not stages))
+                token_filters = []
+                stages.append(stage)
+            else:
+                raise TypeError('Not a token filter: %r' % (stage,))
+        if token_filters or not stages:
+            stages.append(_Segment(self, token_filters, None, not stages))
+        return stages
+
+    def intern(self, token):
+        '''Return the id of a token type, assigning one if needed.
+        '''
+        token_id = self.ids.get(token)
+        if token_id is None:
+            with self._lock:
+                token_id = self.ids.get(token)
+                if token_id is None:
+                    # Append first, so tokens[id] works once id is visible.
+                    self.tokens.append(token)
+                    token_id = self.ids[token] = len(self.tokens) - 1
+        return token_id
+
+    def _decode(self, tokens):
+        types = self.tokens
+        for start, end, token_id in tokens:
+            yield start, end, types[token_id]
+
+    def _encode(self, tokens):
+        intern = self.intern
+        for start, end, token in tokens:
+            yield start, end, intern(token)
+
+    def run(self, tokens):
+        '''Filter (start, end, token) tuples; yields (start, end, token_id)
+        tuples.
+        '''
+        for stage in self.stages:
+            if isinstance(stage, Lookahead):
+                tokens = self._encode(stage.run(self._decode(tokens)))
+            else:
+                tokens = stage.run(tokens)
+        return tokens
+
+    def __call__(self, tokens):
+        '''Filter (start, end, token) tuples into (start, end, token)
+        tuples.
+        '''
+        return self._decode(self.run(tokens))
@@ -0,0 +1,73 @@
+'''Stable fingerprints of lexer grammars.
+
+Two lexer classes with the same fingerprint produce the same tokens for
+any input, so the fingerprint can be used to key caches of lex results.
+'''
+import re
+import hashlib
+
+from rexlex.lexer.tokentype import _TokenType
+from rexlex.lexer.utils import include, words
+from rexlex.lexer.py2compat import str, unicode, bytes, basestring
+
+
+_re_type = type(re.compile(''))
+
+
+def canonical(obj):
+    '''Convert grammar objects into nested tuples with a stable repr.
+    '''
+    if isinstance(obj, _TokenType):
+        return ('token', obj.as_json())
+    if isinstance(obj, include):
+        return ('include', str(obj))
+    if isinstance(obj, _re_type):
+        return ('re', obj.pattern, obj.flags)
+    if isinstance(obj, words):
+        return ('words', canonical(obj.words), obj.pattern)
+    if isinstance(obj, basestring):
+        return obj
+    if isinstance(obj, dict):
+        items = [(canonical(key), canonical(value))
+                 for key, value in obj.items()]
+        return ('dict', tuple(sorted(items, key=repr)))
+    if isinstance(obj, (set, frozenset)):
+        return ('set', tuple(sorted(map(canonical, obj), key=repr)))
+    if isinstance(obj, (list, tuple)):
+        return tuple(canonical(item) for item in obj)
+    if isinstance(obj, type):
+        return ('class', obj.__module__, _qualname(obj))
+    code = getattr(obj, '__code__', None)
+    if code is not None:
+        # Functions, e.g. Lookahead callbacks or line_normalize; lambdas
+        # all share a name, so their code is part of the key.
+        return ('function', obj.__module__, _qualname(obj), code.co_code,
+                canonical([const for const in code.co_consts
+                           if not hasattr(const, 'co_code')]))
+    if hasattr(obj, '__dict__') and type(obj).__repr__ is object.__repr__:
+        # Filters and other plain objects; their default repr holds an
+        # address that changes between processes.
+        return ('object', canonical(type(obj)), canonical(vars(obj)))
+    return repr(obj)
+
+
+def _qualname(obj):
+    return getattr(obj, '__qualname__', obj.__name__)
+
+
+# Class attributes besides tokendefs that change a lexer's output.
+_OUTPUT_ATTRS = (
+    'flags', 're_skip', 'dont_emit', 'matchers', 'filters', 'recover',
+    'error_token', 'line_normalize')
+
+
+def fingerprint(lexer_cls):
+    '''Hex digest of a lexer's tokendefs and the class attributes that
+    affect its output: flags, re_skip, dont_emit, matchers, filters,
+    recover, error_token and line_normalize.
+    '''
+    attrs = [getattr(lexer_cls, 'tokendefs', None)]
+    attrs.extend(
+        (name, getattr(lexer_cls, name, None)) for name in _OUTPUT_ATTRS)
+    data = repr(canonical(attrs)).encode('utf-8')
+    return hashlib.sha1(data).hexdigest()
@@ -1,7 +1,9 @@
+import weakref
 from operator import itemgetter
 from collections import OrderedDict
 
-from rexlex.utils.cachedattr import CachedAttr
+from rexlex.lexer.lineindex import LineIndex
+from rexlex.utils.cachedattr import CachedAttr, CachedClassAttr
 
 
 class _ItemBase(tuple):
@@ -57,10 +59,49 @@ class _ItemBase(tuple):
         '''
         return self._text[self.start: self.end]
 
+    @CachedClassAttr
+    def line_index(cls):
+        '''Newline index of the text, built the first time any item from
+        the text needs it.
+        '''
+        return LineIndex(cls._text)
+
+    @property
+    def line(self):
+        return self.line_index.line(self[0])
+
+    @property
+    def col(self):
+        return self.line_index.position(self[0])[1]
+
+    @property
+    def end_position(self):
+        '''(line, col) of the item's end offset.
+        '''
+        return self.line_index.position(self[1])
+
+    @classmethod
+    def offset(cls, line, col):
+        '''Offset in the text of a (line, col) position.
+        '''
+        return cls.line_index.offset(line, col)
+
+
+# Item classes by id of their text. Lexers over the same text, e.g.
+# those started by a ScannerLexer, reuse its class and so share its line
+# index. Texts can't be weakly referenced, but an entry only lives as
+# long as its class, which holds the text, so the id can't be reused
+# while the entry exists.
+_itemclasses = weakref.WeakValueDictionary()
+
 
 def get_itemclass(text, _ItemBase=_ItemBase):
     '''Return an _ItemBase subclass with the given text as a class attr.
     Enables the Item class to optimize speed and memory use by creating
     token text lazily.
     '''
-    return type('Item', (_ItemBase,), dict(_text=text))
+    Item = _itemclasses.get(id(text))
+    if Item is None or Item._text is not text:
+        Item = type('Item', (_ItemBase,), dict(_text=text))
+        _itemclasses[id(text)] = Item
+    return Item
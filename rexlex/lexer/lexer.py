@@ -1,15 +1,25 @@
 import re
 import sys
+import time
 import logging
 import functools
 
 import rexlex
+import rexlex.metrics
+from rexlex import log_config
 from rexlex.config import LOG_MSG_MAXWIDTH
 from rexlex.lexer import tokendefs
+from rexlex.lexer.tokendefs import TOKEN, WORDS
+from rexlex.lexer import dfa
+from rexlex.lexer import codegen
+from rexlex.lexer import events
+from rexlex.lexer import recovery
+from rexlex.lexer import linememo
+from rexlex.lexer.filters import Pipeline
 from rexlex.lexer import exceptions
-from rexlex.lexer.utils import include, bygroups
+from rexlex.lexer.utils import include, bygroups, words
 from rexlex.lexer.itemclass import get_itemclass
-from rexlex.lexer.tokentype import _TokenType
+from rexlex.lexer.tokentype import _TokenType, Token
 from rexlex.lexer.py2compat import str, unicode, bytes, basestring
 from rexlex.utils.cachedattr import CachedClassAttr
 
@@ -18,6 +28,10 @@ class _LogMessages:
     pass
 
 
+def _no_trace(message, *args):
+    pass
+
+
 class Lexer(object):
     '''Basic regex lexer with optionally extremely noisy debug/trace output.
     '''
@@ -28,8 +42,12 @@ class Lexer(object):
     _Finished = exceptions.Finished
     _MatchFound = exceptions.MatchFound
     _IncompleteLex = exceptions.IncompleteLex
+    _TimeBudgetExceeded = exceptions.TimeBudgetExceeded
+    _TokenBudgetExceeded = exceptions.TokenBudgetExceeded
+    _NoProgress = exceptions.NoProgress
 
-    # Custom log functions.
+    # Custom log functions. Instances replace these with functions bound
+    # to their own trace level; see _bind_trace_functions.
     _logger = logging.getLogger('rexlex')
     trace_result = _logger.rexlex_trace_result
     trace_meta = _logger.rexlex_trace_meta
@@ -37,9 +55,62 @@ class Lexer(object):
     trace_rule = _logger.rexlex_trace_rule
     trace = _logger.rexlex_trace
 
+    _trace_functions = (
+        ('trace_result', log_config.REXLEX_TRACE_RESULT),
+        ('trace_meta', log_config.REXLEX_TRACE_META),
+        ('trace_state', log_config.REXLEX_TRACE_STATE),
+        ('trace_rule', log_config.REXLEX_TRACE_RULE),
+        ('trace', log_config.REXLEX_TRACE),
+    )
+
     LOGLEVEL = None
     _log_messages = {}
 
+    # Set to 'dfa' to prefilter each state's regular patterns with a
+    # table-driven DFA (see rexlex.lexer.dfa), or to 'codegen' to lex
+    # with Python source generated for the class (see
+    # rexlex.lexer.codegen); None uses only ``re``.
+    engine = None
+
+    # With engine = 'codegen': set to False, or pass codegen=False, to
+    # use the generic engine anyway. codegen_dir is where generated
+    # modules are cached; None uses codegen.default_dir().
+    codegen = True
+    codegen_dir = None
+
+    # Number of recent trace events kept for error reports; None keeps
+    # all of them.
+    flight_recorder_size = 256
+
+    # Per-call budgets, also accepted as constructor kwargs; None means
+    # unlimited. max_time is checked between scans, so it can't interrupt
+    # a single runaway regex, only stop the lex right after it returns.
+    # Pops don't advance pos either, so max_stalled_scans should stay well
+    # above the deepest state stack.
+    max_time = None
+    max_tokens = None
+    max_stalled_scans = 1000
+
+    # If true, input no rule matches is emitted as an error_token and
+    # lexing resumes at the next position where a rule of the current or
+    # root state matches, instead of stopping there.
+    recover = False
+    error_token = Token.Error
+
+    # Set to a number of lines to memoize the tokens of whole lines, for
+    # grammars whose patterns don't match across newlines; line_normalize
+    # can map lines to a shared key. See rexlex.lexer.linememo.
+    line_memo = None
+    line_normalize = None
+
+    # Registry that per-document metrics are recorded to, or None; see
+    # rexlex.metrics.
+    metrics = rexlex.metrics.default_registry
+
+    # Filters from rexlex.lexer.filters run over the token stream when
+    # the lexer is iterated; see filters.Pipeline.
+    filters = ()
+
     def __init__(self, text, pos=None, statestack=None, **kwargs):
         '''Text is the input string to lex. Pos is the
         position at which to start, or 0.
@@ -47,54 +118,503 @@ class Lexer(object):
         # Set initial state.
         self.text = text
         self.pos = pos or 0
+        self._root = self._state_ids['root']
         self.statestack = statestack or ['root']
+        self._dont_emit = frozenset(getattr(self, 'dont_emit', ()))
+        # Transition of the last matched rule; applied once its tokens
+        # have been consumed, so statestack is the one they were lexed in.
+        self._pending = None
+        self._max_depth = len(self._stack)
         self.Item = get_itemclass(text)
+        self.flight_recorder = events.FlightRecorder(
+            self.flight_recorder_size, self._state_names)
+        self._record = self.flight_recorder.append
 
         re_skip = getattr(self, 're_skip', None)
         if re_skip is not None:
             re_skip = re.compile(re_skip).match
         self.re_skip = re_skip
 
+        if 'raise_incomplete' in kwargs:
+            self.raise_incomplete = kwargs['raise_incomplete']
+        for name in ('max_time', 'max_tokens', 'max_stalled_scans',
+                     'recover', 'codegen'):
+            if name in kwargs:
+                setattr(self, name, kwargs[name])
+        # State stack at the start of the last run of failed scans, so
+        # recovery knows which state the lexer got stuck in.
+        self._fail_pos = None
+        self._fail_stack = None
+        # Regexes known not to match at _memo_pos, so states retried there
+        # after a pop don't run them again; and the position re_skip is
+        # known not to advance from.
+        self._memo_pos = None
+        self._memo_failed = set()
+        self._noskip_pos = None
+
+        # The trace level is scoped to this instance, so lexers running
+        # in other threads aren't affected by it.
         if hasattr(self, 'DEBUG'):
             if isinstance(self.DEBUG, bool):
-                self._logger.setLevel(rexlex.TRACE)
+                self.loglevel = rexlex.TRACE
             else:
-                self._logger.setLevel(self.DEBUG)
+                self.loglevel = self.DEBUG
         else:
             self.loglevel = getattr(self, 'loglevel', None)
             if self.loglevel is None:
                 self.loglevel = kwargs.get('loglevel', None)
             if self.loglevel is None:
-                self._logger.setLevel(10)
+                self.loglevel = log_config.get_trace_level()
+        self._bind_trace_functions(self.loglevel)
+
+    def _bind_trace_functions(self, loglevel):
+        '''Bind each trace function to either a no-op or a function that
+        logs unconditionally, depending on this instance's level.
+        '''
+        log = self._logger._log
+        # Set if any trace output is on; guards trace arguments that are
+        # expensive to build.
+        self._tracing = (
+            loglevel is not None and loglevel <= log_config.REXLEX_TRACE_RESULT)
+        for name, level in self._trace_functions:
+            if loglevel is not None and loglevel <= level:
+                func = functools.partial(self._trace_log, log, level)
+            else:
+                func = _no_trace
+            setattr(self, name, func)
+
+    @staticmethod
+    def _trace_log(log, level, message, *args):
+        log(level, message, args)
 
     _msg.ITEM = '  %r'
+    _msg.INCOMPLETE = 'Stopped at pos %r of %r in state %r.'
+    _msg.BUDGET_TIME = 'Lex took longer than %r seconds'
+    _msg.BUDGET_TOKENS = 'Lex produced more than %r tokens'
+    _msg.BUDGET_STALLED = 'Lex made no progress in %r scans'
+    _msg.BUDGET = '%s; stopped at pos %r in state %r, rule %s.'
 
     def __iter__(self):
+        Item = self.Item
+        trace_result = self.trace_result
+        item_msg = self._msg.ITEM
+        pipeline = self._pipeline
+        if pipeline is None:
+            for token in self.iter_tokens():
+                item = Item(*token)
+                trace_result(item_msg, (item,))
+                yield item
+        else:
+            tokens = pipeline.tokens
+            for start, end, token_id in pipeline.run(self.iter_tokens()):
+                item = Item(start, end, tokens[token_id])
+                trace_result(item_msg, (item,))
+                yield item
+
+    def iter_tokens(self):
+        '''Yield plain (start, end, token) tuples, without building Items
+        or running the class's filters.
+        '''
+        self._begin()
+        try:
+            if self._use_line_memo():
+                counts = [0]
+                try:
+                    for item in linememo.lex_lines(
+                            self, self._line_memo, type(self).line_normalize,
+                            counts):
+                        yield item
+                finally:
+                    self._ntokens += counts[0]
+            if self._use_codegen():
+                lex = self._codegen[0]
+                counts = [self._ntokens, self._max_depth]
+                try:
+                    for item in lex(self, self.text, self.pos, self._stack,
+                                    self.recover, self.max_stalled_scans,
+                                    counts):
+                        yield item
+                finally:
+                    self._ntokens, self._max_depth = counts
+            self._last_pos = self.pos
+            next_items = self._next_items
+            while True:
+                items = next_items()
+                if items is None:
+                    return
+                for item in items:
+                    yield item
+                if self._pending is not None:
+                    self._update_state(*self._pending)
+        except Exception as exc:
+            self._failed(exc)
+            raise
+        finally:
+            self._end()
+
+    def run(self, on_token, on_state=None):
+        '''Lex the text, calling ``on_token(start, end, token_id)`` with
+        plain ints for each token instead of yielding Items; the token
+        type is ``token_types[token_id]``. The class's filters are applied.
+        If given, ``on_state(pos, state_id, depth)`` is called whenever
+        the state stack changes, with the id of the new top state (see
+        ``_state_names``) and the stack depth. Returns the number of
+        tokens the lexer produced.
+        '''
+        pipeline = self._pipeline
+        if pipeline is not None:
+            if on_state is not None:
+                msg = "State events can't be combined with filters."
+                raise exceptions.ConfigurationError(msg)
+            # Filters work on streams, so this goes through generators.
+            for start, end, token_id in pipeline.run(self.iter_tokens()):
+                on_token(start, end, token_id)
+            return self._ntokens
+
+        ids = self._token_table.ids
+        self._begin()
+        try:
+            if on_state is None and self._use_line_memo():
+                counts = [0]
+                try:
+                    for start, end, token in linememo.lex_lines(
+                            self, self._line_memo, type(self).line_normalize,
+                            counts):
+                        on_token(start, end, ids[token])
+                finally:
+                    self._ntokens += counts[0]
+            if self._use_codegen():
+                push = self._codegen[1]
+                counts = [self._ntokens, self._max_depth]
+                try:
+                    push(self, self.text, self.pos, self._stack, self.recover,
+                         self.max_stalled_scans, counts, on_token, ids,
+                         on_state)
+                finally:
+                    self._ntokens, self._max_depth = counts
+            self._last_pos = self.pos
+            next_items = self._next_items
+            if on_state is None:
+                while True:
+                    items = next_items()
+                    if items is None:
+                        break
+                    for start, end, token in items:
+                        on_token(start, end, ids[token])
+                    if self._pending is not None:
+                        self._update_state(*self._pending)
+            else:
+                root = self._root
+                stack = self._stack
+                top = (len(stack), stack[-1] if stack else root)
+                while True:
+                    items = next_items()
+                    if items is None:
+                        break
+                    for start, end, token in items:
+                        on_token(start, end, ids[token])
+                    if self._pending is not None:
+                        self._update_state(*self._pending)
+                    stack = self._stack
+                    new_top = (len(stack), stack[-1] if stack else root)
+                    if new_top != top:
+                        top = new_top
+                        on_state(self.pos, top[1], top[0])
+        except Exception as exc:
+            self._failed(exc)
+            raise
+        finally:
+            self._end()
+        return self._ntokens
+
+    def feed(self, handler):
+        '''Like run, with a handler object: its ``token`` method is called
+        for each token and, if it has one, its ``state`` method for state
+        changes.
+        '''
+        return self.run(handler.token, getattr(handler, 'state', None))
+
+    @property
+    def token_types(self):
+        '''Token types by the token ids run() passes on.
+        '''
+        return self._token_table.tokens
+
+    def _use_line_memo(self):
+        return (self._line_memo is not None and self.line_memo
+                and not self._tracing and self.max_time is None
+                and self.max_tokens is None and self._pending is None)
+
+    def _use_codegen(self):
+        return (self._codegen is not None and self.codegen
+                and not self._tracing and self.max_time is None
+                and self.max_tokens is None)
+
+    def _begin(self):
+        '''Reset the per-document budget and metrics counters.
+        '''
         self.trace_meta('Tokenizing text: %r', self.text)
+        self._started = time.time()
+        self._deadline = None
+        if self.max_time is not None:
+            self._deadline = self._started + self.max_time
+        self._start_pos = self._last_pos = self.pos
+        self._ntokens = 0
+        self._stalled_scans = 0
+        self._incomplete = self._error = False
+        self._max_depth = len(self._stack)
+        if self._pending is not None:
+            self._update_state(*self._pending)
+
+    def _next_items(self):
+        '''Run one scan and check the budgets. Returns the scan's tokens,
+        or None once lexing is over.
+        '''
         text_len = len(self.text)
-        Item = self.Item
-        msg = self._msg
-        while True:
+        if text_len <= self.pos:
+            # If here, we hit the end of the input. Stop.
+            return None
+        try:
+            items = self.scan()
+        except self._Finished:
             if text_len <= self.pos:
-                # If here, we hit the end of the input. Stop.
-                return
-            try:
-                for item in self.scan():
-                    item = Item(*item)
-                    self.trace_result(msg.ITEM,  (item,))
-                    yield item
-            except self._Finished:
-                if text_len <= self.pos:
-                    return
-                elif getattr(self, 'raise_incomplete', False):
-                    raise self._IncompleteLex()
-                else:
-                    return
+                return None
+            elif self.recover:
+                self._ntokens += 1
+                return [self._recover()]
+            self._incomplete = True
+            if getattr(self, 'raise_incomplete', False):
+                raise self._IncompleteLex(self._incomplete_message())
+            return None
+
+        # Check budgets.
+        msg = self._msg
+        if self.pos == self._last_pos:
+            self._stalled_scans += 1
+            max_stalled_scans = self.max_stalled_scans
+            if max_stalled_scans is not None and \
+                    max_stalled_scans < self._stalled_scans:
+                raise self._budget_error(
+                    self._NoProgress, msg.BUDGET_STALLED % max_stalled_scans)
+        else:
+            self._last_pos = self.pos
+            self._stalled_scans = 0
+        if self._deadline is not None and self._deadline < time.time():
+            raise self._budget_error(
+                self._TimeBudgetExceeded, msg.BUDGET_TIME % self.max_time)
+        self._ntokens += len(items)
+        if self.max_tokens is not None and self.max_tokens < self._ntokens:
+            raise self._budget_error(
+                self._TokenBudgetExceeded, msg.BUDGET_TOKENS % self.max_tokens)
+        return items
+
+    def _failed(self, exc):
+        self._error = True
+        if getattr(exc, 'flight_record', None) is None:
+            exc.flight_record = self.flight_recorder.render(self.text)
+
+    def _end(self):
+        '''Flush the document's metrics.
+        '''
+        if self.metrics is not None:
+            self.metrics.record(type(self), {
+                'documents': 1,
+                'bytes': self.pos - self._start_pos,
+                'tokens': self._ntokens,
+                'seconds': time.time() - self._started,
+                'incomplete': int(self._incomplete),
+                'errors': int(self._error),
+                'max_depth': self._max_depth,
+                })
+
+    def _incomplete_message(self):
+        state = self.statestack[-1] if self.statestack else 'root'
+        lines = [self._msg.INCOMPLETE % (self.pos, len(self.text), state)]
+        lines.append('Last %d trace events:' % len(self.flight_recorder))
+        lines.extend(self.flight_recorder.render(self.text))
+        return '\n'.join(lines)
+
+    # Lazily computed class attributes; see precompile.
+    _compiled_attrs = (
+        '_tokendefs', '_statetable', '_state_names', '_state_ids', '_states',
+        '_dfas', '_state_dfas', '_state_resyncs', '_pipeline',
+        '_codegen', '_token_table', '_line_memo')
+
+    @classmethod
+    def precompile(cls):
+        '''Compute everything the class otherwise compiles on first use,
+        so the first instance doesn't pay for it.
+        '''
+        for name in cls._compiled_attrs:
+            getattr(cls, name)
+
+    def _budget_error(self, exc_type, message):
+        '''Build a BudgetExceeded error naming the current state and, if
+        the last scan matched, the rule that matched.
+        '''
+        stack = self._stack
+        state = stack[-1] if stack else self._root
+        rule = None
+        for kind, pos, state_id, index, end in reversed(self.flight_recorder):
+            if kind == events.MATCH:
+                if end == self.pos:
+                    state, rule = state_id, index
+                break
+            if kind == events.SCAN:
+                state = state_id
+                break
+        state_name = self._state_names[state]
+        if rule is None:
+            description = 'unknown'
+        else:
+            patterns = [rgx.pattern for rgx in self._states[state][rule].rgxs]
+            description = '#%d %r' % (rule, patterns)
+        message = self._msg.BUDGET % (message, self.pos, state_name, description)
+        return exc_type(message, pos=self.pos, state=state_name, rule=rule)
+
+    _msg.RECOVER = 'Recovering: skipped %r; resuming at pos %r in state %r.'
+
+    def _recover(self):
+        '''Skip input no rule matches. Finds the next position where a rule
+        of the state the lexer got stuck in, or of root, can match, and
+        resumes there in that state. Returns the skipped span as an error
+        token.
+        '''
+        pos = self.pos
+        root = self._root
+        if self._fail_pos == pos and self._fail_stack:
+            stack = self._fail_stack
+        else:
+            stack = [root]
+        best = end = len(self.text)
+        resume = [root]
+        candidates = [stack]
+        if stack[-1] != root:
+            candidates.append([root])
+        for candidate in candidates:
+            resync = self._resync(candidate[-1], pos + 1, best)
+            if resync is not None and resync < best:
+                best = end = resync
+                resume = candidate
+        re_skip = self.re_skip
+        if re_skip is not None:
+            # Leave text re_skip would consume before the resume point
+            # out of the error token.
+            while pos + 1 < end:
+                m = re_skip(self.text, end - 1)
+                if m is None or m.end() < best:
+                    break
+                end -= 1
+        self.trace_meta(
+            self._msg.RECOVER, self.text[pos:end], end,
+            self._state_names[resume[-1]])
+        self._record((events.RECOVER, pos, resume[-1], -1, end))
+        self._stack = list(resume)
+        self._fail_pos = None
+        self.pos = end
+        return pos, end, self.error_token
+
+    def _resync(self, state, pos, endpos):
+        '''First position in [pos, endpos) where a rule of state matches.
+        '''
+        text = self.text
+        rules = self._states[state]
+        search = self._state_resyncs[state]
+        while pos < endpos:
+            if search is not None:
+                m = search(text, pos, endpos)
+                if m is None:
+                    return None
+                pos = m.start()
+            for rule in rules:
+                for rgx in rule.rgxs:
+                    if rgx.match(text, pos):
+                        return pos
+            pos += 1
+        return None
 
     @CachedClassAttr
     def _tokendefs(cls):
         return tokendefs.Compiler(cls).compile_all()
 
+    @CachedClassAttr
+    def _statetable(cls):
+        return tokendefs.Compiler(cls).compile_table(cls._tokendefs)
+
+    @CachedClassAttr
+    def _state_names(cls):
+        return cls._statetable.names
+
+    @CachedClassAttr
+    def _state_ids(cls):
+        return cls._statetable.ids
+
+    @CachedClassAttr
+    def _states(cls):
+        return cls._statetable.states
+
+    @CachedClassAttr
+    def _pipeline(cls):
+        if cls.filters:
+            return Pipeline(cls.filters)
+        return None
+
+    @CachedClassAttr
+    def _state_resyncs(cls):
+        return recovery.compile_states(cls._statetable)
+
+    @CachedClassAttr
+    def _dfas(cls):
+        if cls.engine == 'dfa':
+            return dfa.compile_states(cls._tokendefs)
+        return {}
+
+    @CachedClassAttr
+    def _line_memo(cls):
+        if cls.line_memo and linememo.lines_are_local(cls):
+            return linememo.LineMemo(cls.line_memo)
+        return None
+
+    @classmethod
+    def line_memo_stats(cls):
+        '''Hits, misses, hit rate and size of the class's line memo, or
+        None if it has none.
+        '''
+        memo = cls._line_memo
+        return None if memo is None else memo.stats()
+
+    @CachedClassAttr
+    def _codegen(cls):
+        if cls.engine == 'codegen':
+            return codegen.bind(cls, cls.codegen_dir)
+        return None
+
+    @CachedClassAttr
+    def _token_table(cls):
+        return cls._pipeline or Pipeline(())
+
+    @CachedClassAttr
+    def _state_dfas(cls):
+        return [cls._dfas.get(name) for name in cls._state_names]
+
+    @property
+    def statestack(self):
+        '''The state stack as a tuple of state names. The lexer itself
+        works on a stack of integer state ids, so this is a snapshot; to
+        change the stack, assign a new sequence of names.
+        '''
+        names = self._state_names
+        return tuple(names[state] for state in self._stack)
+
+    @statestack.setter
+    def statestack(self, statestack):
+        ids = self._state_ids
+        try:
+            self._stack = [ids[state] for state in statestack]
+        except KeyError as exc:
+            msg = 'Undefined state %r in statestack.'
+            raise exceptions.ConfigurationError(msg % exc.args)
+
     _msg.SCAN_TEXT = '  scan: %r'
     _msg.SCAN_POS = '  scan: pos = %r'
     _msg.SCAN_STATE = '  scan: state is %r'
@@ -105,51 +625,104 @@ class Lexer(object):
     _msg.SCAN_POPPING_ROOT = '  scan: popping from root state; stopping.'
 
     def scan(self):
+        '''Try the current state's rules at ``self.pos``. Returns the list
+        of (start, end, token) tuples produced by the matching rule. If no
+        rule matches, pops the state and returns an empty list; raises
+        Finished when there are no states left.
+        '''
+        if self._pending is not None:
+            self._update_state(*self._pending)
         msg = self._msg
-        self.trace_meta(msg.SCAN_TEXT, self.text[self.pos:(self.pos + self._MAXWIDTH)])
-        self.trace_meta(msg.SCAN_POS, self.pos)
-
-        try:
-            defs = self._tokendefs[self.statestack[-1]]
-            self.trace_state(msg.SCAN_STATE, self.statestack[-1])
-        except IndexError:
-            defs = self._tokendefs['root']
-            self.trace_state(msg.SCAN_ROOTSTATE)
+        pos = self.pos
+        stack = self._stack
+        if stack:
+            state = stack[-1]
+        else:
+            state = self._root
+        if self._tracing:
+            self.trace_meta(msg.SCAN_TEXT, self.text[pos:(pos + self._MAXWIDTH)])
+            self.trace_meta(msg.SCAN_POS, pos)
+            if stack:
+                self.trace_state(msg.SCAN_STATE, self._state_names[state])
+            else:
+                self.trace_state(msg.SCAN_ROOTSTATE)
+        self._record((events.SCAN, pos, state, -1, pos))
 
-        dont_emit = getattr(self, 'dont_emit', [])
-        try:
-            for start, end, token in self._process_state(defs):
-                if token in dont_emit:
-                    pass
-                else:
-                    yield start, end, token
-        except self._MatchFound:
+        items = self._process_state(state)
+        if items is not None:
             self.trace(msg.SCAN_MATCH_FOUND)
-            return
-
-        self.trace_state(msg.SCAN_POPPING, self.statestack)
-        try:
-            self.statestack.pop()
-        except IndexError:
+            return items
+
+        if self._tracing:
+            self.trace_state(msg.SCAN_POPPING, self.statestack)
+        self._record((events.POP, self.pos, state, -1, self.pos))
+        if self.recover and self._fail_pos != self.pos:
+            self._fail_pos = self.pos
+            self._fail_stack = list(stack)
+        if not stack:
             self.trace_meta(msg.SCAN_STATES_EXHAUSTED)
+            self._record((events.FINISH, self.pos, -1, -1, self.pos))
             raise self._Finished()
+        stack.pop()
 
-        if not self.statestack:
+        if not stack:
             self.trace_state(msg.SCAN_POPPING_ROOT)
+            self._record((events.FINISH, self.pos, -1, -1, self.pos))
             # We popped from the root state.
             raise self._Finished()
+        return []
 
     _msg.STATE_STARTING = ' _process_state: starting state %r'
     _msg.STATE_STACK = ' _process_state: stack: %r'
+    _msg.STATE_DFA = ' _process_state: dfa picked regex #%r'
 
-    def _process_state(self, defs):
+    def _process_state(self, state):
+        '''Try each rule of the state in order. Returns the tokens of the
+        first match, or None if nothing matched.
+        '''
         msg = self._msg
-        if self.statestack:
-            self.trace_meta(msg.STATE_STARTING, self.statestack[-1])
+        if self._tracing and self._stack:
+            self.trace_meta(msg.STATE_STARTING, self._state_names[state])
             self.trace_state(msg.STATE_STACK, self.statestack)
-        for rule in defs:
-            for item in self._process_rule(rule):
-                yield item
+        rules = self._states[state]
+        state_dfa = self._state_dfas[state]
+        if state_dfa is None:
+            for index, rule in enumerate(rules):
+                m = self._process_rule(rule.rgxs)
+                if m is not None:
+                    return self._process_match(state, index, rule, m)
+            self._memoize_failed(rgx for rule in rules for rgx in rule.rgxs)
+            return None
+
+        # Only the first regex the DFA says can match, plus any regexes
+        # it can't model, need to be tried with re.
+        self._skip()
+        best = state_dfa.match_index(self.text, self.pos)
+        self.trace_state(msg.STATE_DFA, best)
+        supported = state_dfa.supported
+        rgx_index = 0
+        tried = []
+        for index, rule in enumerate(rules):
+            rgxs = []
+            for rgx in rule.rgxs:
+                if rgx_index == best or not supported[rgx_index]:
+                    rgxs.append(rgx)
+                rgx_index += 1
+            if rgxs:
+                m = self._process_rule(rgxs)
+                if m is not None:
+                    return self._process_match(state, index, rule, m)
+                tried.extend(rgxs)
+        self._memoize_failed(tried)
+        return None
+
+    def _memoize_failed(self, rgxs):
+        '''Remember that none of rgxs match at the current position.
+        '''
+        if self._memo_pos != self.pos:
+            self._memo_pos = self.pos
+            self._memo_failed = set()
+        self._memo_failed.update(rgxs)
 
     _msg.PROCESS_RULE_SKIPPED = '  _process_rule: skipped %r'
     _msg.PROCESS_RULE_ADVANCING = '  _process_rule: advancing pos from %r to %r'
@@ -159,101 +732,108 @@ class Lexer(object):
     _msg.PROCESS_RULE_MATCHED_PATTERN = '  _process_rule: matched pattern: %r'
     _msg.PROCESS_RULE_MATCH_LENGTH = '  _process_rule: %r has length %r'
 
-    def _process_rule(self, rule):
+    def _skip(self):
         msg = self._msg
-        token, rgxs, push, pop, swap = rule
-        pos_changed = False
-        if self.re_skip:
+        pos = self.pos
+        if self.re_skip and pos != self._noskip_pos:
             # Skipper.
             # Try matching the regexes before stripping,
             # in case they specify leading strippables.
-            m = self.re_skip(self.text, self.pos)
+            m = self.re_skip(self.text, pos)
             if m:
                 self.trace_rule(msg.PROCESS_RULE_SKIPPED, m.group())
-                self.trace_rule(msg.PROCESS_RULE_ADVANCING, self.pos, m.end())
-                pos_changed = True
+                self.trace_rule(msg.PROCESS_RULE_ADVANCING, pos, m.end())
+                self._record((events.SKIP, pos, -1, -1, m.end()))
                 self.pos = m.end()
+            if not m or m.end() == pos:
+                self._noskip_pos = pos
 
-        PROCESS_RULE_STATESTACK = self._msg.PROCESS_RULE_STATESTACK
-        PROCESS_RULE_TRYING_REGEX = self._msg.PROCESS_RULE_TRYING_REGEX
-        PROCESS_RULE_MATCH_FOUND = self._msg.PROCESS_RULE_MATCH_FOUND
-        PROCESS_RULE_MATCHED_PATTERN = self._msg.PROCESS_RULE_MATCHED_PATTERN
-        PROCESS_RULE_MATCH_LENGTH = self._msg.PROCESS_RULE_MATCH_LENGTH
-        PROCESS_RULE_ADVANCING = self._msg.PROCESS_RULE_ADVANCING
-
+    def _process_rule(self, rgxs):
+        '''Apply re_skip, then try the regexes. Returns the first match.
+        '''
+        self._skip()
+        text = self.text
+        pos = self.pos
+        if pos == self._memo_pos:
+            # Retrying at the position where a nested state failed.
+            failed = self._memo_failed
+            rgxs = [rgx for rgx in rgxs if rgx not in failed]
+        if self._tracing:
+            msg = self._msg
+            for rgx in rgxs:
+                self.trace_rule(msg.PROCESS_RULE_STATESTACK, self.statestack)
+                m = rgx.match(text, pos)
+                self.trace(msg.PROCESS_RULE_TRYING_REGEX, rgx.pattern)
+                if m:
+                    self.trace_rule(msg.PROCESS_RULE_MATCH_FOUND, m.group())
+                    self.trace_rule(
+                        msg.PROCESS_RULE_MATCHED_PATTERN, rgx.pattern)
+                    return m
+            return None
         for rgx in rgxs:
-            self.trace_rule(PROCESS_RULE_STATESTACK, self.statestack)
-            m = rgx.match(self.text, self.pos)
-            self.trace(PROCESS_RULE_TRYING_REGEX, rgx.pattern)
+            m = rgx.match(text, pos)
             if m:
-                self.trace_rule(PROCESS_RULE_MATCH_FOUND, m.group())
-                self.trace_rule(PROCESS_RULE_MATCHED_PATTERN, rgx.pattern)
-                if isinstance(token, (_TokenType, basestring)):
-                    start, end = m.span()
-                    yield start, end, token
-                else:
-                    matched = m.group()
-                    for token, text in zip(token, m.groups()):
-                        pos = self.pos + matched.index(text)
-                        yield pos, pos + len(text), token
-
-                msg = PROCESS_RULE_MATCH_LENGTH
-                self.trace_rule(msg, m.group(), len(m.group()))
-                msg = PROCESS_RULE_ADVANCING
-                self.trace_rule(msg, self.pos, m.end())
-                self.pos = m.end()
-                self._update_state(rule)
-                raise self._MatchFound()
+                return m
+        return None
+
+    def _process_match(self, state, index, rule, m):
+        '''Produce the tokens for a match, advance pos and run the rule's
+        state transition.
+        '''
+        token, rgxs, kind, npop, popset, pushes, transition = rule
+        start, end = m.span()
+        if kind == TOKEN:
+            items = [(start, end, token)]
+        elif kind == WORDS:
+            # Token type picked by a words mapping.
+            items = [(start, end, m.token)]
+        else:
+            items = []
+            for group, group_token in enumerate(token[:len(m.groups())], 1):
+                group_start, group_end = m.span(group)
+                if group_start != -1:
+                    items.append((group_start, group_end, group_token))
+        dont_emit = self._dont_emit
+        if dont_emit:
+            items = [item for item in items if item[2] not in dont_emit]
+
+        if self._tracing:
+            msg = self._msg
+            self.trace_rule(msg.PROCESS_RULE_MATCH_LENGTH, m.group(), end - start)
+            self.trace_rule(msg.PROCESS_RULE_ADVANCING, self.pos, end)
+        self._record((events.MATCH, start, state, index, end))
+        self.pos = end
+        if transition:
+            self._pending = (npop, popset, pushes)
+        return items
 
-    _msg.UPDATE_SWAPPING = '  _update_state: swapping current state for %r'
     _msg.UPDATE_POPPED = '  _update_state: popped %r'
     _msg.UPDATE_POPPED_MULTI = '  _update_state: popping %r states'
     _msg.UPDATE_POP_ALL = '  _update_state: popping all %r'
     _msg.UPDATE_PUSH = '  _update_state: pushing %r'
-    _msg.UPDATE_PUSH_ALL = '  _update_state: pushing all %r'
 
-    def _update_state(self, rule):
-        msg = self._msg
-        token, rgxs, push, pop, swap = rule
-        statestack = self.statestack
-
-        # State transition
-        if swap and not (push or pop):
-            msg = self._msg.UPDATE_SWAPPING
-            self.trace_state(msg, statestack[-1])
-            statestack.pop()
-            statestack.append(swap)
-        else:
-            if pop:
-                if isinstance(pop, bool):
-                    popped = statestack.pop()
-                    self.trace_state(msg.UPDATE_POPPED, popped)
-                elif isinstance(pop, int):
-                    self.trace_state(msg.UPDATE_POPPED_MULTI, pop)
-                    for i in range(pop):
-                        popped = statestack.pop()
-                        self.trace_state(msg.UPDATE_POPPED, popped)
-
-                # If it's a set, pop all that match.
-                elif isinstance(pop, set):
-                    self.trace_state(msg.UPDATE_POP_ALL, pop)
-                    while statestack[-1] in pop:
-                        popped = statestack.pop()
-                        self.trace_state(msg.UPDATE_POPPED, (popped))
-
-            if push:
-                self.trace_state(msg.UPDATE_PUSH, (push,))
-                if isinstance(push, basestring):
-                    if push == '#pop':
-                        statestack.pop()
-                    elif push.startswith('#pop:'):
-                        numpop = push.replace('#pop:', '')
-                        for i in range(numpop):
-                            statestack.pop()
-                    else:
-                        statestack.append(push)
-                else:
-                    self.trace_state(msg.UPDATE_PUSH_ALL, (push,))
-                    for state in push:
-                        self.trace_state(msg.UPDATE_PUSH, state)
-                        statestack.append(state)
+    def _update_state(self, npop, popset, pushes):
+        self._pending = None
+        stack = self._stack
+        if self._tracing:
+            msg = self._msg
+            names = self._state_names
+            if npop:
+                self.trace_state(msg.UPDATE_POPPED_MULTI, npop)
+            if popset:
+                self.trace_state(
+                    msg.UPDATE_POP_ALL, set(names[i] for i in popset))
+            for state in pushes:
+                self.trace_state(msg.UPDATE_PUSH, names[state])
+        if npop:
+            del stack[-npop:]
+        if popset:
+            while stack and stack[-1] in popset:
+                stack.pop()
+        if pushes:
+            stack.extend(pushes)
+            if self._max_depth < len(stack):
+                self._max_depth = len(stack)
+        self._record((
+            events.STATE, self.pos, stack[-1] if stack else self._root,
+            len(stack), self.pos))
@@ -0,0 +1,56 @@
+'''Conversion between character offsets and line/column positions.
+'''
+from array import array
+from bisect import bisect_left
+
+from rexlex.lexer.py2compat import str, unicode, bytes, basestring
+
+
+class LineIndex(object):
+    '''Sorted offsets of the newlines in a text, so offsets convert to
+    (line, col) and back in O(log n). Lines are numbered from 1 and
+    columns from 0.
+    '''
+
+    def __init__(self, text):
+        newline = b'\n' if isinstance(text, bytes) and bytes is not str \
+            else u'\n'
+        newlines = array('q')
+        append = newlines.append
+        find = text.find
+        pos = find(newline)
+        while pos != -1:
+            append(pos)
+            pos = find(newline, pos + 1)
+        self.newlines = newlines
+        self.length = len(text)
+
+    def __len__(self):
+        '''Number of lines.
+        '''
+        return len(self.newlines) + 1
+
+    def line_start(self, line):
+        '''Offset of the first character of a line.
+        '''
+        if not 1 <= line <= len(self.newlines) + 1:
+            raise IndexError('line %r out of range' % (line,))
+        if line == 1:
+            return 0
+        return self.newlines[line - 2] + 1
+
+    def line(self, offset):
+        return bisect_left(self.newlines, offset) + 1
+
+    def position(self, offset):
+        '''Return the (line, col) of an offset.
+        '''
+        line = bisect_left(self.newlines, offset) + 1
+        if line == 1:
+            return line, offset
+        return line, offset - self.newlines[line - 2] - 1
+
+    def offset(self, line, col):
+        '''Return the offset of a (line, col) position.
+        '''
+        return self.line_start(line) + col
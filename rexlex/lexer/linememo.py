@@ -0,0 +1,153 @@
+r'''Memoized token layouts of whole lines.
+
+Line-oriented input like logs repeats the same lines, or the same line
+shapes, over and over. A lexer can set ``line_memo`` to the number of
+lines to remember::
+
+    class LogLexer(Lexer):
+        line_memo = 10000
+        # Optional: lines with the same key must lex to the same layout.
+        line_normalize = staticmethod(lambda line: DIGITS.sub('0', line))
+        tokendefs = {...}
+
+Each line (with its newline) is then lexed on its own, starting from
+the state stack the previous line ended in. Its tokens, relative to the
+start of the line, and the stack it ends in are stored in a bounded LRU
+keyed by the starting stack and the line, or ``line_normalize(line)``.
+A line seen before in the same state reuses the stored layout shifted
+to its offset, without running any regex. Lines the lexer can't lex to
+the end, or where recovery emits error tokens, aren't stored, and the
+rest of the document is lexed normally from the start of that line.
+
+Lexing lines on their own only gives the tokens of the whole text if no
+pattern, including ``re_skip``, can match past a newline or look outside
+the line (see rexlex.lexer.analysis.line_local); for lexers with such
+patterns, e.g. ``re_skip = r'\s+'``, the memo is turned off.
+
+``MyLexer.line_memo_stats()`` reports the hit rate.
+'''
+import re
+import threading
+from collections import OrderedDict
+
+from rexlex.lexer.analysis import line_local
+from rexlex.lexer.py2compat import unicode
+
+
+class LineMemo(object):
+    '''Bounded LRU of token layouts keyed by line.
+    '''
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        '''The stored layout for key, or None.
+        '''
+        with self._lock:
+            layout = self._entries.get(key)
+            if layout is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return layout
+
+    def put(self, key, layout):
+        with self._lock:
+            self._entries[key] = layout
+            self._entries.move_to_end(key)
+            while self.maxsize < len(self._entries):
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups else 0.0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hit_rate,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+
+def lines_are_local(lexer_cls):
+    '''Whether every pattern of the lexer class, and its re_skip, is
+    line local, so its lines can be lexed one at a time.
+    '''
+    rgxs = [rgx for rules in lexer_cls._states for rule in rules
+            for rgx in rule.rgxs]
+    re_skip = getattr(lexer_cls, 're_skip', None)
+    if re_skip is not None:
+        rgxs.append(re.compile(re_skip))
+    return all(line_local(rgx) for rgx in rgxs)
+
+
+def lex_lines(lexer, memo, normalize, counts):
+    '''Yield the tokens of lexer's text from lexer.pos line by line,
+    through memo. Stops at the end of the text, or at the start of the
+    first line that can't be memoized, leaving lexer.pos and the lexer's
+    state stack there. Adds the number of tokens to counts[0].
+    '''
+    text = lexer.text
+    text_len = len(text)
+    newline = '\n' if isinstance(text, unicode) else b'\n'
+    lexer_cls = type(lexer)
+    kwargs = {
+        'raise_incomplete': False,
+        'recover': lexer.recover,
+        'max_stalled_scans': lexer.max_stalled_scans,
+        'codegen': lexer.codegen,
+        }
+    names = lexer._state_names
+    error_token = lexer.error_token if lexer.recover else None
+    pos = lexer.pos
+    stack = tuple(lexer._stack)
+    ntokens = 0
+    try:
+        while pos < text_len:
+            line_end = text.find(newline, pos)
+            line_end = text_len if line_end == -1 else line_end + 1
+            line = text[pos:line_end]
+            key = (stack, line if normalize is None else normalize(line))
+            entry = memo.get(key)
+            if entry is None:
+                sub = lexer_cls(
+                    line, statestack=[names[state] for state in stack],
+                    **kwargs)
+                sub.line_memo = None
+                sub.metrics = None
+                layout = tuple(sub.iter_tokens())
+                if sub.pos < len(line) or any(
+                        token == error_token for _, _, token in layout):
+                    break
+                entry = (layout, tuple(sub._stack))
+                memo.put(key, entry)
+            layout, stack = entry
+            ntokens += len(layout)
+            lexer.pos = line_end
+            lexer._stack = list(stack)
+            if lexer._max_depth < len(stack):
+                lexer._max_depth = len(stack)
+            for start, end, token in layout:
+                yield start + pos, end + pos, token
+            pos = line_end
+    finally:
+        counts[0] += ntokens
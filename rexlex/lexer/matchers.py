@@ -0,0 +1,166 @@
+'''Matcher backends that can stand in for compiled regexes.
+
+Anything the compiler puts in a rule's ``rgxs`` list only needs to
+provide ``match(text, pos)`` and a ``pattern`` attribute, so patterns
+that don't need the regex engine can be matched more cheaply.
+'''
+import re
+
+from rexlex.lexer.exceptions import ConfigurationError
+from rexlex.lexer.py2compat import str, unicode, bytes, basestring
+
+
+class LiteralMatch(object):
+    '''Minimal stand-in for the match objects returned by ``re``.
+    '''
+    __slots__ = ('re', 'string', 'pos', '_start', '_end')
+
+    def __init__(self, matcher, string, start, end):
+        self.re = matcher
+        self.string = string
+        self.pos = start
+        self._start = start
+        self._end = end
+
+    def __repr__(self):
+        return '<LiteralMatch span=%r, match=%r>' % (self.span(), self.group())
+
+    def group(self, *groups):
+        if groups not in ((), (0,)):
+            raise IndexError('no such group')
+        return self.string[self._start:self._end]
+
+    def groups(self, default=None):
+        return ()
+
+    def start(self, group=0):
+        return self._start
+
+    def end(self, group=0):
+        return self._end
+
+    def span(self, group=0):
+        return self._start, self._end
+
+
+class LiteralMatcher(object):
+    '''Matches a fixed string with ``startswith`` instead of ``re``.
+    '''
+    __slots__ = ('pattern', 'flags', 'literal', 'length')
+
+    # Escapes that stand for a single character.
+    _escapes = {
+        'n': '\n', 't': '\t', 'r': '\r', 'f': '\f', 'v': '\v', 'a': '\a'}
+    _metachars = frozenset('.^$*+?{}[]|()\\')
+    _unsupported_flags = re.IGNORECASE | re.VERBOSE
+
+    def __init__(self, pattern, literal, flags=0):
+        self.pattern = pattern
+        self.flags = flags
+        self.literal = literal
+        self.length = len(literal)
+
+    def __repr__(self):
+        return 'LiteralMatcher(%r)' % (self.pattern,)
+
+    @classmethod
+    def from_pattern(cls, pattern, flags=0):
+        '''Return a LiteralMatcher if the pattern only matches itself
+        (after unescaping), otherwise None.
+        '''
+        if flags & cls._unsupported_flags or not pattern:
+            return None
+        if isinstance(pattern, bytes) and bytes is not str:
+            literal = cls._unescape(pattern.decode('latin-1'))
+            if literal is not None:
+                literal = literal.encode('latin-1')
+        else:
+            literal = cls._unescape(pattern)
+        if literal is None:
+            return None
+        return cls(pattern, literal, flags)
+
+    @classmethod
+    def _unescape(cls, pattern):
+        metachars = cls._metachars
+        escapes = cls._escapes
+        chars = []
+        append = chars.append
+        it = iter(pattern)
+        for char in it:
+            if char == '\\':
+                char = next(it, None)
+                if char is None:
+                    return None
+                if char in escapes:
+                    append(escapes[char])
+                elif char.isalnum() or char == '_':
+                    # Character classes, backrefs, anchors, etc.
+                    return None
+                else:
+                    append(char)
+            elif char in metachars:
+                return None
+            else:
+                append(char)
+        return ''.join(chars)
+
+    def match(self, text, pos=0):
+        if text.startswith(self.literal, pos):
+            return LiteralMatch(self, text, pos, pos + self.length)
+
+
+class WordsMatch(LiteralMatch):
+    '''Match of a word from a ``words`` mapping; carries the word's token.
+    '''
+    __slots__ = ('token',)
+
+    def __init__(self, matcher, string, start, end, token):
+        super(WordsMatch, self).__init__(matcher, string, start, end)
+        self.token = token
+
+
+class WordsMatcher(object):
+    '''Matches an identifier-shaped run, then looks it up in a hash table,
+    so the cost doesn't grow with the number of words.
+    '''
+    __slots__ = ('pattern', 'flags', 'run', 'table', 'fold', 'by_token')
+
+    def __init__(self, words, pattern=r'\w+', flags=0):
+        self.pattern = pattern
+        self.flags = flags
+        self.run = re.compile(pattern, flags).match
+        self.fold = bool(flags & re.IGNORECASE)
+        self.by_token = hasattr(words, 'items')
+
+        check = re.compile('(?:%s)\\Z' % pattern, flags).match
+        for word in words:
+            if not check(word):
+                msg = 'Word %r is not matched in full by pattern %r.'
+                raise ConfigurationError(msg % (word, pattern))
+
+        if self.by_token:
+            self.table = dict(
+                (self._fold(word), token) for word, token in words.items())
+        else:
+            self.table = frozenset(self._fold(word) for word in words)
+
+    def __repr__(self):
+        return 'WordsMatcher(%r, %d words)' % (self.pattern, len(self.table))
+
+    def _fold(self, word):
+        return word.lower() if self.fold else word
+
+    def match(self, text, pos=0):
+        m = self.run(text, pos)
+        if m is None:
+            return None
+        word = m.group()
+        if self.fold:
+            word = word.lower()
+        if word not in self.table:
+            return None
+        if self.by_token:
+            start, end = m.span()
+            return WordsMatch(self, text, start, end, self.table[word])
+        return m
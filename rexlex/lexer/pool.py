@@ -0,0 +1,128 @@
+'''Process-wide pool of compiled patterns and states.
+
+Lexer classes that share patterns or whole states, typically through
+``include``, would otherwise each compile their own copies. The compiler
+looks patterns up in the pool by (pattern, flags, matcher backends) and
+compiled states by a fingerprint of their rules after include
+expansion, so identical patterns and states across classes share one
+compiled object. The pool records what that saves::
+
+    >>> from rexlex.lexer import pool
+    >>> pool.stats()['saved_seconds']
+
+Compiled states are shared lists of rules and must not be mutated. Set
+``compile_pool = None`` on a lexer class to compile it privately.
+'''
+import sys
+import time
+import threading
+
+
+def _sizeof(obj):
+    '''Rough size in bytes of a compiled pattern or a compiled state.
+    '''
+    if isinstance(obj, list):
+        size = sys.getsizeof(obj)
+        for rule in obj:
+            size += sys.getsizeof(rule)
+            # The patterns themselves are counted by the pattern pool.
+            size += sys.getsizeof(rule.rgxs)
+        return size
+    return sys.getsizeof(obj) + sum(
+        sys.getsizeof(getattr(obj, name, None) or 0)
+        for name in ('pattern', 'literal', 'table'))
+
+
+class _Entry(object):
+    __slots__ = ('value', 'seconds', 'size', 'hits')
+
+    def __init__(self, value, seconds, size):
+        self.value = value
+        self.seconds = seconds
+        self.size = size
+        self.hits = 0
+
+
+class CompilePool(object):
+    '''Dedupes compiled patterns and states, keyed by hashable keys the
+    compiler builds.
+    '''
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._patterns = {}
+        self._states = {}
+
+    def _get(self, table, key, build):
+        entry = table.get(key)
+        if entry is None:
+            with self._lock:
+                entry = table.get(key)
+                if entry is None:
+                    started = time.time()
+                    value = build()
+                    entry = _Entry(value, time.time() - started, _sizeof(value))
+                    table[key] = entry
+                    return value
+        entry.hits += 1
+        return entry.value
+
+    def pattern(self, key, build):
+        '''Return the pooled compiled pattern for key, calling build() to
+        compile it if there's none yet.
+        '''
+        return self._get(self._patterns, key, build)
+
+    def state(self, key, build):
+        '''Return the pooled list of compiled rules for a state
+        fingerprint, calling build() to compile it if there's none yet.
+        '''
+        return self._get(self._states, key, build)
+
+    def stats(self):
+        '''Counts of pooled objects and reuses, with the compile time and
+        approximate memory the reuses saved.
+        '''
+        with self._lock:
+            stats = {}
+            for name, table in (('pattern', self._patterns),
+                                ('state', self._states)):
+                entries = list(table.values())
+                stats[name + 's'] = len(entries)
+                stats[name + '_hits'] = sum(e.hits for e in entries)
+                stats[name + '_bytes'] = sum(e.size for e in entries)
+                stats[name + '_saved_bytes'] = sum(
+                    e.size * e.hits for e in entries)
+                stats[name + '_compile_seconds'] = sum(
+                    e.seconds for e in entries)
+                stats[name + '_saved_seconds'] = sum(
+                    e.seconds * e.hits for e in entries)
+            # A state's compile time includes compiling its patterns.
+            stats['compile_seconds'] = stats['state_compile_seconds']
+            stats['saved_seconds'] = (
+                stats['pattern_saved_seconds'] + stats['state_saved_seconds'])
+            stats['saved_bytes'] = (
+                stats['pattern_saved_bytes'] + stats['state_saved_bytes'])
+            return stats
+
+    def clear(self):
+        with self._lock:
+            self._patterns.clear()
+            self._states.clear()
+
+
+# The pool used by default.
+default_pool = CompilePool()
+
+
+def stats():
+    '''Stats of the default pool.
+    '''
+    return default_pool.stats()
+
+
+def clear():
+    '''Empty the default pool. Classes that already compiled keep their
+    compiled tokendefs.
+    '''
+    default_pool.clear()
@@ -0,0 +1,209 @@
+'''Optional NumPy pre-pass for bytes input.
+
+Lexers for log or CSV-like data spend most of their time on runs of
+whitespace, digits and delimiters. If a lexer declares those as simple
+byte classes::
+
+    class LogLexer(Lexer):
+        byteclasses = [
+            ByteClass(Token.Whitespace, b' \\t'),
+            ByteClass(Token.Number, b'0123456789'),
+            ByteClass(Token.Punctuation, b',;', run=False),
+        ]
+
+then ``prescan(LogLexer, data)`` classifies every byte with a lookup
+table, finds run boundaries with ``np.diff``/``np.flatnonzero``, emits
+those tokens in bulk, and only runs the regex lexer on the spans in
+between, carrying its state from one span to the next. This is only
+correct for grammars where the declared bytes always lex to those
+tokens, whatever state the lexer is in; the first prescan of a class
+checks its tokendefs for that and raises ConfigurationError if they
+don't (see Prescanner.check).
+'''
+import re
+import weakref
+import collections
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from rexlex.lexer import analysis
+from rexlex.lexer.exceptions import ConfigurationError
+from rexlex.lexer.tokendefs import TOKEN
+
+
+ByteClass = collections.namedtuple('ByteClass', 'token chars run')
+
+
+class ByteClass(ByteClass):
+    '''ByteClass(token, chars, run=True). If ``run`` is true, adjacent
+    bytes of the class form one token; otherwise each byte is a token.
+    '''
+
+    def __new__(_cls, token, chars, run=True):
+        return tuple.__new__(_cls, (token, bytes(bytearray(chars)), run))
+
+
+class Prescanner(object):
+    '''Lookup tables for one set of byte classes.
+    '''
+
+    def __init__(self, byteclasses):
+        if np is None:
+            raise ConfigurationError('Prescanning requires numpy.')
+        if len(byteclasses) > 255:
+            raise ConfigurationError('At most 255 byte classes are allowed.')
+        self.byteclasses = byteclasses
+        self.lut = lut = np.zeros(256, dtype=np.uint8)
+        self.tokens = tokens = [None]
+        each = [False]
+        for class_id, byteclass in enumerate(byteclasses, 1):
+            chars = np.frombuffer(byteclass.chars, dtype=np.uint8)
+            if lut[chars].any():
+                msg = 'Byte class %r overlaps an earlier class.'
+                raise ConfigurationError(msg % (byteclass,))
+            lut[chars] = class_id
+            tokens.append(byteclass.token)
+            each.append(not byteclass.run)
+        self.each = np.array(each, dtype=bool)
+
+    def spans(self, data):
+        '''Split data into homogeneous spans. Return arrays of starts,
+        ends and class ids; class id 0 marks spans for the regex lexer.
+        '''
+        classes = self.lut[np.frombuffer(data, dtype=np.uint8)]
+        if not len(classes):
+            empty = np.zeros(0, dtype=np.intp)
+            return empty, empty, np.zeros(0, dtype=np.uint8)
+        boundary = np.diff(classes) != 0
+        boundary |= self.each[classes[1:]]
+        starts = np.flatnonzero(boundary) + 1
+        ends = np.append(starts, len(classes))
+        starts = np.insert(starts, 0, 0)
+        return starts, ends, classes[starts]
+
+    def check(self, lexer_cls):
+        '''Raise ConfigurationError unless the byte classes are context
+        free for lexer_cls: every pattern of every state that can match a
+        byte of a class matches exactly one byte of that class (a run of
+        them, for run classes), produces the class's token and doesn't
+        change state; every state lexes all bytes of every class that
+        way; and re_skip matches none of them.
+        '''
+        class_of = self.lut.tolist()
+        names = lexer_cls._state_names
+        for state, rules in enumerate(lexer_cls._states):
+            where = 'state %r' % names[state]
+            covered = collections.defaultdict(set)
+            for rule in rules:
+                for rgx in rule.rgxs:
+                    matched = self._check_pattern(class_of, rgx, rule, where)
+                    if matched is not None:
+                        covered[matched[0]].update(matched[1])
+            for class_id, byteclass in enumerate(self.byteclasses, 1):
+                if covered[class_id] != set(bytearray(byteclass.chars)):
+                    msg = ('Byte class %r is not context free: %s has no '
+                           'rules for all of its bytes.')
+                    raise ConfigurationError(msg % (byteclass, where))
+        re_skip = getattr(lexer_cls, 're_skip', None)
+        if re_skip is not None:
+            self._check_pattern(class_of, re.compile(re_skip), None, 're_skip')
+
+    def _check_pattern(self, class_of, rgx, rule, where):
+        consumed = analysis.consumed_bytes(rgx)
+        if consumed is None:
+            msg = "Can't check pattern %r in %s against the byte classes."
+            raise ConfigurationError(msg % (rgx.pattern, where))
+        codes, shape = consumed
+        class_ids = set(class_of[code] for code in codes) - set([0])
+        if not class_ids:
+            return None
+        class_id = min(class_ids)
+        byteclass = self.byteclasses[class_id - 1]
+        if len(class_ids) == 1 and rule is not None and \
+                rule.kind == TOKEN and rule.token == byteclass.token and \
+                not rule.transition and \
+                _matches_class(codes, shape, byteclass):
+            return class_id, codes
+        msg = ('Byte class %r is not context free: pattern %r in %s can '
+               'match its bytes differently.')
+        raise ConfigurationError(msg % (byteclass, rgx.pattern, where))
+
+
+def _matches_class(codes, shape, byteclass):
+    '''Whether a pattern is exactly one byte of the class, or for run
+    classes, a greedy run of one or more bytes of it.
+    '''
+    chars = set(bytearray(byteclass.chars))
+    if byteclass.run:
+        return shape == analysis.RUN and codes == chars
+    return shape == analysis.SINGLE and codes <= chars
+
+
+# Checked Prescanners per lexer class, by byte classes.
+_prescanners = weakref.WeakKeyDictionary()
+
+
+def get_prescanner(lexer_cls, byteclasses):
+    '''The Prescanner for a lexer class and byte classes, built and
+    checked against the class the first time.
+    '''
+    byteclasses = tuple(byteclasses)
+    by_classes = _prescanners.setdefault(lexer_cls, {})
+    prescanner = by_classes.get(byteclasses)
+    if prescanner is None:
+        prescanner = Prescanner(byteclasses)
+        prescanner.check(lexer_cls)
+        by_classes[byteclasses] = prescanner
+    return prescanner
+
+
+def prescan(lexer_cls, data, byteclasses=None):
+    '''Lex bytes with ``lexer_cls``, handling the lexer's ``byteclasses``
+    runs with NumPy. Yields Item instances like ``Lexer.__iter__``.
+    '''
+    if byteclasses is None:
+        byteclasses = getattr(lexer_cls, 'byteclasses', None)
+    if not byteclasses:
+        msg = '%r declares no byteclasses to prescan.'
+        raise ConfigurationError(msg % (lexer_cls,))
+    if isinstance(data, str) and bytes is not str:
+        raise TypeError('prescan only handles bytes input.')
+
+    prescanner = get_prescanner(lexer_cls, byteclasses)
+    starts, ends, class_ids = prescanner.spans(data)
+    tokens = prescanner.tokens
+
+    # One lexer over all of data lexes the spans in between, so the state
+    # stack carries over from one span to the next.
+    lexer = lexer_cls(data)
+    Item = lexer.Item
+    dont_emit = lexer._dont_emit
+    next_items = lexer._next_items
+    lexer._begin()
+    try:
+        for start, end, class_id in zip(
+                starts.tolist(), ends.tolist(), class_ids.tolist()):
+            if class_id:
+                token = tokens[class_id]
+                if token not in dont_emit:
+                    yield Item(start, end, token)
+                continue
+            lexer.pos = start
+            while lexer.pos < end:
+                items = next_items()
+                if items is None:
+                    # The span can't be lexed to its end, so lexing is
+                    # over, as it would be for the lexer.
+                    return
+                for item in items:
+                    yield Item(*item)
+                if lexer._pending is not None:
+                    lexer._update_state(*lexer._pending)
+    except Exception as exc:
+        lexer._failed(exc)
+        raise
+    finally:
+        lexer._end()
@@ -0,0 +1,146 @@
+'''Error recovery support: finding where lexing can resume after input
+that no rule matches.
+
+For each state, the first characters its patterns can start with are
+collected into a single character-class regex. The lexer searches for
+it to find candidate resume positions at C speed, and only tries the
+state's rules at those positions. States with a pattern whose first
+character can't be determined (one that can match empty, or starts with
+lookaround) get no search; the lexer then tries every position.
+'''
+import re
+
+from rexlex.lexer.dfa import sre_parse, sre_constants
+from rexlex.lexer.analysis import _first_atoms, _nullable
+from rexlex.lexer.matchers import LiteralMatcher, WordsMatcher
+from rexlex.lexer.py2compat import str, unicode, bytes, basestring
+
+try:
+    unichr
+except NameError:
+    unichr = chr
+
+
+_c = sre_constants
+_CATEGORY_ESCAPES = {
+    _c.CATEGORY_DIGIT: r'\d',
+    _c.CATEGORY_NOT_DIGIT: r'\D',
+    _c.CATEGORY_SPACE: r'\s',
+    _c.CATEGORY_NOT_SPACE: r'\S',
+    _c.CATEGORY_WORD: r'\w',
+    _c.CATEGORY_NOT_WORD: r'\W',
+}
+
+# Flags that change what a single character class matches.
+_INLINE_FLAGS = ((re.IGNORECASE, 'i'), (re.ASCII, 'a'), (re.DOTALL, 's'))
+
+
+class _Unknown(Exception):
+    pass
+
+
+def _escape(code):
+    return re.escape(unichr(code))
+
+
+def _atom_regex(atom):
+    op, av = atom
+    if op is _c.LITERAL:
+        return _escape(av)
+    if op is _c.NOT_LITERAL:
+        return '[^%s]' % _escape(av)
+    if op is _c.ANY:
+        return '.'
+    if op is not _c.IN:
+        raise _Unknown(op)
+    negate = ''
+    parts = []
+    for subop, subav in av:
+        if subop is _c.NEGATE:
+            negate = '^'
+        elif subop is _c.LITERAL:
+            parts.append(_escape(subav))
+        elif subop is _c.RANGE:
+            parts.append('%s-%s' % (_escape(subav[0]), _escape(subav[1])))
+        elif subop is _c.CATEGORY and subav in _CATEGORY_ESCAPES:
+            parts.append(_CATEGORY_ESCAPES[subav])
+        else:
+            raise _Unknown(subop)
+    return '[%s%s]' % (negate, ''.join(parts))
+
+
+def _first_char(literal):
+    first = literal[:1]
+    if isinstance(first, bytes) and bytes is not str:
+        first = first.decode('latin-1')
+    return first
+
+
+def first_char_regex(rgx):
+    '''Regex source matching any character a match of rgx can start with,
+    or None if that can't be determined.
+    '''
+    if isinstance(rgx, LiteralMatcher):
+        return re.escape(_first_char(rgx.literal))
+    if isinstance(rgx, WordsMatcher):
+        firsts = set()
+        for word in rgx.table:
+            first = _first_char(word)
+            firsts.add(first)
+            if rgx.fold:
+                firsts.add(first.upper())
+        return '[%s]' % ''.join(re.escape(char) for char in sorted(firsts))
+
+    pattern = getattr(rgx, 'pattern', None)
+    if pattern is None:
+        return None
+    flags = getattr(rgx, 'flags', 0)
+    try:
+        tree = sre_parse.parse(pattern, flags)
+    except Exception:
+        return None
+    flags |= tree.state.flags
+    if flags & re.LOCALE or _nullable(tree):
+        return None
+    atoms, complete = _first_atoms(tree)
+    if not complete or not atoms:
+        return None
+    try:
+        source = '|'.join(_atom_regex(atom) for atom in atoms)
+    except _Unknown:
+        return None
+    inline = ''.join(char for flag, char in _INLINE_FLAGS if flags & flag)
+    if inline:
+        source = '(?%s:%s)' % (inline, source)
+    return source
+
+
+def compile_resync(rules, is_bytes=False):
+    '''Return the ``search`` method of a regex finding the positions
+    where one of the rules might match, or None if any position might.
+    '''
+    parts = []
+    for rule in rules:
+        for rgx in rule.rgxs:
+            source = first_char_regex(rgx)
+            if source is None:
+                return None
+            parts.append(source)
+    # A state without rules never matches anywhere.
+    source = '|'.join(parts) or '(?!)'
+    if is_bytes:
+        source = source.encode('latin-1')
+    return re.compile(source).search
+
+
+def compile_states(statetable):
+    '''Resync searches for each state of a StateTable, by state id.
+    '''
+    resyncs = []
+    for rules in statetable.states:
+        is_bytes = any(
+            isinstance(getattr(rgx, 'pattern', None), bytes)
+            and bytes is not str
+            for rule in rules for rgx in rule.rgxs)
+        resyncs.append(compile_resync(rules, is_bytes))
+    return resyncs
@@ -0,0 +1,12 @@
+'''Command line entry point that replays binary trace files written by
+rexlex.lexer.events::
+
+    python -m rexlex.lexer.replay trace.rxtr [source-file]
+'''
+import sys
+
+from rexlex.lexer.events import main
+
+
+if __name__ == '__main__':
+    sys.exit(main())
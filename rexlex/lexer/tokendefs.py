@@ -1,23 +1,62 @@
 import re
 import functools
+import collections
 from collections import defaultdict
 from operator import attrgetter
 
-from rexlex.lexer.utils import include, Rule
-from rexlex.lexer.exceptions import BogusIncludeError
+from rexlex.lexer.utils import include, words, Rule
+from rexlex.lexer.exceptions import BogusIncludeError, ConfigurationError
+from rexlex.lexer.matchers import LiteralMatcher, WordsMatcher
+from rexlex.lexer.tokentype import _TokenType
+from rexlex.lexer import pool
+from rexlex.lexer.fingerprint import canonical
 from rexlex.lexer.py2compat import str, unicode, bytes, basestring
 
 
+# How a compiled rule turns a match into tokens.
+TOKEN = 0      # The rule's token covers the whole match.
+WORDS = 1      # The token comes from a words() mapping (match.token).
+GROUPS = 2     # bygroups: one token per regex group.
+
+
+CompiledRule = collections.namedtuple(
+    'CompiledRule', 'token rgxs kind npop popset pushes transition')
+CompiledRule.__doc__ = '''A rule with its state transition pre-resolved
+into an opcode: pop ``npop`` states, then pop while the top state id is
+in ``popset``, then push the state ids in ``pushes``. ``transition`` is
+false if the rule doesn't change the state stack at all.
+'''
+
+
+StateTable = collections.namedtuple('StateTable', 'names ids states')
+StateTable.__doc__ = '''Integer-indexed states: ``names[i]`` is the name
+of state ``i``, ``ids`` maps names back to ids and ``states[i]`` is the
+tuple of CompiledRules for state ``i``.
+'''
+
+
 class _BaseCompiler(object):
     _re_type = type(re.compile(''))
 
     def _process_re_type(self, rgx):
         return rgx
 
+    def _process_words(self, flags, rgx):
+        if self.pool is None:
+            return WordsMatcher(rgx.words, rgx.pattern, flags)
+        key = ('words', canonical(rgx.words), rgx.pattern, flags)
+        return self.pool.pattern(
+            key, lambda: WordsMatcher(rgx.words, rgx.pattern, flags))
+
+    # Pool that compiled patterns and states are shared through; lexers
+    # can set ``compile_pool = None`` to opt out.
+    compile_pool = pool.default_pool
+
     def __init__(self, cls):
         self.cls = cls
         self.tokendefs = cls.tokendefs
         self.compiled = defaultdict(list)
+        self.pool = getattr(cls, 'compile_pool', self.compile_pool)
 
     def re_compile(self, flags, text, re_compile=re.compile):
         raise NotImplementedError()
@@ -29,7 +68,9 @@ class _BaseCompiler(object):
         getfunc = {
             type(u""): re_compile,
             str: re_compile,
-            self._re_type: self._process_re_type
+            bytes: re_compile,
+            self._re_type: self._process_re_type,
+            words: functools.partial(self._process_words, flags),
             }
 
         append = self.compiled[state].append
@@ -58,19 +99,132 @@ class _BaseCompiler(object):
 
             rgxs = _rgxs
             rule = rule._replace(rgxs=rgxs)
+            if any(getattr(rgx, 'by_token', False) for rgx in rgxs):
+                # The token comes from the words mapping.
+                if len(rgxs) != 1:
+                    msg = (
+                        "A words mapping must be the only pattern in its "
+                        "rule: %r")
+                    raise ConfigurationError(msg % (rule,))
+                rule = rule._replace(token=None)
             append(rule)
 
     def compile_all(self):
         '''Compile the tokendef regexes.
         '''
         for state, rules in self.tokendefs.items():
-            self._process_rules(state, rules)
+            if self.pool is None:
+                self._process_rules(state, rules)
+            else:
+                self.compiled[state] = self.pool.state(
+                    self._state_key(state),
+                    functools.partial(self._compile_state, state, rules))
         return self.compiled
 
+    def _compile_state(self, state, rules):
+        self._process_rules(state, rules)
+        return self.compiled[state]
+
+    def _expand(self, rules):
+        '''Yield a state's rules with includes replaced by the included
+        rules.
+        '''
+        for rule in rules:
+            if isinstance(rule, include):
+                try:
+                    included = self.tokendefs[rule]
+                except KeyError:
+                    msg = (
+                        "Can't include undefined state %r. Did you forget "
+                        "do define the state %r in your lexer?")
+                    raise BogusIncludeError(msg % (rule, rule))
+                for included_rule in self._expand(included):
+                    yield included_rule
+            else:
+                yield rule
+
+    def _state_key(self, state):
+        '''Structural fingerprint of a state: everything its compiled
+        rules depend on.
+        '''
+        rules = canonical(list(self._expand(self.tokendefs[state])))
+        return (rules, getattr(self.cls, 'flags', 0), self._pool_key())
+
+    def _pool_key(self):
+        return type(self)
+
+    def analyze(self):
+        '''Check the tokendefs for backtracking risks, empty matches,
+        shadowed rules and bad or unreachable states. Returns a list of
+        rexlex.lexer.analysis.Finding.
+        '''
+        from rexlex.lexer import analysis
+        return analysis.analyze(self)
+
+    def compile_table(self, compiled=None):
+        '''Turn compiled tokendefs into a StateTable, resolving state names
+        and transitions to integers so the lexer does no type checks or
+        string work per token.
+        '''
+        if compiled is None:
+            compiled = self.compile_all()
+        names = sorted(compiled)
+        ids = dict((name, i) for i, name in enumerate(names))
+        states = []
+        for name in names:
+            states.append(tuple(
+                self._compile_rule(rule, ids) for rule in compiled[name]))
+        return StateTable(names, ids, states)
+
+    def _state_id(self, ids, state, rule):
+        try:
+            return ids[state]
+        except KeyError:
+            msg = "Rule %r transitions to undefined state %r."
+            raise ConfigurationError(msg % (rule, state))
+
+    def _compile_rule(self, rule, ids):
+        token, rgxs, push, pop, swap = rule
+        if token is None:
+            kind = WORDS
+        elif isinstance(token, (_TokenType, basestring)):
+            kind = TOKEN
+        else:
+            kind = GROUPS
+
+        npop = 0
+        popset = None
+        pushes = ()
+        if swap and not (push or pop):
+            npop = 1
+            pushes = (self._state_id(ids, swap, rule),)
+        else:
+            if pop:
+                if isinstance(pop, bool):
+                    npop = 1
+                elif isinstance(pop, int):
+                    npop = pop
+                elif isinstance(pop, (set, frozenset)):
+                    # Pop all matching states; unknown names never match.
+                    popset = frozenset(ids[name] for name in pop if name in ids)
+            if push:
+                if isinstance(push, basestring):
+                    push = (push,)
+                for state in push:
+                    if state == '#pop':
+                        npop += 1
+                    elif state.startswith('#pop:'):
+                        npop += int(state[len('#pop:'):])
+                    else:
+                        pushes += (self._state_id(ids, state, rule),)
+        transition = bool(npop or popset or pushes)
+        return CompiledRule(token, tuple(rgxs), kind, npop, popset, pushes,
+                            transition)
+
     def _iter_rgxs(self, rule, _re_type=_re_type):
         rgx = rgxs = rule.rgxs
         rgx_type = type(rgx)
-        if issubclass(rgx_type, (basestring, _re_type)):
+        if issubclass(rgx_type, (basestring, _re_type, words)):
             yield rgx, rgx_type
         else:
             for rgx in rgxs:
@@ -80,5 +234,28 @@ class _BaseCompiler(object):
 
 class Compiler(_BaseCompiler):
 
-    def re_compile(self, flags, text, re_compile=re.compile):
-        return re.compile(text, flags)
+    # Matcher backends tried in order before falling back to re.compile.
+    # Lexers can override this with a ``matchers`` attribute, e.g. set
+    # it to an empty tuple to compile every pattern with ``re``.
+    matchers = (LiteralMatcher,)
+
+    def __init__(self, cls):
+        super(Compiler, self).__init__(cls)
+        self.matchers = getattr(cls, 'matchers', self.matchers)
+
+    def _pool_key(self):
+        return type(self), tuple(self.matchers)
+
+    def re_compile(self, flags, text):
+        if self.pool is None:
+            return self._re_compile(flags, text)
+        key = (type(text), text, flags, self._pool_key())
+        return self.pool.pattern(
+            key, functools.partial(self._re_compile, flags, text))
+
+    def _re_compile(self, flags, text, re_compile=re.compile):
+        for matcher in self.matchers:
+            result = matcher.from_pattern(text, flags)
+            if result is not None:
+                return result
+        return re_compile(text, flags)
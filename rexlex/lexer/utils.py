@@ -21,6 +21,22 @@ def bygroups(*tokens):
     return tokens
 
 
+class words(object):
+    '''Indicates that a rule should match an identifier-shaped run of
+    text (``pattern``) and check it against a table of words, instead of
+    trying a big regex alternation. If ``words`` is a mapping, its values
+    are used as the token types of the matched words and the rule's own
+    token is ignored.
+    '''
+
+    def __init__(self, words, pattern=r'\w+'):
+        self.words = words
+        self.pattern = pattern
+
+    def __repr__(self):
+        return 'words(%r, pattern=%r)' % (self.words, self.pattern)
+
+
 class include(str):
     '''Indicates that a state should include rules from another state.
     '''
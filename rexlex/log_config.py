@@ -2,6 +2,7 @@
 Establish custom log levels for rexlexer's verbose output.
 '''
 import logging
+import contextlib
 from rexlex.config import LOG_MSG_MAXWIDTH
 
 
@@ -36,6 +37,51 @@ for loglevel, loglevel_name, method_name in REXLEX_LOG_LEVELS:
     logging.addLevelName(loglevel, loglevel_name)
 
 
+# ---------------------------------------------------------------------------
+# Scope trace levels to a context instead of the shared 'rexlex' logger.
+# ---------------------------------------------------------------------------
+try:
+    from contextvars import ContextVar
+except ImportError:
+    ContextVar = None
+
+if ContextVar is not None:
+    _trace_level = ContextVar('rexlex_trace_level', default=None)
+    get_trace_level = _trace_level.get
+    _set_trace_level = _trace_level.set
+    _reset_trace_level = _trace_level.reset
+else:
+    import threading
+    _local = threading.local()
+
+    def get_trace_level():
+        return getattr(_local, 'level', None)
+
+    def _set_trace_level(level):
+        token = get_trace_level()
+        _local.level = level
+        return token
+
+    def _reset_trace_level(token):
+        _local.level = token
+
+
+@contextlib.contextmanager
+def trace_level(level):
+    '''Enable trace output at ``level`` for lexers created in the current
+    context (thread or asyncio task), without touching the level of the
+    'rexlex' logger other lexers share::
+
+        with rexlex.trace_level(rexlex.TRACE_STATE):
+            tokens = list(MyLexer(text))
+    '''
+    token = _set_trace_level(level)
+    try:
+        yield
+    finally:
+        _reset_trace_level(token)
+
+
 def rexlex_trace_result(self, message, *args, **kws):
     if self.isEnabledFor(REXLEX_TRACE_RESULT):
         self._log(REXLEX_TRACE_RESULT, message, args, **kws)
@@ -73,6 +119,12 @@ setattr(logging.Logger, 'rexlex_trace', rexlex_trace)
 import ctypes
 import logging
 import os
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 
 class ColorizingStreamHandler(logging.StreamHandler):
@@ -204,3 +256,120 @@ class ColorizingStreamHandler(logging.StreamHandler):
             parts[0] = self.colorize(parts[0], record)
             message = '\n'.join(parts)
         return message
+
+
+# ---------------------------------------------------------------------------
+# Write them from a background thread.
+# ---------------------------------------------------------------------------
+class BackgroundHandlerMixin(object):
+    '''Queues records and formats/writes them in batches on a background
+    thread, so tracing doesn't stall the lexing thread on I/O. When the
+    queue is full, records are dropped and counted in ``dropped`` rather
+    than blocking the caller.
+
+    To use it for rexlex's trace output, point the 'default' handler in
+    ``rexlex.config.LOGGING_CONFIG`` at BackgroundColorizingStreamHandler.
+    '''
+    queue_size = 10000
+    batch_size = 500
+
+    _stop = object()
+
+    def __init__(self, *args, **kwargs):
+        queue_size = kwargs.pop('queue_size', self.queue_size)
+        self.batch_size = kwargs.pop('batch_size', self.batch_size)
+        super(BackgroundHandlerMixin, self).__init__(*args, **kwargs)
+        self.dropped = 0
+        self.queue = queue.Queue(queue_size)
+        # Guards the stream. The handler lock can't be used for that:
+        # handle() holds it around emit(), so a slow write would block
+        # the threads that log.
+        self._io_lock = threading.Lock()
+        self._closing = False
+        self._thread = threading.Thread(
+            target=self._drain, name='rexlex-log-writer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def emit(self, record):
+        args = record.args
+        if args and isinstance(args, tuple):
+            # Arguments may be lists the caller goes on changing; copy
+            # them now since formatting happens later.
+            record.args = tuple(
+                list(arg) if type(arg) is list else arg for arg in args)
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _drain(self):
+        get = self.queue.get
+        get_nowait = self.queue.get_nowait
+        while True:
+            if self._closing and self.queue.empty():
+                # close() couldn't queue the stop marker on a full queue.
+                return
+            batch = [get()]
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(get_nowait())
+            except queue.Empty:
+                pass
+            stop = self._stop in batch
+            self._write_batch([r for r in batch if r is not self._stop])
+            for _ in batch:
+                self.queue.task_done()
+            if stop:
+                return
+
+    def _write_batch(self, records):
+        messages = []
+        for record in records:
+            try:
+                messages.append(self.format(record))
+            except (KeyboardInterrupt, SystemExit):
+                raise
+            except:
+                self.handleError(record)
+        if not messages:
+            return
+        terminator = getattr(self, 'terminator', '\n')
+        self._io_lock.acquire()
+        try:
+            if self.is_tty and os.name == 'nt':
+                for message in messages:
+                    self.output_colorized(message)
+                    self.stream.write(terminator)
+            else:
+                self.stream.write(terminator.join(messages) + terminator)
+            logging.StreamHandler.flush(self)
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            self.handleError(records[-1])
+        finally:
+            self._io_lock.release()
+
+    def flush(self):
+        '''Block until every queued record has been written.
+        '''
+        if self._thread.is_alive():
+            self.queue.join()
+
+    def close(self):
+        if self._thread.is_alive():
+            self._closing = True
+            try:
+                self.queue.put_nowait(self._stop)
+            except queue.Full:
+                # The writer is busy; it stops once the queue is drained.
+                pass
+            self._thread.join()
+        super(BackgroundHandlerMixin, self).close()
+
+
+class BackgroundColorizingStreamHandler(
+        BackgroundHandlerMixin, ColorizingStreamHandler):
+    '''ColorizingStreamHandler that writes from a background thread.
+    '''
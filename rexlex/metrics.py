@@ -0,0 +1,195 @@
+'''Operational metrics for lexer classes.
+
+Lexers count what they do in locals while they run and flush the totals
+to a registry once per document, so the counters cost next to nothing
+per token. Per lexer or scanner class, the registry keeps:
+
+``documents``
+    Lexes run (one per Lexer iteration or ScannerLexer scan).
+``bytes``
+    Input consumed, measured in items of the input: bytes for bytes
+    input, characters for str input.
+``tokens``
+    Tokens produced.
+``seconds``
+    Time spent, including time the consumer spent between tokens.
+``incomplete``
+    Lexes that stopped before the end of the input.
+``errors``
+    Lexes that ended with an exception.
+``hook_hits``, ``hook_misses``
+    ScannerLexer hook matches that were lexed into tokens, and matches
+    that were skipped because they fell inside already lexed text or
+    produced no tokens.
+``max_depth``
+    Deepest state stack seen.
+
+Read them as a dict, or in the Prometheus text format::
+
+    >>> from rexlex import metrics
+    >>> metrics.snapshot()['mypackage.MyLexer']['tokens']
+    >>> metrics.serve(9464)   # or metrics.write_textfile(path)
+
+Set ``metrics = None`` on a lexer class to turn recording off, or point
+it at another MetricsRegistry.
+'''
+import os
+import tempfile
+import threading
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+
+# Metric name, Prometheus type, help text.
+FIELDS = (
+    ('documents', 'counter', 'Documents lexed.'),
+    ('bytes', 'counter', 'Input consumed, in bytes or characters.'),
+    ('tokens', 'counter', 'Tokens produced.'),
+    ('seconds', 'counter', 'Time spent lexing.'),
+    ('incomplete', 'counter', 'Lexes that stopped before the end of input.'),
+    ('errors', 'counter', 'Lexes that ended with an exception.'),
+    ('hook_hits', 'counter', 'Scanner hook matches lexed into tokens.'),
+    ('hook_misses', 'counter', 'Scanner hook matches skipped.'),
+    ('max_depth', 'gauge', 'Deepest state stack seen.'),
+)
+
+_MAX_FIELDS = frozenset(['max_depth'])
+
+
+def class_name(cls):
+    return '%s.%s' % (cls.__module__, cls.__name__)
+
+
+class MetricsRegistry(object):
+    '''Per-class totals of the numbers lexers flush after each document.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._names = {}
+
+    def record(self, cls, values):
+        '''Add a document's values, a dict keyed by field name, to the
+        totals of a class.
+        '''
+        name = self._names.get(cls)
+        if name is None:
+            name = self._names[cls] = class_name(cls)
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                entry = self._entries[name] = dict.fromkeys(
+                    (field for field, _, _ in FIELDS), 0)
+            for field, value in values.items():
+                if field in _MAX_FIELDS:
+                    if entry[field] < value:
+                        entry[field] = value
+                else:
+                    entry[field] += value
+
+    def snapshot(self):
+        '''Dict mapping class names to dicts of their totals.
+        '''
+        with self._lock:
+            return dict(
+                (name, dict(entry)) for name, entry in self._entries.items())
+
+    def reset(self):
+        with self._lock:
+            self._entries.clear()
+
+    def prometheus(self, prefix='rexlex'):
+        '''The totals in the Prometheus text exposition format, labeled
+        by class name.
+        '''
+        snapshot = self.snapshot()
+        lines = []
+        for field, kind, help_text in FIELDS:
+            metric = '%s_%s' % (prefix, field)
+            if kind == 'counter':
+                metric += '_total'
+            lines.append('# HELP %s %s' % (metric, help_text))
+            lines.append('# TYPE %s %s' % (metric, kind))
+            for name in sorted(snapshot):
+                lines.append('%s{lexer="%s"} %s' % (
+                    metric, _escape(name), _format(snapshot[name][field])))
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path, prefix='rexlex'):
+        '''Atomically write the Prometheus text to path, e.g. for the node
+        exporter's textfile collector.
+        '''
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(self.prometheus(prefix))
+            os.rename(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def serve(self, port, addr='', prefix='rexlex'):
+        '''Serve the Prometheus text over HTTP from a daemon thread.
+        Returns the server; call its shutdown() method to stop it.
+        '''
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.prometheus(prefix).encode('utf-8')
+                self.send_response(200)
+                self.send_header(
+                    'Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = HTTPServer((addr, port), Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return server
+
+
+def _escape(value):
+    return (value.replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def _format(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+# The registry lexers record to by default.
+default_registry = MetricsRegistry()
+
+
+def snapshot():
+    return default_registry.snapshot()
+
+
+def reset():
+    default_registry.reset()
+
+
+def prometheus(prefix='rexlex'):
+    return default_registry.prometheus(prefix)
+
+
+def write_textfile(path, prefix='rexlex'):
+    default_registry.write_textfile(path, prefix)
+
+
+def serve(port, addr='', prefix='rexlex'):
+    return default_registry.serve(port, addr, prefix)
@@ -23,18 +23,91 @@ class Scanner(BaseScanner):
 '''
 
 import re
+import time
+from collections import namedtuple
 from operator import methodcaller
 
+import rexlex.metrics
 from rexlex import IncompleteLex
+from rexlex.lexer.exceptions import TimeBudgetExceeded, ConfigurationError
+from rexlex.lexer.py2compat import str, bytes, basestring
+from rexlex.utils.cachedattr import CachedClassAttr
 
 
 __all__ = ["Scanner"]
 
 
-class ScannerContinue:
+class ScannerContinue(Exception):
     '''Continue in scanner's loop.
     '''
 
+class Hook(namedtuple('Hook', 'regex lexer state')):
+    '''A compiled hook: where its regex matches, lexing starts with the
+    given lexer class (None for the scanner's lexer) in the given state
+    (None for the lexer's default statestack).
+    '''
+
+
+def compile_hook(hook):
+    '''Turn a hook yielded by get_hooks, a pattern or a (pattern,
+    lexer_class, start_state) tuple, into a Hook.
+    '''
+    if isinstance(hook, Hook):
+        return hook
+    lexer = state = None
+    if isinstance(hook, tuple):
+        if not 1 <= len(hook) <= 3:
+            raise ConfigurationError(
+                'Hooks are a pattern or a (pattern, lexer_class, '
+                'start_state) tuple, got %r.' % (hook,))
+        hook, lexer, state = (hook + (None, None))[:3]
+    if isinstance(hook, basestring):
+        hook = re.compile(hook)
+    return Hook(hook, lexer, state)
+
+
+# Flags that scoped inline groups can set.
+_INLINE_FLAGS = (
+    (re.IGNORECASE, 'i'), (re.MULTILINE, 'm'), (re.DOTALL, 's'),
+    (re.VERBOSE, 'x'), (re.ASCII, 'a'))
+
+# Backreferences and conditionals refer to groups by their number within
+# the hook, which combining would change.
+_BACKREF = re.compile(r'\\[1-9]|\(\?P=|\(\?\(|\\g<')
+
+
+def combine_hooks(hooks):
+    '''Combine the hooks into one regex matching any of them. Returns
+    its ``search`` method and a dict mapping the ``lastindex`` of a match
+    to the hook that matched, or None if the hooks can't be combined.
+    '''
+    parts = []
+    owners = {}
+    group = 1
+    for hook in hooks:
+        pattern = getattr(hook.regex, 'pattern', None)
+        if not isinstance(pattern, basestring) or (
+                isinstance(pattern, bytes) and bytes is not str):
+            return None
+        if _BACKREF.search(pattern):
+            return None
+        flags = hook.regex.flags
+        inline = ''.join(char for flag, char in _INLINE_FLAGS if flags & flag)
+        if inline:
+            pattern = '(?%s:%s)' % (inline, pattern)
+        parts.append('(%s)' % pattern)
+        # The wrapping group closes after the hook's own groups, so it's
+        # the match's lastindex.
+        owners[group] = hook
+        group += 1 + hook.regex.groups
+    if not parts:
+        return None
+    try:
+        return re.compile('|'.join(parts)).search, owners
+    except (re.error, ValueError):
+        return None
+
+
 class ScannerLexer(object):
     '''This object tries uses the hook functions defined
     in get_hooks to find points within the input string
@@ -51,11 +124,24 @@ class ScannerLexer(object):
     # scanner match objects.
     skip_match = False
 
+    # Budgets for the whole scan, also accepted as constructor kwargs.
+    # Each lexer run gets what's left of the time and token budgets;
+    # max_stalled_scans is passed on as is (None uses the lexer's own).
+    max_time = None
+    max_tokens = None
+    max_stalled_scans = None
+
     Continue = ScannerContinue
 
+    # Registry that per-scan metrics are recorded to, or None; see
+    # rexlex.metrics.
+    metrics = rexlex.metrics.default_registry
+
     def get_hooks(self):
-        '''Yields a regex used to find positions in the input string
-        to begin lexing from.
+        '''Yields regexes used to find positions in the input string
+        to begin lexing from. A hook can also be a (regex, lexer_class,
+        start_state) tuple to lex its hits with another lexer, or from
+        another state; all hooks are found in a single pass.
         '''
         raise NotImplementedError()
 
@@ -64,29 +150,91 @@ class ScannerLexer(object):
         '''
         raise NotImplementedError()
 
-    def __init__(self, text, pos=0, lexer=None):
+    def compile_hooks(self):
+        '''Compile the hooks yielded by get_hooks into Hook tuples.
+        '''
+        return [compile_hook(hook) for hook in self.get_hooks()]
+
+    @classmethod
+    def precompile(cls):
+        '''Compile the class's hooks attribute once, so instances don't
+        recompile it, and precompile the lexers. Hooks from get_hooks may
+        depend on the instance, so they're compiled for each instance.
+        '''
+        lexers = set([cls.lexer])
+        lexers.update(hook.lexer for hook in cls._compiled_hooks or ())
+        for lexer in lexers:
+            if lexer is not None:
+                lexer.precompile()
+
+    @CachedClassAttr
+    def _compiled_hooks(cls):
+        '''The class's hooks attribute as Hook tuples, or None if the
+        hooks come from get_hooks.
+        '''
+        if cls.hooks is None:
+            return None
+        return [compile_hook(hook) for hook in cls.hooks]
+
+    def __init__(self, text, pos=0, lexer=None, **kwargs):
         self.text = text
         self.pos = pos
         self.lexer = self.lexer or lexer
-        if hasattr(self.lexer, 'raise_incomplete'):
-            self.lexer.raise_incomplete = False
-        self.hooks = self.hooks or list(self.get_hooks())
+        hooks = self._compiled_hooks
+        self.hooks = self.compile_hooks() if hooks is None else hooks
+        self.hook = None
+        for name in ('max_time', 'max_tokens', 'max_stalled_scans'):
+            if name in kwargs:
+                setattr(self, name, kwargs[name])
+        self._deadline = None
+        self._tokens_left = None
 
     def __iter__(self):
         '''Yield parse trees.
         '''
-        for matchobj in self.matches_ordered():
-            if not self.check_matchobj(matchobj):
-                continue
-            items = list(self.get_tokens(matchobj))
-            if items is None:
-                continue
-            try:
-                start, end = self.get_span(items)
-            except self.Continue():
-                continue
-            self.pos = end
-            yield items
+        if self.max_time is not None:
+            self._deadline = time.time() + self.max_time
+        self._tokens_left = self.max_tokens
+        # Per-document metrics, flushed once at the end.
+        started = time.time()
+        start_pos = self.pos
+        hits = misses = ntokens = 0
+        error = False
+        try:
+            for matchobj, hook in self.iter_hits():
+                if not self.check_matchobj(matchobj):
+                    misses += 1
+                    continue
+                self.hook = hook
+                items = list(self.get_tokens(matchobj))
+                if not items:
+                    misses += 1
+                    continue
+                if self._tokens_left is not None:
+                    self._tokens_left -= len(items)
+                try:
+                    start, end = self.get_span(items)
+                except self.Continue:
+                    misses += 1
+                    continue
+                hits += 1
+                ntokens += len(items)
+                self.pos = end
+                yield items
+        except Exception:
+            error = True
+            raise
+        finally:
+            if self.metrics is not None:
+                self.metrics.record(type(self), {
+                    'documents': 1,
+                    'bytes': len(self.text) - start_pos,
+                    'tokens': ntokens,
+                    'seconds': time.time() - started,
+                    'errors': int(error),
+                    'hook_hits': hits,
+                    'hook_misses': misses,
+                    })
 
     def check_matchobj(self, matchobj):
         if self.pos <= matchobj.start():
@@ -97,13 +245,63 @@ class ScannerLexer(object):
             # This match occurred within previous text.
             return False
 
-    def iter_matches(self):
+    def iter_hits(self):
+        '''Yield (matchobj, hook) pairs in order of position, in a
+        single pass over the text. Yields the same hits as searching for
+        each hook separately: where hooks match at the same position,
+        each of them in the order they're listed, and no hit of a hook
+        that starts inside that hook's previous match.
+        '''
+        hooks = self.hooks
+        combined = combine_hooks(hooks)
+        if combined is None:
+            for hit in self._iter_hits_separately():
+                yield hit
+            return
+        search, owners = combined
+        order = dict((id(hook), index) for index, hook in enumerate(hooks))
+        # Where each hook's next hit may start, as with finditer.
+        next_start = [0] * len(hooks)
+        text = self.text
+        pos = self.pos
+        while True:
+            found = search(text, max(pos, self.pos))
+            if found is None:
+                return
+            start = found.start()
+            # The combined regex picks the first hook matching here; later
+            # hooks may match here too.
+            first = order[id(owners[found.lastindex])]
+            for index in range(first, len(hooks)):
+                if start < next_start[index]:
+                    continue
+                hook = hooks[index]
+                # Match with the hook's own regex so the match object
+                # has the hook's groups.
+                matchobj = hook.regex.match(text, start)
+                if matchobj is None:
+                    continue
+                end = matchobj.end()
+                next_start[index] = end if start < end else end + 1
+                yield matchobj, hook
+            pos = start + 1
+
+    def _iter_hits_separately(self):
+        '''One pass per hook, for hooks that can't be combined.
+        '''
+        hits = []
         for hook in self.hooks:
-            for matchobj in re.finditer(hook, self.text):
-                yield matchobj
+            for matchobj in hook.regex.finditer(self.text, self.pos):
+                hits.append((matchobj, hook))
+        hits.sort(key=lambda hit: hit[0].start())
+        return hits
+
+    def iter_matches(self):
+        for matchobj, hook in self._iter_hits_separately():
+            yield matchobj
 
     def matches_ordered(self):
-        return sorted(self.iter_matches(), key=methodcaller('start'))
+        return [matchobj for matchobj, hook in self.iter_hits()]
 
     def get_span(self, tokens):
         return tokens[0].start, tokens[-1].end
@@ -116,10 +314,34 @@ class ScannerLexer(object):
             start_pos = matchobj.end()
         else:
             start_pos = self.pos
+        lexer = self.lexer
+        kwargs = self.get_budgets()
+        if self.hook is not None:
+            lexer = self.hook.lexer or lexer
+            if self.hook.state is not None:
+                kwargs['statestack'] = [self.hook.state]
         try:
-            items = self.lexer(self.text, pos=start_pos)
-        except IncomepleteLex as exc:
-            self.handle_lex_error(start, exc)
+            items = lexer(
+                self.text, pos=start_pos, raise_incomplete=False, **kwargs)
+        except IncompleteLex as exc:
+            return self.handle_lex_error(start_pos, exc)
 
         return items
 
+
+    def get_budgets(self):
+        '''Lexer kwargs for the remaining budgets.
+        '''
+        budgets = {}
+        if self._deadline is not None:
+            remaining = self._deadline - time.time()
+            if remaining <= 0:
+                msg = 'Scan took longer than %r seconds; stopped at pos %r.'
+                raise TimeBudgetExceeded(
+                    msg % (self.max_time, self.pos), pos=self.pos)
+            budgets['max_time'] = remaining
+        if self._tokens_left is not None:
+            budgets['max_tokens'] = self._tokens_left
+        if self.max_stalled_scans is not None:
+            budgets['max_stalled_scans'] = self.max_stalled_scans
+        return budgets
@@ -0,0 +1,8 @@
+'''Storing and reusing lexed token streams.
+'''
+from rexlex.tokenstream.binary import (
+    dump_tokens, dumps_tokens, load_tokens, loads_tokens,
+    TokenFile, TokenWriter, FormatError)
+from rexlex.tokenstream.cache import LexCache
+from rexlex.tokenstream.index import (
+    TokenIndex, dump_index, dumps_index, load_index, loads_index)
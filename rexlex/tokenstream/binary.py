@@ -0,0 +1,346 @@
+'''Compact binary format for lexed token streams.
+
+Layout::
+
+    b'RXTK' version
+    token records                        (one per token)
+    trailer                              (tables and block index)
+    trailer offset (uint64 LE) b'RXTK'   (footer)
+
+Each token record is three varints: the zigzag-encoded distance from the
+previous token's end to this token's start, the token's length, and an
+index into the token type table. Records are grouped in blocks of
+``block_size`` tokens; the trailer stores each block's byte offset and
+starting position in a fixed-width index, so any token can be decoded
+by reading at most one block. Token types are stored once, keyed by
+``_TokenType.as_json()``. Optionally, the lexer's state stack at the
+first token of each block is stored too, so lexing can be resumed from
+there.
+
+Since the footer comes last, streams can be written in one pass without
+knowing their length in advance.
+'''
+import io
+import os
+import mmap
+import struct
+
+from rexlex.lexer.exceptions import ConfigurationError
+from rexlex.lexer.itemclass import get_itemclass
+from rexlex.lexer.tokentype import _TokenType, string_to_tokentype
+
+
+MAGIC = b'RXTK'
+VERSION = 1
+BLOCK_SIZE = 256
+
+_FOOTER = struct.Struct('<Q4s')
+_BLOCK = struct.Struct('<QQ')
+
+# Token type table entry kinds.
+_KIND_TOKENTYPE = 0
+_KIND_STRING = 1
+
+# Trailer flags.
+_HAS_STATESTACKS = 1
+
+
+class FormatError(Exception):
+    '''Raised when a token file is truncated or isn't a token file.
+    '''
+
+
+def _encode_varint(buf, value):
+    while 0x80 <= value:
+        buf.append((value & 0x7f) | 0x80)
+        value >>= 7
+    buf.append(value)
+
+
+def _read_varint(buf, offset):
+    result = shift = 0
+    while True:
+        byte = buf[offset]
+        offset += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, offset
+        shift += 7
+
+
+def _zigzag(value):
+    return value << 1 if 0 <= value else ((-value) << 1) - 1
+
+
+def _unzigzag(value):
+    return value >> 1 if not value & 1 else -((value + 1) >> 1)
+
+
+def _encode_string(buf, text):
+    data = text.encode('utf-8')
+    _encode_varint(buf, len(data))
+    buf.extend(data)
+
+
+def _decode_string(buf, offset):
+    size, offset = _read_varint(buf, offset)
+    end = offset + size
+    return bytes(buf[offset:end]).decode('utf-8'), end
+
+
+class TokenWriter(object):
+    '''Encodes a token stream incrementally to a binary file object.
+    '''
+
+    def __init__(self, fileobj, statestacks=False, block_size=BLOCK_SIZE):
+        self.fileobj = fileobj
+        self.statestacks = statestacks
+        self.block_size = block_size
+        self.type_ids = {}
+        self.types = []
+        self.state_ids = {}
+        self.states = []
+        self.blocks = []
+        self.snapshots = []
+        self.count = 0
+        self.prev_end = 0
+        self.buf = bytearray()
+        self.offset = len(MAGIC) + 1
+        fileobj.write(MAGIC + bytearray((VERSION,)))
+
+    def _type_id(self, token):
+        type_id = self.type_ids.get(token)
+        if type_id is None:
+            type_id = self.type_ids[token] = len(self.types)
+            self.types.append(token)
+        return type_id
+
+    def _state_id(self, state):
+        state_id = self.state_ids.get(state)
+        if state_id is None:
+            state_id = self.state_ids[state] = len(self.states)
+            self.states.append(state)
+        return state_id
+
+    def write(self, start, end, token, statestack=None):
+        buf = self.buf
+        if not self.count % self.block_size:
+            self.blocks.append((self.offset + len(buf), self.prev_end))
+            if self.statestacks:
+                self.snapshots.append(
+                    [self._state_id(state) for state in statestack])
+            if 0x10000 <= len(buf):
+                self.fileobj.write(bytes(buf))
+                self.offset += len(buf)
+                del buf[:]
+        _encode_varint(buf, _zigzag(start - self.prev_end))
+        _encode_varint(buf, end - start)
+        _encode_varint(buf, self._type_id(token))
+        self.prev_end = end
+        self.count += 1
+
+    def close(self):
+        '''Write the trailer and footer. Returns the number of tokens.
+        '''
+        buf = self.buf
+        trailer_offset = self.offset + len(buf)
+        _encode_varint(buf, self.count)
+        _encode_varint(buf, self.block_size)
+        _encode_varint(buf, _HAS_STATESTACKS if self.statestacks else 0)
+        _encode_varint(buf, len(self.types))
+        for token in self.types:
+            if isinstance(token, _TokenType):
+                buf.append(_KIND_TOKENTYPE)
+                _encode_string(buf, token.as_json())
+            else:
+                buf.append(_KIND_STRING)
+                _encode_string(buf, token)
+        _encode_varint(buf, len(self.states))
+        for state in self.states:
+            _encode_string(buf, state)
+        for stack in self.snapshots:
+            _encode_varint(buf, len(stack))
+            for state_id in stack:
+                _encode_varint(buf, state_id)
+        _encode_varint(buf, len(self.blocks))
+        for block in self.blocks:
+            buf.extend(_BLOCK.pack(*block))
+        buf.extend(_FOOTER.pack(trailer_offset, MAGIC))
+        self.fileobj.write(bytes(buf))
+        del buf[:]
+        return self.count
+
+
+class TokenFile(object):
+    '''Random access to an encoded token stream held in any buffer
+    (bytes, or an mmap when loaded with ``load_tokens``).
+    '''
+
+    def __init__(self, buf, closer=None):
+        self.buf = buf
+        self._closer = closer
+        self._block = (None, None)
+        if len(buf) < len(MAGIC) + 1 + _FOOTER.size or \
+                bytes(buf[:len(MAGIC)]) != MAGIC:
+            raise FormatError('Not a token file.')
+        if buf[len(MAGIC)] != VERSION:
+            raise FormatError('Unsupported version %r.' % buf[len(MAGIC)])
+        trailer_offset, magic = _FOOTER.unpack_from(buf, len(buf) - _FOOTER.size)
+        if magic != MAGIC:
+            raise FormatError('Truncated token file.')
+        self._read_trailer(trailer_offset)
+
+    def _read_trailer(self, offset):
+        buf = self.buf
+        self.count, offset = _read_varint(buf, offset)
+        self.block_size, offset = _read_varint(buf, offset)
+        flags, offset = _read_varint(buf, offset)
+
+        ntypes, offset = _read_varint(buf, offset)
+        types = []
+        for _ in range(ntypes):
+            kind = buf[offset]
+            name, offset = _decode_string(buf, offset + 1)
+            if kind == _KIND_TOKENTYPE:
+                name = string_to_tokentype(name)
+            types.append(name)
+        self.types = types
+
+        nstates, offset = _read_varint(buf, offset)
+        states = []
+        for _ in range(nstates):
+            name, offset = _decode_string(buf, offset)
+            states.append(name)
+        self.states = states
+
+        nblocks = (self.count + self.block_size - 1) // self.block_size
+        snapshots = []
+        if flags & _HAS_STATESTACKS:
+            for _ in range(nblocks):
+                depth, offset = _read_varint(buf, offset)
+                stack = []
+                for _ in range(depth):
+                    state_id, offset = _read_varint(buf, offset)
+                    stack.append(states[state_id])
+                snapshots.append(stack)
+        self.snapshots = snapshots
+
+        nblocks, offset = _read_varint(buf, offset)
+        self._blocks_offset = offset
+        self.nblocks = nblocks
+
+    def _block_entry(self, block):
+        return _BLOCK.unpack_from(self.buf, self._blocks_offset + block * _BLOCK.size)
+
+    def _decode_block(self, block):
+        '''Decode a whole block into a list of (start, end, token) tuples.
+        '''
+        cached_block, tokens = self._block
+        if cached_block == block:
+            return tokens
+        offset, prev_end = self._block_entry(block)
+        count = min(self.block_size, self.count - block * self.block_size)
+        buf = self.buf
+        types = self.types
+        tokens = []
+        append = tokens.append
+        for _ in range(count):
+            delta, offset = _read_varint(buf, offset)
+            length, offset = _read_varint(buf, offset)
+            type_id, offset = _read_varint(buf, offset)
+            start = prev_end + _unzigzag(delta)
+            prev_end = start + length
+            append((start, prev_end, types[type_id]))
+        self._block = (block, tokens)
+        return tokens
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.count))]
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError('token index out of range')
+        block, i = divmod(index, self.block_size)
+        return self._decode_block(block)[i]
+
+    def __iter__(self):
+        for block in range(self.nblocks):
+            for token in self._decode_block(block):
+                yield token
+
+    def items(self, text):
+        '''Yield Item instances bound to the original text.
+        '''
+        Item = get_itemclass(text)
+        for start, end, token in self:
+            yield Item(start, end, token)
+
+    def statestack_at(self, index):
+        '''Return (token_index, statestack) for the nearest stored state
+        stack snapshot at or before the given token index.
+        '''
+        if not self.snapshots:
+            raise ConfigurationError('Token file has no state stacks.')
+        block = index // self.block_size
+        return block * self.block_size, list(self.snapshots[block])
+
+    def close(self):
+        self._block = (None, None)
+        if self._closer is not None:
+            self._closer()
+            self._closer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def dump_tokens(stream, fileobj, statestacks=False, block_size=BLOCK_SIZE):
+    '''Encode a stream of (start, end, token) items to a binary file
+    object. If statestacks is true, stream must be a lexer instance, whose
+    ``statestack`` is snapshotted at the start of each block. Returns the
+    number of tokens written.
+    '''
+    if statestacks and not hasattr(stream, 'statestack'):
+        msg = 'State stack snapshots need a lexer instance, not %r.'
+        raise ConfigurationError(msg % (stream,))
+    writer = TokenWriter(fileobj, statestacks, block_size)
+    write = writer.write
+    if statestacks:
+        for start, end, token in stream:
+            write(start, end, token, stream.statestack)
+    else:
+        for start, end, token in stream:
+            write(start, end, token)
+    return writer.close()
+
+
+def dumps_tokens(stream, statestacks=False, block_size=BLOCK_SIZE):
+    '''Like dump_tokens, but return the encoded bytes.
+    '''
+    fileobj = io.BytesIO()
+    dump_tokens(stream, fileobj, statestacks, block_size)
+    return fileobj.getvalue()
+
+
+def load_tokens(path):
+    '''Memory-map a token file and return a TokenFile for it.
+    '''
+    with open(path, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            # mmap can't map an empty file.
+            raise FormatError('Empty token file.')
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return TokenFile(buf, closer=buf.close)
+
+
+def loads_tokens(data):
+    '''Return a TokenFile over encoded bytes.
+    '''
+    return TokenFile(data)
@@ -0,0 +1,200 @@
+'''Content-addressed cache of lex results.
+
+Results are keyed by a hash of the input text plus the fingerprint of
+the lexer class, and stored in the compact binary token format. The
+in-process tier is an LRU bounded by total bytes; the optional on-disk
+tier is a directory of token files, also bounded by total bytes, with
+least recently used files evicted first.
+'''
+import os
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+from rexlex.lexer.fingerprint import fingerprint
+from rexlex.lexer.py2compat import str, unicode, bytes, basestring
+from rexlex.tokenstream.binary import dumps_tokens, loads_tokens, FormatError
+
+
+class LexCache(object):
+    '''Caches the token streams produced by ``lexer_cls(text)``.
+    '''
+    suffix = '.rxtk'
+
+    def __init__(self, max_bytes=64 << 20, directory=None,
+                 max_disk_bytes=1 << 30):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = OrderedDict()
+        self._fingerprints = {}
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+        self.disk_bytes = 0
+        if directory is not None:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            self.disk_bytes = sum(size for _, size, _ in self._disk_files())
+
+    def key(self, lexer_cls, text):
+        '''Hex digest identifying the result of lexing text with lexer_cls.
+        '''
+        lexer_fingerprint = self._fingerprints.get(lexer_cls)
+        if lexer_fingerprint is None:
+            lexer_fingerprint = fingerprint(lexer_cls)
+            self._fingerprints[lexer_cls] = lexer_fingerprint
+        digest = hashlib.sha1(lexer_fingerprint.encode('ascii'))
+        if isinstance(text, unicode):
+            digest.update(b'u')
+            digest.update(text.encode('utf-8', 'surrogatepass'))
+        else:
+            digest.update(b'b')
+            digest.update(text)
+        return digest.hexdigest()
+
+    def lex(self, lexer_cls, text):
+        '''Return the list of Items lexer_cls produces for text, from the
+        cache if possible.
+        '''
+        key = self.key(lexer_cls, text)
+        data = self._get(key)
+        if data is None:
+            items = list(lexer_cls(text))
+            self._put(key, dumps_tokens(items))
+            return items
+        return list(loads_tokens(data).items(text))
+
+    def _get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return data
+        data = self._disk_get(key)
+        with self._lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.disk_hits += 1
+                self._memory_put(key, data)
+        return data
+
+    def _put(self, key, data):
+        with self._lock:
+            self._memory_put(key, data)
+        self._disk_put(key, data)
+
+    def _memory_put(self, key, data):
+        if self.max_bytes < len(data) or key in self._entries:
+            return
+        self._entries[key] = data
+        self.bytes += len(data)
+        while self.max_bytes < self.bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.bytes -= len(evicted)
+            self.evictions += 1
+
+    # -----------------------------------------------------------------------
+    # On-disk tier.
+    # -----------------------------------------------------------------------
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + self.suffix)
+
+    def _disk_files(self):
+        for dirpath, dirnames, filenames in os.walk(self.directory):
+            for filename in filenames:
+                if filename.endswith(self.suffix):
+                    path = os.path.join(dirpath, filename)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    yield stat.st_mtime, stat.st_size, path
+
+    def _disk_get(self, key):
+        if self.directory is None:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            loads_tokens(data)
+        except (IOError, OSError, FormatError):
+            return None
+        try:
+            # Touch the file so eviction sees it as recently used.
+            os.utime(path, None)
+        except OSError:
+            pass
+        return data
+
+    def _disk_put(self, key, data):
+        if self.directory is None or self.max_disk_bytes < len(data):
+            return
+        path = self._path(key)
+        if os.path.exists(path):
+            return
+        dirname = os.path.dirname(path)
+        if not os.path.isdir(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError:
+                pass
+        fd, tmp = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self._lock:
+            self.disk_bytes += len(data)
+            if self.disk_bytes <= self.max_disk_bytes:
+                return
+        self._disk_evict()
+
+    def _disk_evict(self):
+        files = sorted(self._disk_files())
+        total = sum(size for _, size, _ in files)
+        for mtime, size, path in files:
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self.disk_evictions += 1
+        with self._lock:
+            self.disk_bytes = total
+
+    # -----------------------------------------------------------------------
+    # Sizing.
+    # -----------------------------------------------------------------------
+    def stats(self):
+        '''Counters for sizing the cache.
+        '''
+        with self._lock:
+            lookups = self.hits + self.misses
+            return dict(
+                hits=self.hits,
+                disk_hits=self.disk_hits,
+                misses=self.misses,
+                hit_rate=float(self.hits) / lookups if lookups else 0.0,
+                entries=len(self._entries),
+                bytes=self.bytes,
+                evictions=self.evictions,
+                disk_bytes=self.disk_bytes,
+                disk_evictions=self.disk_evictions)
+
+    def clear(self):
+        '''Empty the in-process tier.
+        '''
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
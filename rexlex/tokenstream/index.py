@@ -0,0 +1,241 @@
+'''Token type index over a lexed stream.
+
+For each token type, the index keeps sorted arrays of the starts and
+ends of its tokens, and of their positions in the stream. "All tokens of
+type T between offsets X and Y" is then two bisections instead of a scan
+over the whole stream, and counts come straight from the bisections.
+Queries expand token types to their subtypes through the ``_TokenType``
+hierarchy, so ``Token.Name`` covers ``Token.Name.Builtin`` too.
+
+Like the token stream format, the index is a file of its own that is
+meant to be stored next to the token file::
+
+    b'RXTI' version
+    type table      (per type: kind, name, count, offset of its arrays)
+    padding         (to 8 bytes)
+    arrays          (per type: starts, ends and stream positions, int64 LE)
+
+The arrays are fixed width, so a memory-mapped index is queried in
+place without decoding it.
+'''
+import io
+import os
+import sys
+import mmap
+import heapq
+import struct
+from array import array
+from bisect import bisect_left, bisect_right
+
+from rexlex.lexer.tokentype import _TokenType, string_to_tokentype
+from rexlex.tokenstream.binary import (
+    FormatError, _encode_varint, _read_varint, _encode_string,
+    _decode_string, _KIND_TOKENTYPE, _KIND_STRING)
+
+
+MAGIC = b'RXTI'
+VERSION = 1
+
+_TYPE = struct.Struct('<QQ')
+_BIG_ENDIAN = sys.byteorder == 'big'
+
+
+class TokenIndex(object):
+    '''Maps each token type to sorted (starts, ends, positions) arrays.
+    Assumes tokens of one type don't overlap, which holds for lexer
+    output.
+    '''
+
+    def __init__(self, arrays, closer=None):
+        self.arrays = arrays
+        self._closer = closer
+        self._expanded = {}
+
+    @classmethod
+    def from_tokens(cls, tokens):
+        '''Build an index from (start, end, token) tuples, e.g. a lexer
+        or a TokenFile.
+        '''
+        arrays = {}
+        for position, (start, end, token) in enumerate(tokens):
+            entry = arrays.get(token)
+            if entry is None:
+                entry = arrays[token] = (array('q'), array('q'), array('q'))
+            starts, ends, positions = entry
+            starts.append(start)
+            ends.append(end)
+            positions.append(position)
+        return cls(arrays)
+
+    def types(self):
+        return list(self.arrays)
+
+    def _expand(self, tokentype, subtypes):
+        '''The indexed types a query for tokentype covers.
+        '''
+        if not subtypes or not isinstance(tokentype, _TokenType):
+            return [tokentype] if tokentype in self.arrays else []
+        expanded = self._expanded.get(tokentype)
+        if expanded is None:
+            expanded = [
+                token for token in self.arrays
+                if isinstance(token, _TokenType) and token in tokentype]
+            self._expanded[tokentype] = expanded
+        return expanded
+
+    def _range(self, token, start, end):
+        starts, ends, positions = self.arrays[token]
+        lo = bisect_left(starts, start)
+        hi = len(ends) if end is None else bisect_right(ends, end)
+        return lo, max(lo, hi)
+
+    def count(self, tokentype, start=0, end=None, subtypes=True):
+        '''Number of tokens of tokentype within text[start:end].
+        '''
+        total = 0
+        for token in self._expand(tokentype, subtypes):
+            lo, hi = self._range(token, start, end)
+            total += hi - lo
+        return total
+
+    def counts(self, start=0, end=None):
+        '''Dict of the number of tokens of each type within
+        text[start:end], leaving out types with none.
+        '''
+        counts = {}
+        for token in self.arrays:
+            lo, hi = self._range(token, start, end)
+            if lo < hi:
+                counts[token] = hi - lo
+        return counts
+
+    def find(self, tokentype, start=0, end=None, subtypes=True):
+        '''List the (start, end, token, position) tuples of the tokens of
+        tokentype within text[start:end], in stream order. Position is
+        the token's index in the stream, e.g. for a TokenFile.
+        '''
+        runs = []
+        for token in self._expand(tokentype, subtypes):
+            starts, ends, positions = self.arrays[token]
+            lo, hi = self._range(token, start, end)
+            runs.append([
+                (positions[i], starts[i], ends[i], token)
+                for i in range(lo, hi)])
+        return [
+            (token_start, token_end, token, position)
+            for position, token_start, token_end, token in heapq.merge(*runs)]
+
+    # -----------------------------------------------------------------------
+    # Serialization.
+    # -----------------------------------------------------------------------
+    def dump(self, fileobj):
+        '''Write the index to a binary file object.
+        '''
+        header = bytearray(MAGIC + bytearray((VERSION,)))
+        _encode_varint(header, len(self.arrays))
+        names = []
+        for token in self.arrays:
+            name = bytearray()
+            if isinstance(token, _TokenType):
+                name.append(_KIND_TOKENTYPE)
+                _encode_string(name, token.as_json())
+            else:
+                name.append(_KIND_STRING)
+                _encode_string(name, token)
+            names.append(name)
+        header_size = len(header) + sum(len(name) + _TYPE.size for name in names)
+        padding = -header_size % 8
+        offset = header_size + padding
+        for name, starts in zip(names, (a[0] for a in self.arrays.values())):
+            header.extend(name)
+            header.extend(_TYPE.pack(len(starts), offset))
+            offset += 3 * 8 * len(starts)
+        header.extend(b'\0' * padding)
+        fileobj.write(bytes(header))
+        for entry in self.arrays.values():
+            for values in entry:
+                values = array('q', values)
+                if _BIG_ENDIAN:
+                    values.byteswap()
+                fileobj.write(values.tobytes())
+
+    def dumps(self):
+        fileobj = io.BytesIO()
+        self.dump(fileobj)
+        return fileobj.getvalue()
+
+    @classmethod
+    def from_buffer(cls, buf, closer=None):
+        '''Read an index from a buffer. On little-endian machines the
+        arrays are views of the buffer, not copies.
+        '''
+        if bytes(buf[:len(MAGIC)]) != MAGIC:
+            raise FormatError('Not a token index file.')
+        if buf[len(MAGIC)] != VERSION:
+            raise FormatError('Unsupported version %r.' % buf[len(MAGIC)])
+        view = memoryview(buf)
+        try:
+            ntypes, offset = _read_varint(buf, len(MAGIC) + 1)
+            arrays = {}
+            for _ in range(ntypes):
+                kind = buf[offset]
+                name, offset = _decode_string(buf, offset + 1)
+                if kind == _KIND_TOKENTYPE:
+                    name = string_to_tokentype(name)
+                count, data_offset = _TYPE.unpack_from(buf, offset)
+                offset += _TYPE.size
+                if len(buf) < data_offset + 3 * 8 * count:
+                    raise FormatError('Truncated token index file.')
+                entry = []
+                for i in range(3):
+                    start = data_offset + i * 8 * count
+                    values = view[start:start + 8 * count].cast('q')
+                    if _BIG_ENDIAN:
+                        values = array('q', values)
+                        values.byteswap()
+                    entry.append(values)
+                arrays[name] = tuple(entry)
+        except (IndexError, struct.error):
+            raise FormatError('Truncated token index file.')
+        return cls(arrays, closer)
+
+    def close(self):
+        self.arrays = {}
+        self._expanded = {}
+        if self._closer is not None:
+            self._closer()
+            self._closer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def dump_index(tokens, fileobj):
+    '''Index a stream of (start, end, token) tuples and write the index
+    to a binary file object. Returns the index.
+    '''
+    index = TokenIndex.from_tokens(tokens)
+    index.dump(fileobj)
+    return index
+
+
+def dumps_index(tokens):
+    return TokenIndex.from_tokens(tokens).dumps()
+
+
+def load_index(path):
+    '''Memory-map an index file.
+    '''
+    with open(path, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            # mmap can't map an empty file.
+            raise FormatError('Empty token index file.')
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return TokenIndex.from_buffer(buf, closer=buf.close)
+
+
+def loads_index(data):
+    return TokenIndex.from_buffer(data)
@@ -140,6 +140,12 @@ class ColorizingStreamHandler(logging.StreamHandler):
         return message
 
 
+class BackgroundColorizingStreamHandler(
+        rexlog.BackgroundHandlerMixin, ColorizingStreamHandler):
+    '''ColorizingStreamHandler that writes from a background thread.
+    '''
+
+
 def main():
     root = logging.getLogger()
     root.setLevel(logging.DEBUG)
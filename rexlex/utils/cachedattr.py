@@ -1,3 +1,10 @@
+import threading
+
+
+# Shared by all CachedClassAttrs, since computing one may need others.
+_class_attr_lock = threading.RLock()
+
+
 class CachedAttr(object):
     '''Computes attr value and caches it in the instance.'''
 
@@ -21,14 +28,33 @@ class CachedClassAttr(object):
             def myMethod(cls):
                 # ...
             myMethod = CachedClassAttribute(myMethod)
-    Use "del MyClass.myMethod" to clear cache.'''
+
+    The value is cached separately for each class, so subclasses don't
+    inherit a value computed for their parent. Reading it through an
+    instance also stores it on the instance, so the instance's later
+    reads are plain attribute lookups.
+    Use "del MyClass._cached_myMethod" to clear cache.'''
 
     def __init__(self, method, name=None):
         self.method = method
         self.name = name or method.__name__
+        self.cache_name = '_cached_' + self.name
 
     def __get__(self, inst, cls):
-        result = self.method(cls)
-        setattr(cls, self.name, result)
+        try:
+            result = cls.__dict__[self.cache_name]
+        except KeyError:
+            # Compute it once even if several threads get here at once.
+            with _class_attr_lock:
+                try:
+                    result = cls.__dict__[self.cache_name]
+                except KeyError:
+                    result = self.method(cls)
+                    setattr(cls, self.cache_name, result)
+        if inst is not None:
+            try:
+                setattr(inst, self.name, result)
+            except AttributeError:
+                # Instances without a __dict__.
+                pass
         return result
-
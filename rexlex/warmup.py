@@ -0,0 +1,94 @@
+'''Compiling lexers ahead of time.
+
+Lexer classes compile their tokendefs lazily, on first use. Behind a
+pre-forking server that means every worker compiles every lexer on its
+first request, and keeps its own copy of the result. Calling warmup()
+in the parent process compiles everything up front; the compiled
+objects are then inherited by the workers. Where the interpreter has
+``gc.freeze()``, warmup() also moves everything allocated so far into
+the permanent generation, so collections in the workers don't touch
+(and copy-on-write) those pages.
+'''
+import gc
+import sys
+import time
+import collections
+
+from rexlex.lexer.lexer import Lexer
+from rexlex.scanner.scanner import ScannerLexer
+
+
+class WarmupReport(collections.namedtuple(
+        'WarmupReport', 'classes seconds objects blocks frozen errors')):
+    '''What warmup() did: the classes it compiled, how long that took,
+    how many gc-tracked objects and allocated memory blocks it added,
+    whether gc.freeze() was called, and (class, exception) pairs for the
+    classes that failed to compile.
+    '''
+    __slots__ = ()
+
+    def __str__(self):
+        return ('Compiled %d classes in %.3fs (%d objects, %d blocks); '
+                '%d errors.%s') % (
+            len(self.classes), self.seconds, self.objects, self.blocks,
+            len(self.errors), ' Froze the heap.' if self.frozen else '')
+
+
+def _subclasses(cls):
+    seen = set()
+    pending = [cls]
+    while pending:
+        for subclass in pending.pop().__subclasses__():
+            if subclass not in seen:
+                seen.add(subclass)
+                pending.append(subclass)
+                yield subclass
+
+
+def _is_concrete(cls):
+    if issubclass(cls, ScannerLexer):
+        return cls.get_hooks is not ScannerLexer.get_hooks or \
+            cls.hooks is not None
+    return bool(getattr(cls, 'tokendefs', None))
+
+
+def all_lexer_classes():
+    '''All imported Lexer and ScannerLexer subclasses that can be
+    compiled.
+    '''
+    classes = list(_subclasses(Lexer)) + list(_subclasses(ScannerLexer))
+    return [cls for cls in classes if _is_concrete(cls)]
+
+
+def _allocated_blocks():
+    getallocatedblocks = getattr(sys, 'getallocatedblocks', None)
+    return getallocatedblocks() if getallocatedblocks else 0
+
+
+def warmup(lexer_classes=None, freeze=True):
+    '''Precompile the given Lexer and ScannerLexer classes, or all
+    imported ones, and freeze the heap if possible. Classes that fail to
+    compile are reported rather than raised. Returns a WarmupReport.
+    '''
+    if lexer_classes is None:
+        lexer_classes = all_lexer_classes()
+    objects = len(gc.get_objects())
+    blocks = _allocated_blocks()
+    started = time.time()
+    errors = []
+    for cls in lexer_classes:
+        try:
+            cls.precompile()
+        except Exception as exc:
+            errors.append((cls, exc))
+    seconds = time.time() - started
+    objects = len(gc.get_objects()) - objects
+    blocks = _allocated_blocks() - blocks
+
+    frozen = False
+    if freeze and hasattr(gc, 'freeze'):
+        gc.collect()
+        gc.freeze()
+        frozen = True
+    return WarmupReport(
+        list(lexer_classes), seconds, objects, blocks, frozen, errors)
@@ -26,6 +26,9 @@ setup(**{
     "license": "MIT",
     "url": "http://twneale.github.com/rexlex/",
     "platforms": ['any'],
+    "extras_require": {
+        'prescan': ['numpy'],
+        },
     "scripts": [
     ]
 })
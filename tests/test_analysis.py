@@ -0,0 +1,88 @@
+import io
+import sys
+import unittest
+
+from rexlex import Lexer, include, words
+from rexlex.lexer import analysis
+from rexlex.lexer.tokendefs import Compiler
+
+
+class BadLexer(Lexer):
+    tokendefs = {
+        'root': [
+            include('whitespace'),
+            ('Keyword', words(['if', 'else'])),
+            ('Operator', '=='),
+            ('Operator', '=|<'),
+            ('Name', r'\w+'),
+            ('Keyword', r'while|for'),
+            ('Nested', r'(a+)+b'),
+            ('Alternation', r'(\w+x|\d+y)*z'),
+            ('Fine', r'(ab+c)*d'),
+            ('Open', r'\(', 'paren'),
+            ('Open', r'\[', 'nope'),
+            ('Empty', r'x*'),
+        ],
+        'whitespace': [
+            ('Whitespace', r'\s+'),
+        ],
+        'paren': [
+            ('Close', r'\)', '#pop'),
+            ('Default', '', '#pop'),
+        ],
+        'orphan': [
+            ('X', 'x'),
+        ],
+    }
+
+
+class GoodLexer(Lexer):
+    tokendefs = {
+        'root': [
+            ('Operator', '=='),
+            ('Operator', '='),
+            ('Name', r'\w+', 'after'),
+        ],
+        'after': [
+            ('Colon', ':', '#pop'),
+        ],
+    }
+
+
+class AnalysisTest(unittest.TestCase):
+
+    def findings(self, lexer_cls):
+        return dict(
+            ((f.kind, f.state, f.rule), f)
+            for f in Compiler(lexer_cls).analyze())
+
+    def test_findings(self):
+        findings = self.findings(BadLexer)
+        self.assertEqual(sorted(findings), [
+            ('empty', 'paren', 1),
+            ('empty', 'root', 11),
+            ('redos', 'root', 6),
+            ('redos', 'root', 7),
+            ('shadowed', 'root', 5),
+            ('undefined-state', 'root', 10),
+            ('unreachable', 'orphan', None),
+        ])
+        self.assertEqual(findings['empty', 'root', 11].level, analysis.ERROR)
+        self.assertEqual(findings['empty', 'paren', 1].level, analysis.WARNING)
+        self.assertIn("rule #4 '\\\\w+'", findings['shadowed', 'root', 5].message)
+
+    def test_clean(self):
+        self.assertEqual(Compiler(GoodLexer).analyze(), [])
+
+    def test_cli(self):
+        stdout = sys.stdout
+        sys.stdout = output = io.StringIO()
+        try:
+            status = analysis.main(['tests.test_analysis.BadLexer'])
+            clean = analysis.main(['tests.test_analysis.GoodLexer'])
+        finally:
+            sys.stdout = stdout
+        self.assertEqual((status, clean), (1, 0))
+        self.assertIn(
+            "tests.test_analysis.BadLexer: warning: unreachable: "
+            "state 'orphan'", output.getvalue())
@@ -0,0 +1,66 @@
+import io
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from rexlex import cli
+
+
+class CliTest(unittest.TestCase):
+    lexer = 'tests.test_lexer.TestableLexer'
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        for name, text in (('a.txt', 'abcde'), ('b.txt', 'abcde abcde'),
+                           ('c.dat', 'e')):
+            with open(os.path.join(self.directory, name), 'w') as f:
+                f.write(text)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_cli(self, *args, **kwargs):
+        stdout = io.BytesIO()
+        stderr = io.StringIO()
+        status = cli.main(
+            list(args), stdin=io.StringIO(kwargs.get('stdin', '')),
+            stdout=stdout, stderr=stderr)
+        return status, stdout.getvalue(), stderr.getvalue()
+
+    def test_jsonl(self):
+        pattern = os.path.join(self.directory, '*.txt')
+        missing = os.path.join(self.directory, 'missing.txt')
+        for jobs in ('1', '2'):
+            status, out, err = self.run_cli(
+                self.lexer, pattern, missing, '-j', jobs)
+            records = [json.loads(line) for line in out.splitlines()]
+            self.assertEqual(
+                [os.path.basename(record['path']) for record in records],
+                ['a.txt', 'b.txt', 'missing.txt'])
+            self.assertEqual(records[0]['tokens'][:2],
+                             [[0, 1, 'Root'], [1, 2, 'Bar']])
+            self.assertEqual(len(records[1]['tokens']), 10)
+            self.assertIn('FileNotFoundError', records[2]['error'])
+            self.assertEqual(status, 1)
+            self.assertIn('Lexed 3 files, 16 bytes, 15 tokens', err)
+            self.assertIn('1 errors.', err)
+
+    def test_binary_unordered_mmap(self):
+        pattern = os.path.join(self.directory, '*')
+        status, out, err = self.run_cli(
+            self.lexer, pattern, '-f', 'binary', '--unordered',
+            '--mmap-threshold', '1', '-q')
+        frames = dict(
+            (os.path.basename(path), [tuple(token) for token in tokens])
+            for path, tokens in cli.read_frames(io.BytesIO(out)))
+        self.assertEqual(sorted(frames), ['a.txt', 'b.txt', 'c.dat'])
+        self.assertEqual(frames['c.dat'], [(0, 1, 'Root')])
+        self.assertEqual((status, err), (0, ''))
+
+    def test_stdin(self):
+        status, out, err = self.run_cli(self.lexer, '-q', stdin='ae')
+        record = json.loads(out)
+        self.assertEqual(record['path'], '-')
+        self.assertEqual(record['tokens'], [[0, 1, 'Root'], [1, 2, 'Root']])
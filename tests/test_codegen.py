@@ -0,0 +1,115 @@
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+from rexlex import Lexer, IncompleteLex, Token, bygroups, words
+from rexlex.lexer import codegen
+from rexlex.lexer.exceptions import NoProgress
+
+from tests.test_lexer import (
+    TestableLexer, PopNLexer, EmptyMatchLexer, RecoveringLexer, NestedLexer)
+
+
+class MixedLexer(Lexer):
+    re_skip = re.compile(r'\s+|#[^\n]*')
+    dont_emit = ['Comma']
+    tokendefs = {
+        'root': [
+            ('Keyword', words({'if': 'If', 'else': 'Else'})),
+            (bygroups('Name', 'Comma', 'Name'), r'(\w+)(,)(\w+)?'),
+            ('Name', r'\w+'),
+            ('Open', r'\[', 'list'),
+        ],
+        'list': [
+            ('Comma', ','),
+            ('Number', r'\d+'),
+            ('Open', r'\[', 'list'),
+            ('Close', r'\]', None, set(['list'])),
+        ],
+    }
+
+
+class CodegenTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def generated(self, lexer_cls):
+        return type(lexer_cls.__name__, (lexer_cls,), {
+            'engine': 'codegen', 'codegen_dir': self.directory})
+
+    def assertSameTokens(self, lexer_cls, text, **kwargs):
+        generic = lexer_cls(text, **kwargs)
+        expected = [tuple(item) for item in generic]
+        lexer = self.generated(lexer_cls)(text, **kwargs)
+        self.assertEqual([tuple(item) for item in lexer], expected)
+        self.assertEqual(lexer.statestack, generic.statestack)
+        self.assertEqual(lexer.pos, generic.pos)
+
+    def test_same_tokens(self):
+        self.assertSameTokens(TestableLexer, 'abcde abcbcde a')
+        self.assertSameTokens(TestableLexer, 'abcdq')
+        self.assertSameTokens(PopNLexer, '(k=1;j=;)x')
+        self.assertSameTokens(PopNLexer, 'x', statestack=['root', 'root'])
+        self.assertSameTokens(
+            MixedLexer, 'if a,b c, else # note\n [1, [2,3] 4] x')
+        self.assertSameTokens(RecoveringLexer, 'foo ?? bar (1 ? nil) !!')
+        self.assertSameTokens(RecoveringLexer, '(1 ?? x', recover=False)
+        self.assertSameTokens(NestedLexer, '(( ) (( ) a ((b')
+        self.assertSameTokens(NestedLexer, '( ( ( ( a ) ) )) ?')
+
+    def test_incomplete(self):
+        lexer = self.generated(TestableLexer)('abcdq', raise_incomplete=True)
+        self.assertRaises(IncompleteLex, list, lexer)
+
+    def test_no_progress(self):
+        lexer = self.generated(EmptyMatchLexer)('aac', max_stalled_scans=10)
+        with self.assertRaises(NoProgress) as cm:
+            list(lexer)
+        self.assertEqual((cm.exception.pos, cm.exception.rule), (2, 1))
+
+    def test_module_cached(self):
+        lexer_cls = self.generated(MixedLexer)
+        lexer_cls.precompile()
+        filenames = [name for name in os.listdir(self.directory)
+                     if name.endswith('.py')]
+        self.assertEqual(len(filenames), 1)
+        with open(os.path.join(self.directory, filenames[0])) as f:
+            self.assertIn('def state_0(text, pos):', f.read())
+        # Another class of the same shape imports the same module.
+        module = codegen.load_module(self.generated(MixedLexer), self.directory)
+        self.assertEqual(module.__file__,
+                         os.path.join(self.directory, filenames[0]))
+
+    def test_fallback(self):
+        lexer_cls = self.generated(TestableLexer)
+        lexer = lexer_cls('abcde', codegen=False)
+        list(lexer)
+        self.assertTrue(len(lexer.flight_recorder))
+        lexer = lexer_cls('abcde')
+        list(lexer)
+        self.assertFalse(len(lexer.flight_recorder))
+
+    def test_run(self):
+        text = 'if a,b c, else # note\n [1, [2,3] 4] x'
+        generic = MixedLexer(text)
+        generic_events = []
+        expected = [(start, end, generic.token_types[token_id])
+                    for start, end, token_id in self.collect(
+                        generic, lambda *event: generic_events.append(event))]
+        lexer = self.generated(MixedLexer)(text)
+        events = []
+        tokens = self.collect(lexer, lambda *event: events.append(event))
+        self.assertEqual([(start, end, lexer.token_types[token_id])
+                          for start, end, token_id in tokens], expected)
+        self.assertEqual(events, generic_events)
+
+    def collect(self, lexer, on_state=None):
+        tokens = []
+        lexer.run(lambda *token: tokens.append(token), on_state)
+        return tokens
@@ -0,0 +1,59 @@
+import re
+import random
+import unittest
+
+from rexlex import Lexer, Token
+from rexlex.lexer.dfa import DFA, NOMATCH
+
+
+class ReLexer(Lexer):
+
+    re_skip = r'\s*'
+    tokendefs = {
+        'root': [
+            (Token.Keyword, r'if|iff|else\b'),
+            (Token.Number, r'\d+(\.\d*)?(e[+-]?\d+)?'),
+            (Token.Name, r'[a-z_]\w*'),
+            (Token.String, r'"', 'string'),
+            (Token.Operator, r'[-+*/=<>]=?|\.\.'),
+            (Token.Punctuation, r'[(){};,.]'),
+            (Token.Lookahead, r'(?=x)x'),
+            (Token.Other, r'[^\sA-Z]{2,3}?'),
+        ],
+        'string': [
+            (Token.String.Escape, r'\\.'),
+            (Token.String, r'[^"\\]+'),
+            (Token.String, r'"', None, True),
+        ],
+    }
+
+
+class DFALexer(ReLexer):
+    engine = 'dfa'
+
+
+class DFATest(unittest.TestCase):
+
+    def test_unsupported_patterns(self):
+        dfa = DFALexer._dfas['root']
+        self.assertEqual(
+            dfa.supported,
+            [False, True, True, True, True, True, False, True])
+
+    def test_first_matching_pattern(self):
+        patterns = [r'a|ab', r'[a-c]+x', r'\w+', r'x{2,4}y', r'(?ia)[^q]z']
+        dfa = DFA([(pattern, 0) for pattern in patterns])
+        self.assertEqual(dfa.match_index('abx', 0), 0)
+        self.assertEqual(dfa.match_index('bbx', 0), 1)
+        self.assertEqual(dfa.match_index('xxxy', 0), 2)
+        self.assertEqual(dfa.match_index(' Z', 0), 4)
+        self.assertEqual(dfa.match_index(' Q', 0), NOMATCH)
+        self.assertEqual(dfa.match_index('- ab', 2), 0)
+
+    def test_same_tokens_as_re(self):
+        rand = random.Random(42)
+        alphabet = 'ifelsx0129.e+-"\\ ()=<>_;\xe9٠AZ'
+        for _ in range(500):
+            text = ''.join(
+                rand.choice(alphabet) for _ in range(rand.randint(0, 30)))
+            self.assertEqual(list(ReLexer(text)), list(DFALexer(text)))
@@ -0,0 +1,73 @@
+import re
+import unittest
+
+from rexlex import Lexer, Token
+from rexlex.lexer.filters import Pipeline, Drop, Remap, Merge, Lookahead
+
+
+class PlainLexer(Lexer):
+    tokendefs = {
+        'root': [
+            (Token.Text.Whitespace, r'\s'),
+            (Token.Name.Builtin, r'print\b'),
+            (Token.Name, r'[a-z]+'),
+            (Token.Punctuation.Open, r'\('),
+            (Token.Punctuation.Close, r'\)'),
+            (Token.Operator, r'[-+*/=]'),
+        ],
+    }
+
+
+def paren_call(token, following):
+    # Names directly followed by '(' are function names.
+    start, end, tokentype = token
+    if tokentype == Token.Name and following and \
+            following[0][2] == Token.Punctuation.Open:
+        return [(start, end, Token.Name.Function)]
+    return [token]
+
+
+class FilteredLexer(PlainLexer):
+    filters = [
+        Drop(Token.Text),
+        Remap({Token.Name.Builtin: Token.Name}),
+        Lookahead(paren_call),
+        Merge(Token.Punctuation, Token.Operator),
+    ]
+
+
+class FilterTest(unittest.TestCase):
+    text = 'print x  foo(a) ++ ((y'
+
+    def lex(self, lexer_cls):
+        return [(item.text, item.token) for item in lexer_cls(self.text)]
+
+    def test_lexer_filters(self):
+        self.assertEqual(self.lex(FilteredLexer), [
+            ('print', Token.Name), ('x', Token.Name),
+            ('foo', Token.Name.Function), ('(', Token.Punctuation.Open),
+            ('a', Token.Name), (')', Token.Punctuation.Close),
+            ('++', Token.Operator), ('((', Token.Punctuation.Open),
+            ('y', Token.Name)])
+        # Run twice, so cached lookups are exercised.
+        self.assertEqual(self.lex(FilteredLexer), self.lex(FilteredLexer))
+
+    def test_no_filters(self):
+        self.assertIsNone(PlainLexer._pipeline)
+        self.assertEqual(len(self.lex(PlainLexer)), 16)
+
+    def test_merge_contiguous(self):
+        tokens = [(0, 1, 'A'), (1, 2, 'A'), (3, 4, 'A'), (4, 5, 'B')]
+        self.assertEqual(list(Pipeline([Merge()])(tokens)), [
+            (0, 2, 'A'), (3, 4, 'A'), (4, 5, 'B')])
+        self.assertEqual(list(Pipeline([Merge(contiguous=False)])(tokens)),
+                         [(0, 4, 'A'), (4, 5, 'B')])
+
+    def test_fusion(self):
+        pipeline = Pipeline([
+            Drop('B'), Remap({'C': 'A'}), Merge(contiguous=False), Drop('D')])
+        self.assertEqual(len(pipeline.stages), 2)
+        tokens = [(0, 1, 'A'), (1, 2, 'B'), (2, 3, 'C'), (3, 4, 'D')]
+        self.assertEqual(list(pipeline(tokens)), [(0, 3, 'A')])
+        ids = list(pipeline.run(tokens))
+        self.assertEqual(ids, [(0, 3, pipeline.tokens.index('A'))])
@@ -1,8 +1,16 @@
+import gc
 import re
 import unittest
+from io import BytesIO
 
-from rexlex import Lexer
+from rexlex import Lexer, IncompleteLex, Token, bygroups, words
+from rexlex.lexer.exceptions import (
+    ConfigurationError, NoProgress, TokenBudgetExceeded, TimeBudgetExceeded)
+from rexlex import log_config
+from rexlex.lexer import events, linememo
+from rexlex.lexer import itemclass
 from rexlex.lexer.itemclass import get_itemclass
+from rexlex.lexer.filters import Drop
 
 
 class TestableLexer(Lexer):
@@ -40,3 +48,388 @@ class TupleTransTest(unittest.TestCase):
     def test(self):
         toks = list(TestableLexer(self.text))
         self.assertEqual(toks, self.expected)
+
+
+class PopNLexer(Lexer):
+    """Test '#pop:N', swaps and bygroups."""
+
+    tokendefs = {
+        'root': [
+            ('Open', '\\(', ('a', 'b', 'c')),
+            (bygroups('Key', 'Value'), r'(\w)=(\d)?;'),
+            ('Swap', 'x', None, None, 'b'),
+        ],
+        'a': [],
+        'b': [],
+        'c': [
+            ('Close', '\\)', '#pop:2'),
+        ],
+    }
+
+
+class StateTableTest(unittest.TestCase):
+
+    def test_pop_n(self):
+        lexer = PopNLexer('(')
+        list(lexer)
+        self.assertEqual(lexer.statestack, ('root', 'a', 'b', 'c'))
+        lexer = PopNLexer('()')
+        list(lexer)
+        self.assertEqual(lexer.statestack, ('root', 'a'))
+
+    def test_swap(self):
+        lexer = PopNLexer('x', statestack=['root', 'root'])
+        list(lexer)
+        self.assertEqual(lexer.statestack, ('root', 'b'))
+
+    def test_bygroups_spans(self):
+        toks = [tuple(item) for item in PopNLexer('k=1;j=;')]
+        self.assertEqual(
+            toks, [(0, 1, 'Key'), (2, 3, 'Value'), (4, 5, 'Key')])
+
+    def test_statestack_assignment(self):
+        lexer = PopNLexer('(')
+        # A snapshot: it can't be changed in place, only replaced.
+        self.assertRaises(AttributeError, getattr, lexer.statestack, 'append')
+        lexer.statestack = lexer.statestack + ('a',)
+        self.assertEqual(lexer.statestack, ('root', 'a'))
+
+    def test_undefined_statestack(self):
+        self.assertRaises(
+            ConfigurationError, PopNLexer, '', statestack=['root', 'nope'])
+
+    def test_undefined_transition_target(self):
+        class BadLexer(Lexer):
+            tokendefs = {'root': [('A', 'a', 'nope')]}
+        self.assertRaises(ConfigurationError, BadLexer, 'a')
+
+
+class EmptyMatchLexer(Lexer):
+    tokendefs = {
+        'root': [
+            ('A', 'a'),
+            ('Empty', 'b*'),
+        ],
+    }
+
+
+class BudgetTest(unittest.TestCase):
+
+    def test_no_progress(self):
+        lexer = EmptyMatchLexer('aac', max_stalled_scans=10)
+        with self.assertRaises(NoProgress) as cm:
+            list(lexer)
+        exc = cm.exception
+        self.assertEqual((exc.pos, exc.state, exc.rule), (2, 'root', 1))
+        self.assertIn("rule #1 ['b*']", str(exc))
+
+    def test_max_tokens(self):
+        lexer = TestableLexer('abcde' * 10, max_tokens=12)
+        with self.assertRaises(TokenBudgetExceeded) as cm:
+            list(lexer)
+        self.assertEqual(cm.exception.pos, 13)
+        self.assertEqual(len(list(TestableLexer('abcde', max_tokens=5))), 5)
+
+    def test_max_time(self):
+        lexer = TestableLexer('abcde' * 10, max_time=-1)
+        self.assertRaises(TimeBudgetExceeded, list, lexer)
+
+
+class RecoveringLexer(Lexer):
+    recover = True
+    re_skip = re.compile(r'\s+')
+    tokendefs = {
+        'root': [
+            ('Name', '[a-z]+'),
+            ('Open', r'\(', 'paren'),
+        ],
+        'paren': [
+            ('Number', r'\d+'),
+            ('Keyword', words(['nil'])),
+            ('Close', r'\)', None, True),
+        ],
+    }
+
+
+class RecoveryTest(unittest.TestCase):
+
+    def lex(self, text, **kwargs):
+        return [(item.text, item.token)
+                for item in RecoveringLexer(text, **kwargs)]
+
+    def test_resync_in_current_state(self):
+        self.assertEqual(self.lex('foo ?? bar (1 ? nil) !!'), [
+            ('foo', 'Name'), ('??', Token.Error), ('bar', 'Name'),
+            ('(', 'Open'), ('1', 'Number'), ('?', Token.Error),
+            ('nil', 'Keyword'), (')', 'Close'), ('!!', Token.Error)])
+
+    def test_resync_in_root(self):
+        lexer = RecoveringLexer('(1 ?? x')
+        self.assertEqual([(item.text, item.token) for item in lexer], [
+            ('(', 'Open'), ('1', 'Number'), ('??', Token.Error),
+            ('x', 'Name')])
+        self.assertEqual(lexer.statestack, ('root',))
+        kinds = [event[0] for event in lexer.flight_recorder]
+        self.assertIn(events.RECOVER, kinds)
+
+    def test_off(self):
+        self.assertEqual(self.lex('foo ?? bar', recover=False),
+                         [('foo', 'Name')])
+
+    def test_resync_search(self):
+        search = RecoveringLexer._state_resyncs[
+            RecoveringLexer._state_ids['paren']]
+        self.assertEqual(search('?? n 5').start(), 3)
+        self.assertIsNone(search('?? ; x'))
+
+
+class IncompleteLexer(TestableLexer):
+    raise_incomplete = True
+    flight_recorder_size = 8
+
+
+class FlightRecorderTest(unittest.TestCase):
+
+    def test_incomplete_lex_dumps_events(self):
+        lexer = IncompleteLexer('abcdX')
+        with self.assertRaises(IncompleteLex) as cm:
+            list(lexer)
+        message = str(cm.exception)
+        self.assertIn("Stopped at pos 4 of 5 in state 'root'", message)
+        self.assertIn('Last 8 trace events', message)
+        self.assertEqual(len(cm.exception.flight_record), 8)
+        self.assertIn("Popping from 'foo'", cm.exception.flight_record[0])
+
+    def test_trace_file_replay(self):
+        text = 'abcde'
+        lexer = TestableLexer(text)
+        list(lexer)
+        buf = BytesIO()
+        lexer.flight_recorder.write(buf)
+        buf.seek(0)
+        recorded, states = events.read_events(buf)
+        self.assertEqual(recorded, list(lexer.flight_recorder))
+        self.assertEqual(states, ['bar', 'foo', 'root'])
+        matches = [e for e in recorded if e[0] == events.MATCH]
+        self.assertEqual(
+            [(pos, end) for _, pos, _, _, end in matches],
+            [(0, 1), (1, 2), (2, 3), (3, 4), (4, 5)])
+        lines = events.render(recorded, states, text)
+        self.assertIn("  _process_rule: match found: c (rule #1 of 'bar', "
+                      "pos 2 to 3)", lines)
+
+
+class LineIndexTest(unittest.TestCase):
+    text = 'a b\n\nc\nd e'
+
+    def test_item_positions(self):
+        items = list(TestableLexer(self.text))
+        self.assertEqual(
+            [(item.text, item.line, item.col) for item in items],
+            [('a', 1, 0), ('b', 1, 2), ('c', 3, 0), ('d', 4, 0),
+             ('e', 4, 2)])
+        Item = items[0].__class__
+        self.assertEqual(items[-1].end_position, (4, 3))
+        self.assertEqual(Item.offset(3, 0), 5)
+        self.assertRaises(IndexError, Item.offset, 5, 0)
+        self.assertEqual(len(Item.line_index), 4)
+
+    def test_shared_per_text(self):
+        first = TestableLexer(self.text)
+        second = TestableLexer(self.text, pos=4)
+        self.assertIs(first.Item.line_index, second.Item.line_index)
+        # Lexers over other texts in between don't stop the sharing.
+        other = TestableLexer(self.text + 'a')
+        third = TestableLexer(self.text)
+        self.assertIsNot(other.Item, first.Item)
+        self.assertIs(third.Item, first.Item)
+
+    def test_text_released(self):
+        text = 'a b ' * 1000
+        key = id(text)
+        lexer = TestableLexer(text)
+        self.assertIn(key, itemclass._itemclasses)
+        del lexer, text
+        gc.collect()
+        self.assertNotIn(key, itemclass._itemclasses)
+
+
+class NestedLexer(Lexer):
+    re_skip = re.compile(' +')
+    tokendefs = {
+        'root': [
+            ('Open', r'\(', 'paren'),
+            ('Word', r'\w+'),
+        ],
+        'paren': [
+            ('Open', r'\(', 'paren'),
+            ('Close', r'\)', '#pop'),
+        ],
+    }
+
+
+class FailedMatchMemoTest(unittest.TestCase):
+
+    def attempts(self, text):
+        lexer = NestedLexer(text, loglevel=log_config.REXLEX_TRACE)
+        patterns = []
+
+        def trace(message, *args):
+            if message == lexer._msg.PROCESS_RULE_TRYING_REGEX:
+                patterns.append(args[0])
+
+        lexer.trace = trace
+        tokens = [tuple(item) for item in lexer]
+        return tokens, patterns
+
+    def test_pops_dont_retry_regexes(self):
+        tokens, patterns = self.attempts('( ( ( ( a')
+        self.assertEqual([token for _, _, token in tokens],
+                         ['Open'] * 4 + ['Word'])
+        # The innermost 'paren' tries both its regexes at 'a'; the three
+        # pops back to 'paren' and the pop to root retry none of them.
+        self.assertEqual(patterns, [r'\('] * 4 + [r'\(', r'\)', r'\w+'])
+
+    def test_same_tokens(self):
+        text = '(( ) (( ) a ((b'
+        tokens, _ = self.attempts(text)
+        self.assertEqual(tokens, [tuple(item) for item in NestedLexer(text)])
+        self.assertEqual(len(tokens), 10)
+
+
+class LogLexer(Lexer):
+    line_memo = 3
+    re_skip = re.compile(' +')
+    tokendefs = {
+        'root': [
+            ('Level', 'INFO|WARN'),
+            ('Number', r'\d+'),
+            ('Open', r'\[', 'bracket'),
+            ('Newline', '\n'),
+            ('Word', r'\w+'),
+        ],
+        'bracket': [
+            ('Word', r'\w+'),
+            ('Newline', '\n'),
+            ('Close', r'\]', '#pop'),
+        ],
+    }
+
+
+class LineMemoTest(unittest.TestCase):
+    text = ('INFO [main] started 1\n' * 3 + 'WARN [db] slow 250\n'
+            + 'INFO [main] started 1\n' + 'WARN [db slow\nINFO x')
+
+    def tearDown(self):
+        LogLexer._line_memo.clear()
+
+    def tokens(self, lexer_cls, text):
+        return [tuple(item) for item in lexer_cls(text)]
+
+    def test_same_tokens(self):
+        class PlainLexer(LogLexer):
+            line_memo = None
+
+        self.assertEqual(self.tokens(LogLexer, self.text),
+                         self.tokens(PlainLexer, self.text))
+        stats = LogLexer.line_memo_stats()
+        # The line after the unterminated bracket starts in 'bracket', so
+        # it's a miss even though the same text was seen in root.
+        self.assertEqual((stats['hits'], stats['misses']), (3, 4))
+        self.assertEqual((stats['size'], stats['evictions']), (3, 1))
+        self.assertIsNone(PlainLexer.line_memo_stats())
+
+    def test_lex_lines_matches_whole_text(self):
+        text = 'WARN [db slow\nslower\n] 1\n' * 3 + 'INFO [a\n] 2'
+        lexer = LogLexer(text)
+        counts = [0]
+        tokens = list(linememo.lex_lines(
+            lexer, linememo.LineMemo(10), None, counts))
+
+        class PlainLexer(LogLexer):
+            line_memo = None
+
+        self.assertEqual(tokens, list(PlainLexer(text).iter_tokens()))
+        self.assertEqual((lexer.pos, lexer.statestack), (len(text), ('root',)))
+        self.assertEqual(counts[0], len(tokens))
+
+    def test_patterns_across_lines(self):
+        class SpaceLexer(LogLexer):
+            re_skip = re.compile(r'\s+')
+
+        class LookaheadLexer(LogLexer):
+            tokendefs = dict(LogLexer.tokendefs, root=[
+                ('Last', r'\w+(?=\n\n)')] + LogLexer.tokendefs['root'])
+
+        # Lexed line by line, the skip couldn't take '\n  ' in one go and
+        # the lookahead couldn't see past the line; no memo for these.
+        for lexer_cls in (SpaceLexer, LookaheadLexer):
+            self.assertIsNone(lexer_cls.line_memo_stats())
+        self.assertIsNotNone(LogLexer.line_memo_stats())
+
+    def test_normalized(self):
+        class TemplateLexer(LogLexer):
+            line_normalize = staticmethod(lambda line: re.sub(r'\d', '0', line))
+
+        text = 'INFO 12\nINFO 34\nINFO 56\n'
+        self.assertEqual(self.tokens(TemplateLexer, text),
+                         self.tokens(LogLexer, text))
+        self.assertEqual(TemplateLexer.line_memo_stats()['hits'], 2)
+
+    def test_bounded(self):
+        text = ''.join('INFO %s\n' % word for word in 'abcdea')
+        list(LogLexer(text))
+        stats = LogLexer.line_memo_stats()
+        self.assertEqual((stats['size'], stats['evictions']), (3, 3))
+        self.assertEqual(stats['hits'], 0)
+
+
+class RunTest(unittest.TestCase):
+
+    def run_lexer(self, lexer, on_state=None):
+        tokens = []
+        lexer.run(lambda start, end, token_id: tokens.append(
+            (start, end, lexer.token_types[token_id])), on_state)
+        return tokens
+
+    def test_same_tokens(self):
+        for lexer_cls, text in ((TestableLexer, 'abcde abcbcde a'),
+                                (PopNLexer, '(k=1;j=;)x'),
+                                (RecoveringLexer, 'foo ?? bar (1 ? nil) !!'),
+                                (LogLexer, LineMemoTest.text)):
+            expected = list(lexer_cls(text).iter_tokens())
+            self.assertEqual(self.run_lexer(lexer_cls(text)), expected)
+        LogLexer._line_memo.clear()
+
+    def test_state_events(self):
+        lexer = TestableLexer('abcde')
+        events = []
+        self.run_lexer(lexer, lambda *event: events.append(event))
+        names = lexer._state_names
+        self.assertEqual(
+            [(pos, names[state], depth) for pos, state, depth in events],
+            # Failing to match 'e' pops back to root one state at a time.
+            [(1, 'bar', 2), (2, 'bar', 3), (3, 'foo', 4), (4, 'bar', 3),
+             (4, 'bar', 2), (4, 'root', 1)])
+
+    def test_feed(self):
+        class Handler(object):
+            def __init__(self):
+                self.tokens = []
+
+            def token(self, start, end, token_id):
+                self.tokens.append((start, end, token_id))
+
+        handler = Handler()
+        self.assertEqual(TestableLexer('abcde').feed(handler), 5)
+        self.assertEqual([end for _, end, _ in handler.tokens], [1, 2, 3, 4, 5])
+
+    def test_filters_with_state_events(self):
+        class FilteredLexer(TestableLexer):
+            filters = [Drop('Foo')]
+
+        lexer = FilteredLexer('abcde')
+        self.assertRaises(ConfigurationError, lexer.run, id, id)
+        tokens = self.run_lexer(FilteredLexer('abcde'))
+        self.assertEqual([token for _, _, token in tokens],
+                         ['Root', 'Bar', 'Bar', 'Root'])
@@ -3,10 +3,12 @@ since if they don't the logging output of every program that invokes
 rexlex will be thoroughly despoiled with by its noisy trace output.
 '''
 import sys
+import threading
 import logging
 import unittest
 
 from six import StringIO
+import rexlex
 import rexlex.log_config
 from rexlex import lexer
 
@@ -14,6 +16,10 @@ from rexlex import lexer
 logger = logging.getLogger('rexlex')
 
 
+class TokenLexer(rexlex.Lexer):
+    tokendefs = {'root': [('A', 'a'), ('B', 'b')]}
+
+
 class TestRexlexTraceResult(unittest.TestCase):
 
     expected = 'rexlex: test'
@@ -182,3 +188,129 @@ class TestRexlexTraceResult(unittest.TestCase):
     def test_trace(self):
         logger.rexlex_trace("test")
         self.assertIn(self.expected, self.stderr.getvalue())
+
+
+class TestBackgroundHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.stream = StringIO()
+        self.logger = logging.getLogger('rexlex.test_background')
+        self.logger.propagate = False
+        self.logger.setLevel(rexlex.log_config.REXLEX_TRACE)
+
+    def tearDown(self):
+        for handler in list(self.logger.handlers):
+            self.logger.removeHandler(handler)
+            handler.close()
+
+    def test_writes_in_background(self):
+        handler = rexlex.log_config.BackgroundColorizingStreamHandler(
+            self.stream)
+        self.logger.addHandler(handler)
+        statestack = ['root']
+        for i in range(100):
+            self.logger.rexlex_trace('msg %r %r', i, statestack)
+        statestack.append('changed')
+        handler.flush()
+        lines = self.stream.getvalue().splitlines()
+        self.assertEqual(len(lines), 100)
+        self.assertEqual(lines[-1], "msg 99 ['root']")
+
+    def test_drops_when_full(self):
+        writing = threading.Event()
+        release = threading.Event()
+
+        class GatedStream(StringIO):
+            def write(self, s):
+                writing.set()
+                release.wait()
+                return StringIO.write(self, s)
+
+        handler = rexlex.log_config.BackgroundColorizingStreamHandler(
+            GatedStream(), queue_size=5, batch_size=1)
+        self.logger.addHandler(handler)
+        self.logger.rexlex_trace('msg first')
+        # The writer is now stuck in write(), holding no lock emit needs.
+        writing.wait()
+        for i in range(50):
+            self.logger.rexlex_trace('msg %r', i)
+        self.assertEqual(handler.dropped, 45)
+        release.set()
+        handler.flush()
+        self.assertEqual(len(handler.stream.getvalue().splitlines()), 6)
+
+    def test_close_with_full_queue(self):
+        writing = threading.Event()
+        release = threading.Event()
+
+        class GatedStream(StringIO):
+            def write(self, s):
+                writing.set()
+                release.wait()
+                return StringIO.write(self, s)
+
+        handler = rexlex.log_config.BackgroundColorizingStreamHandler(
+            GatedStream(), queue_size=2, batch_size=1)
+        self.logger.addHandler(handler)
+        self.logger.rexlex_trace('msg first')
+        writing.wait()
+        for i in range(2):
+            self.logger.rexlex_trace('msg %r', i)
+        self.assertTrue(handler.queue.full())
+        self.logger.removeHandler(handler)
+        # close() can't queue its stop marker, and mustn't wait for room.
+        closer = threading.Thread(target=handler.close)
+        closer.start()
+        while not handler._closing:
+            closer.join(0.01)
+        release.set()
+        closer.join()
+        self.assertFalse(handler._thread.is_alive())
+        self.assertEqual(len(handler.stream.getvalue().splitlines()), 3)
+
+
+class TestScopedTraceLevel(unittest.TestCase):
+
+    def setUp(self):
+        self.stderr = StringIO()
+        self.real_stderr = sys.stderr
+        logger.handlers[0].stream = self.stderr
+        logger.setLevel(logging.WARNING)
+
+    def tearDown(self):
+        logger.handlers[0].stream = self.real_stderr
+
+    def test_lexer_leaves_logger_level_alone(self):
+        class TracingLexer(TokenLexer):
+            DEBUG = True
+        list(TracingLexer('ab'))
+        self.assertEqual(logger.level, logging.WARNING)
+        self.assertIn('_process_rule', self.stderr.getvalue())
+
+    def test_trace_level_context(self):
+        list(TokenLexer('ab'))
+        self.assertEqual(self.stderr.getvalue(), '')
+        with rexlex.trace_level(rexlex.TRACE_RESULT):
+            list(TokenLexer('ab'))
+        output = self.stderr.getvalue()
+        self.assertIn("token='A'", output)
+        self.assertNotIn('_process_rule', output)
+
+    def test_concurrent_lexing(self):
+        texts = ['ab' * i for i in range(1, 50)]
+        expected = [list(TokenLexer(text)) for text in texts]
+        results = {}
+
+        def lex(i):
+            level = rexlex.TRACE if i % 2 else None
+            with rexlex.trace_level(level):
+                results[i] = list(TokenLexer(texts[i]))
+
+        threads = [threading.Thread(target=lex, args=(i,))
+                   for i in range(len(texts))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([results[i] for i in range(len(texts))], expected)
+        self.assertEqual(logger.level, logging.WARNING)
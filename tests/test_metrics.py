@@ -0,0 +1,93 @@
+import shutil
+import tempfile
+import unittest
+from urllib.request import urlopen
+
+from rexlex import Lexer, ScannerLexer
+from rexlex.metrics import MetricsRegistry
+
+from tests.test_lexer import TestableLexer
+
+
+registry = MetricsRegistry()
+
+
+class MeteredLexer(TestableLexer):
+    metrics = registry
+
+
+class MeteredScanner(ScannerLexer):
+    lexer = MeteredLexer
+    metrics = registry
+
+    def get_hooks(self):
+        yield 'a'
+        yield 'b'
+        yield 'q'
+        yield 'e'
+
+
+class MetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        registry.reset()
+
+    def test_lexer(self):
+        list(MeteredLexer('abcde abcde'))
+        list(MeteredLexer('abcq', raise_incomplete=False))
+        entry = registry.snapshot()['tests.test_metrics.MeteredLexer']
+        self.assertEqual(entry['documents'], 2)
+        self.assertEqual(entry['tokens'], 13)
+        self.assertEqual(entry['bytes'], 14)
+        self.assertEqual(entry['incomplete'], 1)
+        self.assertEqual(entry['errors'], 0)
+        # root, bar, bar, foo.
+        self.assertEqual(entry['max_depth'], 4)
+        self.assertLess(0, entry['seconds'])
+
+    def test_codegen_counts_the_same(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        class GeneratedLexer(MeteredLexer):
+            engine = 'codegen'
+            codegen_dir = directory
+
+        list(MeteredLexer('abcde abcbcde'))
+        list(GeneratedLexer('abcde abcbcde'))
+        snapshot = registry.snapshot()
+        generic = snapshot['tests.test_metrics.MeteredLexer']
+        generated = snapshot['tests.test_metrics.GeneratedLexer']
+        for field in ('documents', 'tokens', 'bytes', 'max_depth'):
+            self.assertEqual(generic[field], generated[field], field)
+
+    def test_errors(self):
+        lexer = MeteredLexer('abcq', raise_incomplete=True)
+        self.assertRaises(Exception, list, lexer)
+        entry = registry.snapshot()['tests.test_metrics.MeteredLexer']
+        self.assertEqual((entry['incomplete'], entry['errors']), (1, 1))
+
+    def test_scanner(self):
+        scans = list(MeteredScanner('xabcdex q e'))
+        self.assertEqual(len(scans), 2)
+        entry = registry.snapshot()['tests.test_metrics.MeteredScanner']
+        self.assertEqual(entry['documents'], 1)
+        self.assertEqual(entry['tokens'], 6)
+        # q lexes to nothing. The b and e inside the first lex aren't
+        # searched for at all.
+        self.assertEqual((entry['hook_hits'], entry['hook_misses']), (2, 1))
+
+    def test_prometheus(self):
+        list(MeteredLexer('abcde'))
+        text = registry.prometheus()
+        self.assertIn('# TYPE rexlex_tokens_total counter\n', text)
+        self.assertIn(
+            'rexlex_tokens_total{lexer="tests.test_metrics.MeteredLexer"} 5\n',
+            text)
+        self.assertIn('# TYPE rexlex_max_depth gauge\n', text)
+
+        server = registry.serve(0, '127.0.0.1')
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = 'http://127.0.0.1:%d/metrics' % server.server_address[1]
+        self.assertEqual(urlopen(url).read().decode('utf-8'), text)
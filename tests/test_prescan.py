@@ -0,0 +1,95 @@
+import unittest
+
+from rexlex import Lexer, Token, include
+from rexlex.lexer.exceptions import ConfigurationError
+from rexlex.lexer.prescan import ByteClass, get_prescanner, prescan, np
+
+
+class CSVLexer(Lexer):
+
+    tokendefs = {
+        'root': [
+            (Token.Whitespace, b'[ \\t]+'),
+            (Token.Number, b'\\d+'),
+            (Token.Punctuation, b','),
+            (Token.Newline, b'\\n'),
+            (Token.String, b'"[^"\\s,\\d]*"'),
+            (Token.Name, b'[^\\s,"\\d]+'),
+        ],
+    }
+
+    byteclasses = [
+        ByteClass(Token.Whitespace, b' \t'),
+        ByteClass(Token.Number, b'0123456789'),
+        ByteClass(Token.Punctuation, b',', run=False),
+        ByteClass(Token.Newline, b'\n', run=False),
+    ]
+
+
+@unittest.skipIf(np is None, 'numpy is not installed')
+class PrescanTest(unittest.TestCase):
+
+    def test_same_tokens_as_lexer(self):
+        data = b'id, name,,  score\n1,"ab",  42\n\n77,xyz,3\n'
+        self.assertEqual(list(prescan(CSVLexer, data)), list(CSVLexer(data)))
+
+    def test_stops_like_lexer(self):
+        class RecoveringLexer(CSVLexer):
+            recover = True
+
+        # The quote can't be lexed: both stop after '1,', or with recover,
+        # both emit an error token and go on.
+        data = b'1,"ab 2,3'
+        for lexer_cls in (CSVLexer, RecoveringLexer):
+            self.assertEqual(list(prescan(lexer_cls, data)),
+                             list(lexer_cls(data)))
+        self.assertEqual(len(list(prescan(CSVLexer, data))), 2)
+
+    def test_prescanner_cached(self):
+        prescanner = get_prescanner(CSVLexer, CSVLexer.byteclasses)
+        self.assertIs(get_prescanner(CSVLexer, CSVLexer.byteclasses),
+                      prescanner)
+
+    def test_state_carries_across_spans(self):
+        class QuotedLexer(CSVLexer):
+            tokendefs = {
+                'root': [
+                    include('classes'),
+                    (Token.String, b'"', 'quoted'),
+                    (Token.Name, b'[^\\s,"\\d]+'),
+                ],
+                'quoted': [
+                    include('classes'),
+                    (Token.String, b'"', '#pop'),
+                    (Token.String, b'[^\\s,"\\d]+'),
+                ],
+                'classes': CSVLexer.tokendefs['root'][:4],
+            }
+
+        data = b'a,"b 1,c"\nd, "e"'
+        items = list(prescan(QuotedLexer, data))
+        self.assertEqual(items, list(QuotedLexer(data)))
+        # 'c' follows a comma, but is still lexed in the 'quoted' state.
+        self.assertEqual((items[7].text, items[7].token), (b'c', Token.String))
+
+    def test_not_context_free(self):
+        # Quoted strings can hold spaces, digits and commas.
+        class QuotedLexer(CSVLexer):
+            tokendefs = dict(CSVLexer.tokendefs, root=[
+                (Token.String, b'"[^"]*"')] + CSVLexer.tokendefs['root'])
+
+        # A state that would pop on the class bytes instead of lexing them.
+        class PartialLexer(CSVLexer):
+            tokendefs = dict(CSVLexer.tokendefs, root=[
+                (Token.Name, b'x', 'name')] + CSVLexer.tokendefs['root'],
+                name=[(Token.Name, b'y')])
+
+        for lexer_cls in (QuotedLexer, PartialLexer):
+            self.assertRaises(
+                ConfigurationError, list, prescan(lexer_cls, b'1'))
+
+    def test_empty(self):
+        self.assertEqual(list(prescan(CSVLexer, b'')), [])
+
+    def test_text_input_rejected(self):
+        self.assertRaises(TypeError, list, prescan(CSVLexer, u'1,2'))
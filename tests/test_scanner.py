@@ -3,6 +3,7 @@ import unittest
 
 from rexlex import Lexer, ScannerLexer
 from rexlex.lexer.itemclass import get_itemclass
+from rexlex.lexer.exceptions import TokenBudgetExceeded
 
 
 class TestableLexer(Lexer):
@@ -55,3 +56,86 @@ class ScannerLexerTest(unittest.TestCase):
     def test(self):
         toks = list(TestableScannerLexer(self.text))
         self.assertEqual(toks, self.expected)
+
+    def test_token_budget(self):
+        scanner = TestableScannerLexer(self.text, max_tokens=10)
+        self.assertEqual(list(scanner), self.expected)
+        scanner = TestableScannerLexer(self.text, max_tokens=9)
+        self.assertRaises(TokenBudgetExceeded, list, scanner)
+
+
+class OtherLexer(Lexer):
+
+    LOGLEVEL = None
+
+    tokendefs = {
+        'root': [
+            ('Hash', '#'),
+            ('Num', r'\d+'),
+        ],
+        'word': [
+            ('At', '@'),
+            ('Word', '[a-z]+'),
+        ],
+    }
+
+
+class RoutingScannerLexer(ScannerLexer):
+    lexer = TestableLexer
+
+    def get_hooks(self):
+        yield 'a'
+        yield (r'#(\d)', OtherLexer)
+        yield (r'@', OtherLexer, 'word')
+        yield (r'#\d\d', TestableLexer)
+
+
+class HookRoutingTest(unittest.TestCase):
+    text = 'xabcde #12 @foo a'
+
+    def tokens(self, scanner):
+        return [[(item.start, item.end, item.token) for item in items]
+                for items in scanner]
+
+    def test_routing(self):
+        scanner = RoutingScannerLexer(self.text)
+        self.assertEqual(self.tokens(scanner), [
+            [(1, 2, 'Root'), (2, 3, 'Bar'), (3, 4, 'Bar'), (4, 5, 'Foo'),
+             (5, 6, 'Root')],
+            [(7, 8, 'Hash'), (8, 10, 'Num')],
+            [(11, 12, 'At'), (12, 15, 'Word')],
+            [(16, 17, 'Root')],
+        ])
+
+    def test_matches_like_separate_passes(self):
+        scanner = RoutingScannerLexer(self.text + ' abab #1234')
+        combined = [(m.span(), hook) for m, hook in scanner.iter_hits()]
+        separate = [(m.span(), hook)
+                    for m, hook in scanner._iter_hits_separately()]
+        self.assertEqual(combined, separate)
+        # Both '#' hooks hit at 7, in the order they're listed.
+        self.assertEqual([span for span, _ in combined[1:3]],
+                         [(7, 9), (7, 10)])
+
+    def test_same_position(self):
+        class FallbackScanner(ScannerLexer):
+            lexer = TestableLexer
+
+            def get_hooks(self):
+                # '#' lexes to nothing in 'word', so the next hook gets it.
+                yield (r'#', OtherLexer, 'word')
+                yield (r'#\d+', OtherLexer)
+
+        scanner = FallbackScanner('x #12 y')
+        self.assertEqual(self.tokens(scanner),
+                         [[(2, 3, 'Hash'), (3, 5, 'Num')]])
+
+    def test_backreferences_fall_back(self):
+        class BackrefScanner(ScannerLexer):
+            lexer = TestableLexer
+            hooks = [r'(x)\1a', ('a', OtherLexer)]
+
+        scanner = BackrefScanner('xxabcde')
+        self.assertEqual(
+            [(m.start(), hook.lexer) for m, hook in scanner.iter_hits()],
+            [(0, None), (2, OtherLexer)])
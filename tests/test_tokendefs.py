@@ -0,0 +1,169 @@
+import re
+import unittest
+
+from rexlex import Lexer, Token, include, words
+from rexlex.lexer.exceptions import ConfigurationError
+from rexlex.lexer.matchers import LiteralMatcher
+from rexlex.lexer.pool import CompilePool
+
+
+class LiteralLexer(Lexer):
+
+    re_skip = re.compile(r'\s+')
+    tokendefs = {
+        'root': [
+            ('Arrow', '=>'),
+            ('Paren', r'\('),
+            ('Paren', r'\)'),
+            ('And', 'and'),
+            ('Name', r'\w+'),
+            ('Newline', r'\n'),
+        ],
+    }
+
+
+class RegexOnlyLexer(LiteralLexer):
+    matchers = ()
+
+
+class LiteralMatcherTest(unittest.TestCase):
+
+    def test_detects_literals(self):
+        self.assertEqual(LiteralMatcher.from_pattern('=>').literal, '=>')
+        self.assertEqual(LiteralMatcher.from_pattern(r'\(\.').literal, '(.')
+        self.assertEqual(LiteralMatcher.from_pattern(r'a\nb').literal, 'a\nb')
+
+    def test_rejects_regexes(self):
+        for pattern in ('', 'a+', '[ab]', r'\w', 'a|b', '(a)', r'\b', 'a.'):
+            self.assertIsNone(LiteralMatcher.from_pattern(pattern))
+        self.assertIsNone(LiteralMatcher.from_pattern('and', re.I))
+
+    def test_match(self):
+        matcher = LiteralMatcher.from_pattern('=>')
+        self.assertIsNone(matcher.match('a =>', 0))
+        m = matcher.match('a =>', 2)
+        self.assertEqual(m.span(), (2, 4))
+        self.assertEqual(m.group(), '=>')
+        self.assertEqual(m.groups(), ())
+
+    def test_compiled_rules(self):
+        rgxs = [rule.rgxs[0] for rule in LiteralLexer._tokendefs['root']]
+        types = [type(rgx) for rgx in rgxs]
+        self.assertEqual(types[:4], [LiteralMatcher] * 4)
+        self.assertNotIsInstance(rgxs[4], LiteralMatcher)
+
+    def test_same_tokens_as_regex(self):
+        text = 'android and (x => y)\n'
+        self.assertEqual(
+            list(LiteralLexer(text)), list(RegexOnlyLexer(text)))
+
+
+class WordsLexer(Lexer):
+
+    re_skip = re.compile(r'\s+')
+    tokendefs = {
+        'root': [
+            (Token.Keyword, words(['if', 'else', 'while'])),
+            (None, words({'int': Token.Type, 'str': Token.Type,
+                          'None': Token.Constant})),
+            (Token.Name, r'\w+'),
+            (Token.Punctuation, '[();]'),
+        ],
+    }
+
+
+class WordsTest(unittest.TestCase):
+
+    def test_words(self):
+        text = 'if (iffy) int x; else None'
+        toks = [(item.text, item.token) for item in WordsLexer(text)]
+        self.assertEqual(toks, [
+            ('if', Token.Keyword),
+            ('(', Token.Punctuation),
+            ('iffy', Token.Name),
+            (')', Token.Punctuation),
+            ('int', Token.Type),
+            ('x', Token.Name),
+            (';', Token.Punctuation),
+            ('else', Token.Keyword),
+            ('None', Token.Constant)])
+
+    def test_word_must_match_pattern(self):
+        class BadLexer(Lexer):
+            tokendefs = {'root': [(Token.Operator, words(['<=', 'and']))]}
+        self.assertRaises(ConfigurationError, lambda: BadLexer._tokendefs)
+
+
+_test_pool = CompilePool()
+
+
+class PooledBase(Lexer):
+    compile_pool = _test_pool
+    tokendefs = {
+        'root': [
+            include('common'),
+            ('Name', r'\w+'),
+        ],
+        'common': [
+            ('Space', r'\s+'),
+            ('Keyword', words(['if', 'else'])),
+        ],
+    }
+
+
+class PooledA(PooledBase):
+    pass
+
+
+class PooledB(PooledBase):
+    tokendefs = {
+        'root': [
+            include('common'),
+            ('Number', r'\d+'),
+            ('Name', r'\w+'),
+        ],
+        'common': [
+            ('Space', r'\s+'),
+            ('Keyword', words(['if', 'else'])),
+        ],
+    }
+
+
+class Unpooled(PooledBase):
+    compile_pool = None
+
+
+class CompilePoolTest(unittest.TestCase):
+
+    def test_shared_states_and_patterns(self):
+        _test_pool.clear()
+        self.assertIs(PooledA._tokendefs['common'],
+                      PooledB._tokendefs['common'])
+        self.assertIsNot(PooledA._tokendefs['root'],
+                         PooledB._tokendefs['root'])
+        # Patterns are shared across different states too.
+        self.assertIs(PooledA._tokendefs['root'][-1].rgxs[0],
+                      PooledB._tokendefs['root'][-1].rgxs[0])
+        self.assertIsNot(Unpooled._tokendefs['common'],
+                         PooledA._tokendefs['common'])
+        self.assertEqual(list(PooledA('if 12 x')), list(Unpooled('if 12 x')))
+
+        stats = _test_pool.stats()
+        self.assertEqual(stats['states'], 3)
+        self.assertEqual(stats['state_hits'], 1)
+        self.assertEqual(stats['patterns'], 4)
+        self.assertTrue(stats['pattern_hits'])
+        self.assertTrue(stats['saved_bytes'])
+
+    def test_matchers_are_part_of_the_key(self):
+        class Literal(Lexer):
+            compile_pool = _test_pool
+            tokendefs = {'root': [('Arrow', '=>')]}
+
+        class Regex(Literal):
+            matchers = ()
+
+        self.assertIsInstance(Literal._tokendefs['root'][0].rgxs[0],
+                              LiteralMatcher)
+        self.assertNotIsInstance(Regex._tokendefs['root'][0].rgxs[0],
+                                 LiteralMatcher)
@@ -0,0 +1,218 @@
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+from rexlex import Lexer, Token
+from rexlex.tokenstream import (
+    dump_tokens, dumps_tokens, load_tokens, loads_tokens, FormatError,
+    LexCache, TokenIndex, dump_index, load_index, loads_index)
+from rexlex.lexer.filters import Drop, Lookahead
+
+
+class StreamLexer(Lexer):
+
+    re_skip = re.compile(r'\s+')
+    tokendefs = {
+        'root': [
+            (Token.Name, r'\w+'),
+            ('Open', r'\(', 'paren'),
+        ],
+        'paren': [
+            (Token.Number, r'\d+'),
+            ('Open', r'\(', 'paren'),
+            ('Close', r'\)', None, True),
+        ],
+    }
+
+
+class BinaryFormatTest(unittest.TestCase):
+    text = 'foo (1 (2 3) 4) bar baz (5)' * 20
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'tokens.rxtk')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def expected(self):
+        return [tuple(item) for item in StreamLexer(self.text)]
+
+    def test_roundtrip(self):
+        tokens = loads_tokens(
+            dumps_tokens(StreamLexer(self.text), block_size=16))
+        self.assertEqual(list(tokens), self.expected())
+        self.assertEqual(list(tokens.items(self.text)),
+                         list(StreamLexer(self.text)))
+
+    def test_random_access_from_mmap(self):
+        with open(self.path, 'wb') as f:
+            count = dump_tokens(StreamLexer(self.text), f, block_size=16)
+        expected = self.expected()
+        self.assertEqual(count, len(expected))
+        with load_tokens(self.path) as tokens:
+            self.assertEqual(len(tokens), len(expected))
+            for i in (len(expected) - 1, 0, 17, 16, 15, 100, -1):
+                self.assertEqual(tokens[i], expected[i])
+            self.assertEqual(tokens[10:40:7], expected[10:40:7])
+            self.assertRaises(IndexError, tokens.__getitem__, len(expected))
+
+    def test_statestacks(self):
+        data = dumps_tokens(
+            StreamLexer(self.text), statestacks=True, block_size=4)
+        tokens = loads_tokens(data)
+        index, statestack = tokens.statestack_at(10)
+        self.assertEqual(index, 8)
+        lexer = StreamLexer(
+            self.text, pos=tokens[index][0], statestack=statestack)
+        self.assertEqual(
+            [tuple(item) for item in lexer], self.expected()[index:])
+
+    def test_bad_file(self):
+        self.assertRaises(FormatError, loads_tokens, b'not a token file')
+        data = dumps_tokens(StreamLexer(self.text))
+        self.assertRaises(FormatError, loads_tokens, data[:-3])
+
+    def test_empty_file(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            self.assertRaises(FormatError, load_tokens, path)
+        finally:
+            os.remove(path)
+
+
+class TokenIndexTest(unittest.TestCase):
+    text = 'foo (1 (2 3) 4) bar baz (5)' * 20
+
+    def setUp(self):
+        self.tokens = [tuple(item) for item in StreamLexer(self.text)]
+
+    def scan(self, tokentype, start, end):
+        return [(s, e, t, i) for i, (s, e, t) in enumerate(self.tokens)
+                if (t == tokentype or (
+                    isinstance(tokentype, type(Token)) and t in tokentype))
+                and start <= s and e <= end]
+
+    def check(self, index):
+        for tokentype in (Token.Name, Token.Number, Token, 'Open'):
+            for start, end in ((0, len(self.text)), (13, 100), (50, 51)):
+                expected = self.scan(tokentype, start, end)
+                self.assertEqual(
+                    index.find(tokentype, start, end), expected)
+                self.assertEqual(
+                    index.count(tokentype, start, end), len(expected))
+        counts = index.counts(0, 27)
+        self.assertEqual(counts, {
+            Token.Name: 3, Token.Number: 5, 'Open': 3, 'Close': 3})
+
+    def test_queries(self):
+        index = TokenIndex.from_tokens(self.tokens)
+        self.check(index)
+        self.assertEqual(index.count(Token, subtypes=False), 0)
+        self.assertEqual(index.count(Token.Name.Builtin), 0)
+
+    def test_serialization(self):
+        index = loads_index(TokenIndex.from_tokens(self.tokens).dumps())
+        self.check(index)
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'tokens.rxti')
+            with open(path, 'wb') as f:
+                dump_index(loads_tokens(dumps_tokens(self.tokens)), f)
+            with load_index(path) as index:
+                self.check(index)
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertRaises(FormatError, loads_index, b'RXTK\x01')
+
+    def test_empty_file(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            self.assertRaises(FormatError, load_index, path)
+        finally:
+            os.remove(path)
+
+
+class OtherLexer(StreamLexer):
+    dont_emit = ['Open']
+
+
+class LexCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_hits_and_misses(self):
+        cache = LexCache()
+        text = 'foo (1 2) bar'
+        first = cache.lex(StreamLexer, text)
+        second = cache.lex(StreamLexer, text)
+        self.assertEqual(first, list(StreamLexer(text)))
+        self.assertEqual(second, first)
+        self.assertEqual(cache.lex(OtherLexer, text), list(OtherLexer(text)))
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 2))
+        self.assertEqual(stats['entries'], 2)
+
+    def test_lru_eviction(self):
+        cache = LexCache(max_bytes=200)
+        texts = ['foo %d (%d)' % (i, i) * 3 for i in range(10)]
+        for text in texts:
+            cache.lex(StreamLexer, text)
+        stats = cache.stats()
+        self.assertLessEqual(stats['bytes'], 200)
+        self.assertTrue(stats['evictions'])
+        cache.lex(StreamLexer, texts[-1])
+        self.assertEqual(cache.stats()['hits'], 1)
+
+    def test_disk_tier(self):
+        text = 'foo (1 (2)) bar'
+        LexCache(directory=self.tmpdir).lex(StreamLexer, text)
+        cache = LexCache(directory=self.tmpdir)
+        self.assertEqual(cache.lex(StreamLexer, text), list(StreamLexer(text)))
+        self.assertEqual(cache.stats()['disk_hits'], 1)
+
+    def test_disk_eviction(self):
+        cache = LexCache(directory=self.tmpdir, max_disk_bytes=300)
+        for i in range(10):
+            cache.lex(StreamLexer, 'foo %d (%d)' % (i, i) * 3)
+        self.assertLessEqual(cache.stats()['disk_bytes'], 300)
+        self.assertTrue(cache.stats()['disk_evictions'])
+
+    def test_output_settings_in_key(self):
+        class FilteredLexer(StreamLexer):
+            filters = (Drop(Token.Number),)
+
+        class RecoveringLexer(StreamLexer):
+            recover = True
+
+        class OtherRecoveringLexer(StreamLexer):
+            recover = True
+            error_token = Token.Other
+
+        cache = LexCache()
+        text = 'foo (1 2) ? bar'
+        lexers = [StreamLexer, FilteredLexer, RecoveringLexer,
+                  OtherRecoveringLexer]
+        for lexer_cls in lexers:
+            cached = cache.lex(lexer_cls, text)
+            self.assertEqual([tuple(item) for item in cached],
+                             [tuple(item) for item in lexer_cls(text)])
+        self.assertEqual(len(set(cache.key(lexer_cls, text)
+                                 for lexer_cls in lexers)), 4)
+        self.assertEqual(cache.stats()['hits'], 0)
+
+    def test_key_stable_for_filters(self):
+        def make():
+            return type('FilteredLexer', (StreamLexer,), {
+                'filters': (Drop(Token.Number), Lookahead(lambda t, f: [t]))})
+
+        cache = LexCache()
+        self.assertEqual(cache.key(make(), 'a'), cache.key(make(), 'a'))
@@ -0,0 +1,120 @@
+import gc
+import unittest
+
+import rexlex
+from rexlex import Lexer, ScannerLexer
+from rexlex.warmup import all_lexer_classes
+
+
+class WarmLexer(Lexer):
+    tokendefs = {
+        'root': [
+            ('A', 'a'),
+            ('B', 'b+'),
+        ],
+    }
+
+
+class WarmScanner(ScannerLexer):
+    lexer = WarmLexer
+
+    def get_hooks(self):
+        yield 'a'
+
+
+class WarmSubScanner(WarmScanner):
+
+    def get_hooks(self):
+        yield 'b+'
+
+
+class DeclaredScanner(ScannerLexer):
+    lexer = WarmLexer
+    hooks = ['a']
+
+
+class InstanceScanner(ScannerLexer):
+    lexer = WarmLexer
+
+    def get_hooks(self):
+        # Hooks that depend on the instance.
+        yield self.text.split()[0]
+
+
+class BrokenLexer(Lexer):
+    tokendefs = {
+        'root': [
+            ('A', 'a', 'nope'),
+        ],
+    }
+
+
+class WarmupTest(unittest.TestCase):
+
+    def test_warmup(self):
+        report = rexlex.warmup(
+            [WarmLexer, WarmScanner, DeclaredScanner, BrokenLexer],
+            freeze=False)
+        self.assertFalse(report.frozen)
+        self.assertIn('_cached__statetable', WarmLexer.__dict__)
+        self.assertIn('_cached__state_resyncs', WarmLexer.__dict__)
+        self.assertEqual([hook.regex.pattern
+                          for hook in DeclaredScanner._compiled_hooks], ['a'])
+        self.assertIs(DeclaredScanner('xabx').hooks,
+                      DeclaredScanner._compiled_hooks)
+        self.assertEqual([cls for cls, exc in report.errors], [BrokenLexer])
+        self.assertIn('4 classes', str(report))
+        self.assertEqual(len(list(WarmScanner('xabx'))), 1)
+        self.assertEqual(len(list(DeclaredScanner('xabx'))), 1)
+
+    def test_instance_hooks(self):
+        # get_hooks isn't run without an instance, and still runs for
+        # each instance after precompile.
+        report = rexlex.warmup([InstanceScanner], freeze=False)
+        self.assertEqual(report.errors, [])
+        self.assertIsNone(InstanceScanner._compiled_hooks)
+        for text in ('a b', 'b a'):
+            self.assertEqual(
+                [hook.regex.pattern for hook in InstanceScanner(text).hooks],
+                [text[0]])
+
+    def test_subclass_hooks(self):
+        # Warming the parent doesn't hand its hooks to subclasses.
+        rexlex.warmup([WarmScanner], freeze=False)
+        self.assertEqual(
+            [hook.regex.pattern for hook in WarmSubScanner('ab').hooks],
+            ['b+'])
+        rexlex.warmup([WarmSubScanner], freeze=False)
+        self.assertEqual(
+            [hook.regex.pattern for hook in WarmSubScanner('ab').hooks],
+            ['b+'])
+        self.assertEqual(
+            [hook.regex.pattern for hook in WarmScanner('ab').hooks], ['a'])
+
+    def test_subclass_compiled_attrs(self):
+        WarmLexer.precompile()
+        lexer = WarmLexer('ab')
+        self.assertIs(lexer._states, WarmLexer._states)
+        # Later reads on the instance skip the descriptor.
+        self.assertIs(vars(lexer)['_states'], WarmLexer._states)
+
+        class SubLexer(WarmLexer):
+            tokendefs = {'root': [('C', 'c')]}
+
+        self.assertEqual(list(SubLexer('c')), [(0, 1, 'C')])
+        self.assertIsNot(SubLexer('c')._states, WarmLexer._states)
+
+    def test_all_subclasses(self):
+        classes = all_lexer_classes()
+        self.assertIn(WarmLexer, classes)
+        self.assertIn(WarmScanner, classes)
+        self.assertNotIn(Lexer, classes)
+
+    @unittest.skipUnless(hasattr(gc, 'freeze'), 'needs gc.freeze')
+    def test_freeze(self):
+        try:
+            report = rexlex.warmup([WarmLexer])
+            self.assertTrue(report.frozen)
+            self.assertTrue(gc.get_freeze_count())
+        finally:
+            gc.unfreeze()